@@ -5,7 +5,7 @@ class Env:
     def __init__(self):
         # 根据操作系统，设置运行时文件路径
         # Windows在 $User\AppData\Local\.musictoolbox 中
-        # Linux在 /etc/.musictoolbox 中
+        # Linux在 /etc/.musictoolbox 中，没有写权限时在 ~/.local/share/musictoolbox 中
         self.runtime_path = self.set_runtime_path()
 
     @staticmethod
@@ -16,27 +16,57 @@ class Env:
             return runtime_path
         elif os.name == 'posix':  # Linux
             runtime_path = '/etc/.musictoolbox'
+            try:
+                os.makedirs(runtime_path, exist_ok=True)
+                if os.access(runtime_path, os.W_OK | os.X_OK):
+                    return runtime_path
+            except OSError:
+                pass
+            # 非 root 用户没有 /etc 的写权限，改用 $XDG_DATA_HOME/musictoolbox（默认为 ~/.local/share/musictoolbox）
+            data_home = os.getenv('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+            runtime_path = os.path.join(data_home, 'musictoolbox')
             os.makedirs(runtime_path, exist_ok=True)
             return runtime_path
         else:
             raise EnvironmentError("Unsupported operating system")
 
 
+def runtime_dir(name):
+    """
+    运行时目录属性：首次读取时才创建目录，也可以直接赋值改用其他目录
+    """
+    def getter(self):
+        if name not in self._paths:
+            path = os.path.join(self.runtime_path, name)
+            os.makedirs(path, exist_ok=True)
+            self._paths[name] = path
+        return self._paths[name]
+
+    def setter(self, value):
+        self._paths[name] = value
+
+    return property(getter, setter)
+
+
 class G:
+    # 根据Env类生成各种文件路径；目录在首次使用时创建，不需要缓存和配置的命令不会访问运行时目录
+    cache_path = runtime_dir("cache")
+    config_path = runtime_dir("config")
+    tool_path = runtime_dir("sw")
+    source_path = runtime_dir("source")
+
     def __init__(self):
-        env = Env()
-        # 根据Env类生成各种文件路径
-        self.cache_path = os.path.join(env.runtime_path, "cache")
-        os.makedirs(self.cache_path, exist_ok=True)
-        self.config_path = os.path.join(env.runtime_path, "config")
-        os.makedirs(self.config_path, exist_ok=True)
-        self.tool_path = os.path.join(env.runtime_path, "sw")
-        os.makedirs(self.tool_path, exist_ok=True)
-        self.source_path = os.path.join(env.runtime_path, "source")
-        os.makedirs(self.source_path, exist_ok=True)
+        self._env = None
+        self._paths = {}
 
         self.ffmpeg = "ffmpeg"
 
+    @property
+    def runtime_path(self):
+        if self._env is None:
+            self._env = Env()
+        return self._env.runtime_path
+
 
 class Color:
     def __init__(self):
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+
+from runtime import VAL
+from runtime.metrics import METRICS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, path)
+)
+"""
+
+
+class StatCache:
+    """
+    以 (路径, 大小, 修改时间, inode) 为键的持久化缓存，存放于 VAL.cache_path 下的 SQLite 数据库
+
+    文件被修改或替换后，大小、修改时间或 inode 随之变化，旧的缓存值自动失效。
+    启动时一次性读入当前 kind 的全部条目，之后每个文件的查询只需一次 stat()；
+    新写入的条目先暂存在内存中，积累到 batch_size 条后在一个事务内批量写入。
+
+    参数:
+        kind (str): 缓存类别，不同类别的值互不干扰，例如不同的哈希方式
+        db_name (str): 数据库文件名，默认为 cache.db
+        batch_size (int): 批量写入的条目数，默认为500
+    """
+
+    def __init__(self, kind, db_name="cache.db", batch_size=500):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.db_path = os.path.join(VAL.cache_path, db_name)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+        rows = self._conn.execute("SELECT path, size, mtime_ns, inode, value FROM entries WHERE kind = ?",
+                                  (kind,))
+        self.entries = {row[0]: row[1:] for row in rows}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def stat_key(st):
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, path, st=None):
+        """
+        读取缓存值，文件状态与缓存时不一致则视为未命中
+
+        参数:
+            path (str): 文件路径
+            st (os.stat_result): 文件状态，留空则现场 stat
+
+        返回:
+            str | None: 缓存值
+        """
+        entry = self.entries.get(path)
+        if entry is not None and st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                entry = None
+        if entry is None or entry[:3] != self.stat_key(st):
+            METRICS.count("cache_misses", kind=self.kind)
+            return None
+        METRICS.count("cache_hits", kind=self.kind)
+        return entry[3]
+
+    def put(self, path, value, st=None):
+        """
+        写入缓存值
+
+        参数:
+            path (str): 文件路径
+            value (str): 缓存值
+            st (os.stat_result): 计算缓存值时的文件状态，留空则现场 stat
+        """
+        if st is None:
+            st = os.stat(path)
+        key = self.stat_key(st)
+        with self._lock:
+            self.entries[path] = (*key, value)
+            self._pending.append((self.kind, path, *key, value))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with METRICS.timer("cache_save", kind=self.kind), self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (kind, path, size, mtime_ns, inode, value) VALUES (?, ?, ?, ?, ?, ?)",
+                self._pending)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._conn.close()
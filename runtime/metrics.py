@@ -0,0 +1,258 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+import contextlib
+import collections
+
+from runtime import VAL
+
+# 各工具统一通过 METRICS 记录阶段耗时和计数，运行结束时输出汇总，按需写入 JSON 文件和 Prometheus 文本文件
+PREFIX = "mtoolbox"
+# 采样分析的默认间隔（秒）
+SAMPLE_INTERVAL = 0.005
+# 通过环境变量为交互菜单开启性能分析，取值为 cprofile 或 sample
+PROFILE_ENV = "MTOOLBOX_PROFILE"
+# 通过环境变量指定指标文件目录；未指定且未开启性能分析时只输出汇总，不写文件
+METRICS_DIR_ENV = "MTOOLBOX_METRICS_DIR"
+
+
+def metric_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def prometheus_name(name):
+    return f"{PREFIX}_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def prometheus_labels(labels):
+    if not labels:
+        return ""
+
+    def escape(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+class Sampler:
+    """
+    采样分析：后台线程定期记录所有线程的调用栈，输出 flamegraph.pl / speedscope 可读的折叠栈格式
+
+    与 cProfile 不同，采样对被测代码几乎没有额外开销，也能看到线程池中工作线程的耗时
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="metrics-sampler")
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Metrics:
+    """
+    线程安全的计时器和计数器
+
+    计时器记录调用次数和累计耗时，计数器记录累计值，二者都可以带标签，例如
+    METRICS.count("cache_hits", kind="md5")。多线程并行的阶段，计时器的累计耗时是各线程耗时之和，
+    可能超过运行的总时长。在子进程中记录的数据不会汇总到主进程，需要在主进程中按结果计数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.started = None
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+            self.started = time.time()
+
+    def count(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_time(self, name, seconds, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            calls, total = self.timers.get(key, (0, 0.0))
+            self.timers[key] = (calls + 1, total + seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """
+        返回:
+            dict: {"started", "counters": {名称: 值}, "timers": {名称: {"calls", "seconds"}}}，
+            带标签的名称形如 cache_hits{kind=md5}
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "counters": {format_key(key): value for key, value in sorted(self.counters.items())},
+                "timers": {format_key(key): {"calls": calls, "seconds": seconds}
+                           for key, (calls, seconds) in sorted(self.timers.items())},
+            }
+
+    def summary(self, stream=None):
+        """
+        输出各阶段耗时和计数的汇总表，默认写到标准错误输出
+        """
+        stream = stream or sys.stderr
+        snapshot = self.snapshot()
+        if snapshot["timers"]:
+            print(f"{'阶段':<40} {'次数':>8} {'耗时(s)':>10}", file=stream)
+            for name, timer in snapshot["timers"].items():
+                print(f"{name:<40} {timer['calls']:>8} {timer['seconds']:>10.3f}", file=stream)
+        if snapshot["counters"]:
+            print(f"{'计数':<40} {'值':>19}", file=stream)
+            for name, value in snapshot["counters"].items():
+                print(f"{name:<40} {value:>19}", file=stream)
+
+    def write_json(self, path):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def prometheus(self):
+        """
+        返回 Prometheus 文本格式的指标，可由 node_exporter 的 textfile collector 采集
+
+        计数器输出为 mtoolbox_<名称>_total，计时器输出为 mtoolbox_stage_seconds_total 和
+        mtoolbox_stage_calls_total，以 stage 标签区分阶段
+        """
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        lines = []
+        by_name = collections.defaultdict(list)
+        for (name, labels), value in counters:
+            by_name[name].append((labels, value))
+        for name, values in by_name.items():
+            metric = prometheus_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{prometheus_labels(labels)} {value}" for labels, value in values)
+        if timers:
+            for suffix, index in (("seconds_total", 1), ("calls_total", 0)):
+                metric = f"{PREFIX}_stage_{suffix}"
+                lines.append(f"# TYPE {metric} counter")
+                for (name, labels), values in timers:
+                    lines.append(f"{metric}{prometheus_labels((('stage', name),) + labels)} {values[index]}")
+        if self.started is not None:
+            lines.append(f"# TYPE {PREFIX}_run_start_timestamp_seconds gauge")
+            lines.append(f"{PREFIX}_run_start_timestamp_seconds {self.started}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+    @contextlib.contextmanager
+    def run(self, name, output_dir=None, profile=None, summary=True):
+        """
+        记录一次完整的运行：清空之前的数据，结束时输出汇总；指定了指标文件目录或开启了性能分析时，
+        还会写入 <name>.json 和 <name>.prom。写入失败只输出警告，不影响运行结果
+
+        参数:
+            name (str): 运行名称，用作文件名
+            output_dir (str): 指标文件目录，留空则读取环境变量 MTOOLBOX_METRICS_DIR；仍为空时，
+                开启性能分析则写到 VAL.cache_path/metrics，否则不写文件
+            profile (str): 性能分析方式，cprofile 写入 <name>.prof（可用 snakeviz 等查看），
+                sample 写入 <name>.folded 折叠栈；留空则读取环境变量 MTOOLBOX_PROFILE，仍为空时不分析
+            summary (bool): 结束时是否输出汇总表
+        """
+        profile = profile or os.environ.get(PROFILE_ENV) or None
+        if profile not in (None, "cprofile", "sample"):
+            raise ValueError(f"不支持的性能分析方式：{profile}")
+        output_dir = output_dir or os.environ.get(METRICS_DIR_ENV) or None
+        self.reset()
+        profiler = None
+        if profile == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif profile == "sample":
+            profiler = Sampler()
+            profiler.start()
+        try:
+            with self.timer("run"):
+                yield self
+        finally:
+            if profile == "cprofile":
+                profiler.disable()
+            elif profile == "sample":
+                profiler.stop()
+            if summary:
+                self.summary()
+            if output_dir or profile:
+                try:
+                    base = self.write_files(name, output_dir or os.path.join(VAL.cache_path, "metrics"), profiler)
+                except OSError as e:
+                    print(f"警告：指标文件写入失败：{e}", file=sys.stderr)
+                else:
+                    if summary:
+                        print(f"指标已写入 {base}.json / {base}.prom", file=sys.stderr)
+
+    def write_files(self, name, output_dir, profiler=None):
+        """
+        将指标和性能分析结果写入 output_dir
+
+        返回:
+            str: 不含扩展名的文件路径
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, name)
+        if isinstance(profiler, Sampler):
+            profiler.dump(base + ".folded")
+        elif profiler is not None:
+            profiler.dump_stats(base + ".prof")
+        self.write_json(base + ".json")
+        self.write_prometheus(base + ".prom")
+        return base
+
+
+METRICS = Metrics()
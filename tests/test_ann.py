@@ -0,0 +1,27 @@
+import numpy as np
+
+from tools.sim import ann
+
+
+def library(n=40, dims=120, seed=0):
+    # 不相关的向量叠加一个很大的公共偏移，未标准化时两两余弦相似度都接近1，与 MFCC 汇聚向量的情况相同
+    rng = np.random.default_rng(seed)
+    scale = rng.uniform(0.1, 10, dims)
+    return rng.standard_normal((n, dims)) * scale + 100 * scale
+
+
+def test_unrelated_vectors_do_not_cluster():
+    matrix = library()
+    unit = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    assert (unit @ unit.T).min() > 0.9
+    clusters = ann.ann_clusters(matrix)
+    assert sorted(len(cluster) for cluster in clusters) == [1] * len(matrix)
+
+
+def test_near_duplicates_cluster():
+    matrix = library()
+    rng = np.random.default_rng(1)
+    copies = matrix[:5] + rng.standard_normal((5, matrix.shape[1])) * 0.01 * matrix.std(axis=0)
+    clusters = ann.ann_clusters(np.vstack([matrix, copies, matrix[5:6]]))
+    pairs = sorted(sorted(cluster) for cluster in clusters if len(cluster) > 1)
+    assert pairs == [[0, 40], [1, 41], [2, 42], [3, 43], [4, 44], [5, 45]]
@@ -1,35 +1,270 @@
+import os
+import sys
+import json
+import argparse
+import contextlib
+
 from runtime import COLOR as color
-from tools import check_ffmpeg
-from tools import sim
-from tools import wav2flac
+from runtime.metrics import METRICS
 
 MENU = """
 ------菜单------
 1. 检查FFMpeg安装状态
 2. 音乐去重（哈希）
-3. 音乐AI去重（暂不可用）
+3. 音乐AI去重
 4. 音频自动转换为FLAC
+5. 音乐声纹去重（识别转码）
+6. 批量生成频谱图
 ------END------
 """
 
+# 退出码：0 全部成功，1 部分文件处理失败，2 参数或环境错误
+EXIT_PARTIAL = 1
+EXIT_ERROR = 2
 
-def main():
+
+# 菜单编号对应的指标文件名，与子命令名称一致
+MENU_RUNS = {
+    "1": "check-ffmpeg",
+    "2": "hash-dedup",
+    "3": "ai-dedup",
+    "4": "transcode",
+    "5": "fingerprint-dedup",
+    "6": "spectrogram",
+}
+
+
+def interactive():
     print(color.cyan, MENU, color.end)
     print("请输入指令对应的编号")
     command = input(">>")
+    if command not in MENU_RUNS:
+        print(f"{color.red}无效的命令{color.end}")
+        return
+    # 设置环境变量 MTOOLBOX_PROFILE=cprofile 或 sample 可开启性能分析，MTOOLBOX_METRICS_DIR 可写入指标文件
+    with METRICS.run(MENU_RUNS[command]):
+        run_menu(command)
 
+
+def run_menu(command):
+    # 各工具依赖的库较重，只导入选中的工具
     match command:
         case "1":
+            from tools import check_ffmpeg
             check_ffmpeg.main()
         case "2":
+            from tools import sim
             sim.main()
         case "3":
-            print(f"{color.yellow}鉴于依赖库Librosa还没支持Python3.12，")
-            print(f"因此我先摸鱼一会儿，此功能暂不可用{color.end}")
+            from tools import sim
+            sim.ai_main()
         case "4":
+            from tools import wav2flac
             wav2flac.main()
-        case _:
-            print(f"{color.red}无效的命令{color.end}")
+        case "5":
+            from tools import sim
+            sim.fingerprint_main()
+        case "6":
+            from tools import musicAnalyze
+            musicAnalyze.main()
+
+
+class CommandError(Exception):
+    pass
+
+
+def require_dir(path):
+    if not os.path.isdir(path):
+        raise CommandError(f"目录不存在：{path}")
+
+
+def require_ffmpeg(encoder=None):
+    from tools import check_ffmpeg
+    if not check_ffmpeg.is_ffmpeg_available():
+        raise CommandError("ffmpeg命令不可用")
+    if encoder and not check_ffmpeg.has_encoder(encoder):
+        raise CommandError(f"当前ffmpeg不支持{encoder}编码")
+
+
+# 每个子命令返回 (JSON文档, NDJSON记录列表, 是否有失败项)
+
+def cmd_hash_dedup(args):
+    require_dir(args.path)
+    require_ffmpeg()
+    from tools.sim import md5
+    clusters, failed = md5.find_duplicate_audio_files(args.path, workers=args.jobs, digest=args.digest,
+                                                      mode=args.mode)
+    records = [{"type": "cluster", "files": cluster} for cluster in clusters]
+    records += [{"type": "failed", "path": path} for path in failed]
+    return {"clusters": clusters, "failed": failed}, records, bool(failed)
+
+
+def cmd_ai_dedup(args):
+    require_dir(args.path)
+    require_ffmpeg()
+    from tools.sim import ai
+    jobs = args.jobs or os.cpu_count() or 1
+    clusters, failed, pairs = ai.main(args.path, threads=jobs, engine=args.engine)
+    if not args.no_verify:
+        from tools.sim import verify
+        clusters, _ = verify.verify_clusters(clusters, min_score=args.min_score, workers=jobs, edges=pairs)
+    records = [{"type": "cluster", "files": cluster} for cluster in clusters]
+    records += [{"type": "failed", "path": path} for path in failed]
+    return {"clusters": clusters, "failed": failed}, records, bool(failed)
+
+
+def cmd_transcode(args):
+    require_dir(args.input_dir)
+    require_ffmpeg("flac")
+    from tools import scanner
+    from tools.wav2flac.scheduler import Job, Scheduler, load_settings, output_path
+    output_dir = args.output_dir or args.input_dir
+    jobs = [Job(source, output_path(source, args.input_dir, output_dir))
+            for source in scanner.scan_files(args.input_dir, tuple(args.extensions))]
+    settings = load_settings()
+    if args.jobs:
+        settings["jobs"] = args.jobs
+    if args.level is not None:
+        settings["level"] = args.level
+    result = Scheduler(verify=args.verify, **settings).run(jobs)
+
+    status = {job: "converted" for job in result.converted}
+    status.update((job, "skipped") for job in result.skipped)
+    status.update((job, "failed") for job, _ in result.failed)
+    errors = dict(result.failed + result.mismatched)
+    verified = set(result.verified)
+    records = []
+    for job in jobs:
+        record = {"type": "job", "source": job.source, "output": job.output, "status": status.get(job)}
+        if args.verify and record["status"] != "failed":
+            record["verified"] = job in verified
+        if job in errors:
+            record["error"] = errors[job]
+        records.append(record)
+    document = {
+        "converted": [job.source for job in result.converted],
+        "skipped": [job.source for job in result.skipped],
+        "failed": [{"source": job.source, "error": error} for job, error in result.failed],
+        "verified": [job.source for job in result.verified],
+        "mismatched": [{"source": job.source, "error": error} for job, error in result.mismatched],
+    }
+    return document, records, bool(result.failed or result.mismatched)
+
+
+def cmd_spectrogram(args):
+    require_dir(args.input_dir)
+    require_ffmpeg()
+    from tools import musicAnalyze
+    rendered, cached, failed = musicAnalyze.batch_render(args.input_dir, args.output_dir, workers=args.jobs,
+                                                         width=args.width, height=args.height)
+    failed = [{"path": path, "error": error} for path, error in failed]
+    records = [{"type": "failed", **item} for item in failed]
+    records.append({"type": "summary", "rendered": rendered, "cached": cached, "failed": len(failed)})
+    return {"rendered": rendered, "cached": cached, "failed": failed}, records, bool(failed)
+
+
+def cmd_probe(args):
+    import concurrent.futures
+    from tools import probe
+    files = probe.expand_paths(args.paths)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) if args.jobs else None
+    try:
+        with probe.Prober(executor) as prober:
+            results = prober.probe_many(files)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    records = [{"type": "probe", "path": path, **(info or {"error": "文件不存在"})} for path, info in results.items()]
+    return results, records, any(info is None for info in results.values())
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-j", "--jobs", type=int, default=None, help="并行数，默认为CPU核心数")
+    common.add_argument("--format", choices=("json", "ndjson"), default="json",
+                        help="输出格式：json 输出一个文档，ndjson 每行输出一条记录")
+    common.add_argument("--metrics-dir", default=None,
+                        help="写入指标文件（<命令>.json、<命令>.prom）的目录，也可用环境变量 MTOOLBOX_METRICS_DIR 指定，"
+                             "默认不写入")
+    common.add_argument("--profile", choices=("cprofile", "sample"), default=None,
+                        help="开启性能分析，结果与指标文件写在同一目录，未指定目录时写到缓存目录下的 metrics")
+
+    parser = argparse.ArgumentParser(prog="toolbox", description="音乐工具箱，不带参数运行时进入交互菜单")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sub = subparsers.add_parser("hash-dedup", parents=[common], help="按音频数据哈希查找重复文件")
+    sub.add_argument("path")
+    sub.add_argument("--mode", default="ffmpeg", choices=("ffmpeg", "stream", "native", "streaminfo", "pcm"))
+    sub.add_argument("--digest", default="md5", choices=("md5", "blake2b", "xxh64"))
+    sub.set_defaults(func=cmd_hash_dedup)
+
+    sub = subparsers.add_parser("ai-dedup", parents=[common], help="按音频特征查找相似文件")
+    sub.add_argument("path")
+    sub.add_argument("--engine", default="ann", choices=("ann", "kmeans"))
+    sub.add_argument("--min-score", type=float, default=0.6, help="互相关验证的最低分数")
+    sub.add_argument("--no-verify", action="store_true", help="跳过互相关验证")
+    sub.set_defaults(func=cmd_ai_dedup)
+
+    sub = subparsers.add_parser("transcode", parents=[common], help="转换为FLAC")
+    sub.add_argument("input_dir")
+    sub.add_argument("--output-dir", default=None, help="输出目录，默认与源文件相同")
+    sub.add_argument("--level", type=int, default=None, help="压缩等级，默认使用性能测试保存的参数或8")
+    sub.add_argument("--verify", action="store_true", help="按 STREAMINFO 中的MD5校验转换结果")
+    sub.add_argument("--extensions", nargs="+", default=[".wav", ".wmv", ".aac"])
+    sub.set_defaults(func=cmd_transcode)
+
+    sub = subparsers.add_parser("spectrogram", parents=[common], help="批量生成频谱图")
+    sub.add_argument("input_dir")
+    sub.add_argument("--output-dir", default=None, help="输出目录，默认与音频文件相同")
+    sub.add_argument("--width", type=int, default=1600)
+    sub.add_argument("--height", type=int, default=512)
+    sub.set_defaults(func=cmd_spectrogram)
+
+    sub = subparsers.add_parser("probe", parents=[common], help="读取音频参数")
+    sub.add_argument("paths", nargs="+", help="文件或目录")
+    sub.set_defaults(func=cmd_probe)
+    return parser
+
+
+def write_result(document, records, output_format, stream):
+    if output_format == "ndjson":
+        for record in records:
+            stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+    else:
+        json.dump(document, stream, ensure_ascii=False, indent=2)
+        stream.write("\n")
+    stream.flush()
+
+
+def run(argv):
+    """
+    运行子命令，结果以 JSON/NDJSON 写到标准输出，进度和提示信息写到标准错误输出
+
+    返回:
+        int: 退出码
+    """
+    args = build_parser().parse_args(argv)
+    stdout = sys.stdout
+    try:
+        # 各工具用 print 输出的提示信息转到标准错误输出，保持标准输出可被程序解析
+        with contextlib.redirect_stdout(sys.stderr), \
+                METRICS.run(args.command, output_dir=args.metrics_dir, profile=args.profile):
+            document, records, partial = args.func(args)
+    except CommandError as e:
+        print(f"{color.red}{e}{color.end}", file=sys.stderr)
+        return EXIT_ERROR
+    except OSError as e:
+        # 运行时目录、缓存数据库无法创建或写入等环境问题
+        print(f"{color.red}{e}{color.end}", file=sys.stderr)
+        return EXIT_ERROR
+    write_result(document, records, args.format, stdout)
+    return EXIT_PARTIAL if partial else 0
+
+
+def main():
+    if len(sys.argv) > 1:
+        sys.exit(run(sys.argv[1:]))
+    interactive()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,359 @@
+import os
+import struct
+
+# MPEG 音频帧头查找表，按 [版本][层] 索引；版本 3 = MPEG1，2 = MPEG2，0 = MPEG2.5；层 3 = Layer I，1 = Layer III
+MPEG_BITRATES = {
+    (3, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (3, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (3, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 1): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+# 首帧中可能存放的 VBR 信息头，ffmpeg 解封装时会丢弃该帧
+VBR_TAGS = (b"Xing", b"Info", b"VBRI")
+
+
+def id3v2_size(header):
+    """
+    返回 ID3v2 标签的总长度，header 不是 ID3v2 标签头时返回0
+
+    参数:
+        header (bytes): 标签起始处的至少10个字节
+    """
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    # 带有 footer 的标签额外占用10字节
+    return 10 + size + (10 if header[5] & 0x10 else 0)
+
+
+def parse_mpeg_header(header):
+    """
+    解析 MPEG 音频帧头
+
+    参数:
+        header (bytes): 帧起始处的4个字节
+
+    返回:
+        tuple | None: (帧长度, 采样率, 声道数, 每帧采样数, 码率kbps)，不是合法帧头时返回 None
+    """
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = MPEG_BITRATES[(3 if version == 3 else 2, layer)][bitrate_index]
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    channels = 1 if (header[3] >> 6) == 3 else 2
+    if layer == 3:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    elif layer == 2 or version == 3:
+        samples = 1152
+        length = 144 * bitrate * 1000 // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate * 1000 // sample_rate + padding
+    return length, sample_rate, channels, samples, bitrate
+
+
+def trailing_tags_size(f, end):
+    """
+    返回文件末尾 ID3v1 / Lyrics3v2 / APEv2 标签的总长度
+
+    参数:
+        f (file): 以二进制方式打开的文件
+        end (int): 当前认定的数据结束位置
+    """
+    start_end = end
+    while True:
+        if end >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b"TAG":
+                end -= 128
+                continue
+        if end >= 15:
+            f.seek(end - 15)
+            tail = f.read(15)
+            if tail[6:] == b"LYRICS200" and tail[:6].isdigit():
+                end -= 15 + int(tail[:6])
+                continue
+        if end >= 32:
+            f.seek(end - 32)
+            footer = f.read(32)
+            if footer[:8] == b"APETAGEX":
+                size, _, flags = struct.unpack("<III", footer[12:24])
+                end -= size + (32 if flags & 0x80000000 else 0)
+                continue
+        return start_end - end
+
+
+def first_mpeg_frame(f, start, end):
+    """
+    从 start 起查找第一个 MPEG 音频帧，要求连续两个帧头均合法，避免把标签后的填充数据误判为帧头
+
+    返回:
+        tuple | None: (帧起始位置, parse_mpeg_header 的结果)
+    """
+    f.seek(start)
+    window = f.read(64 * 1024)
+    for offset in range(len(window) - 3):
+        frame = parse_mpeg_header(window[offset:offset + 4])
+        if frame is None:
+            continue
+        f.seek(start + offset + frame[0])
+        if start + offset + frame[0] == end or parse_mpeg_header(f.read(4)):
+            return start + offset, frame
+    return None
+
+
+def skip_id3v2(f):
+    start = 0
+    while True:
+        f.seek(start)
+        skip = id3v2_size(f.read(10))
+        if not skip:
+            return start
+        start += skip
+
+
+def mp3_payload_range(f, size):
+    """
+    计算 MP3 文件中音频帧数据的起止位置，跳过 ID3v2、VBR 信息帧以及末尾的各种标签
+    """
+    start = skip_id3v2(f)
+    end = size - trailing_tags_size(f, size)
+    found = first_mpeg_frame(f, start, end)
+    if found is None:
+        return None
+    start, frame = found
+
+    # ffmpeg 解封装时会丢弃首个 Xing/Info/VBRI 信息帧
+    f.seek(start)
+    first = f.read(min(frame[0], 64))
+    if any(tag in first for tag in VBR_TAGS):
+        start += frame[0]
+    return start, end
+
+
+def flac_payload_range(f, size):
+    """
+    计算 FLAC 文件中音频帧数据的起止位置，跳过前置 ID3v2 标签和全部 metadata 块
+    """
+    f.seek(0)
+    start = id3v2_size(f.read(10))
+    f.seek(start)
+    if f.read(4) != b"fLaC":
+        return None
+    start += 4
+    while True:
+        block_header = f.read(4)
+        if len(block_header) < 4:
+            return None
+        length = int.from_bytes(block_header[1:4], "big")
+        start += 4 + length
+        if block_header[0] & 0x80:
+            break
+        f.seek(start)
+    end = size - trailing_tags_size(f, size)
+    return start, end
+
+
+def audio_payload_range(path):
+    """
+    返回音频文件中音频数据（不含标签）的字节范围，目前支持 MP3 和 FLAC
+
+    参数:
+        path (str): 音频文件路径
+
+    返回:
+        tuple | None: (起始位置, 结束位置)，格式不支持或无法解析时返回 None
+    """
+    parsers = {
+        ".mp3": mp3_payload_range,
+        ".flac": flac_payload_range,
+    }
+    parser = parsers.get(os.path.splitext(path)[1].lower())
+    if parser is None:
+        return None
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        payload = parser(f, size)
+    if payload is None or payload[0] >= payload[1]:
+        return None
+    return payload
+
+
+def flac_streaminfo(path):
+    """
+    读取 FLAC 文件的 STREAMINFO 块
+
+    参数:
+        path (str): FLAC 文件路径
+
+    返回:
+        dict | None: 包含 sample_rate、channels、bits_per_sample、total_samples、md5 的字典，
+        md5 为编码器记录的解码后PCM数据的MD5，未记录时为 None；不是FLAC文件时返回 None
+    """
+    with open(path, "rb") as f:
+        start = id3v2_size(f.read(10))
+        f.seek(start)
+        header = f.read(4 + 4 + 34)
+    if len(header) < 42 or header[:4] != b"fLaC" or header[4] & 0x7F != 0:
+        return None
+    info = header[8:]
+    packed = int.from_bytes(info[10:18], "big")
+    md5 = info[18:34]
+    return {
+        "sample_rate": packed >> 44,
+        "channels": ((packed >> 41) & 0x07) + 1,
+        "bits_per_sample": ((packed >> 36) & 0x1F) + 1,
+        "total_samples": packed & 0xFFFFFFFFF,
+        "md5": md5.hex() if any(md5) else None,
+    }
+
+
+def wav_info(path):
+    """
+    读取 WAV 文件的 fmt 块和 data 块位置
+
+    参数:
+        path (str): WAV 文件路径
+
+    返回:
+        dict | None: 包含 format_tag、channels、sample_rate、bits_per_sample、block_align、
+        data_offset、data_size 的字典，format_tag 为1表示整数PCM、3表示浮点；不是WAV文件时返回 None
+
+    异常:
+        ValueError: 块头或 fmt 块被截断
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        info = {}
+        offset = 12
+        while offset + 8 <= size:
+            f.seek(offset)
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"WAV文件被截断：{path}")
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt " and chunk_size >= 16:
+                fmt = f.read(min(chunk_size, 40))
+                if len(fmt) < 16:
+                    raise ValueError(f"WAV文件的 fmt 块被截断：{path}")
+                format_tag, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+                # WAVE_FORMAT_EXTENSIBLE 的实际格式在子格式GUID的前两个字节中
+                if format_tag == 0xFFFE and len(fmt) >= 26:
+                    format_tag = struct.unpack("<H", fmt[24:26])[0]
+                info.update(format_tag=format_tag, channels=channels, sample_rate=sample_rate,
+                            bits_per_sample=bits, block_align=block_align)
+            elif chunk_id == b"data":
+                # 流式写入的WAV可能没有填写 data 块大小
+                info.update(data_offset=offset + 8, data_size=min(chunk_size, size - offset - 8))
+                break
+            offset += 8 + chunk_size + (chunk_size & 1)
+    if "format_tag" not in info or "data_offset" not in info:
+        return None
+    return info
+
+
+def vbr_frame_count(data):
+    """
+    从首帧中的 Xing/Info 或 VBRI 信息头读取总帧数（不含信息帧本身），没有信息头时返回 None
+    """
+    position = data.find(b"Xing")
+    if position < 0:
+        position = data.find(b"Info")
+    if position >= 0 and len(data) >= position + 12:
+        flags = int.from_bytes(data[position + 4:position + 8], "big")
+        if flags & 0x01:
+            return int.from_bytes(data[position + 8:position + 12], "big")
+        return None
+    position = data.find(b"VBRI")
+    if position >= 0 and len(data) >= position + 18:
+        return int.from_bytes(data[position + 14:position + 18], "big")
+    return None
+
+
+def mp3_info(path):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start = skip_id3v2(f)
+        end = size - trailing_tags_size(f, size)
+        found = first_mpeg_frame(f, start, end)
+        if found is None:
+            return None
+        start, (length, sample_rate, channels, samples, bitrate) = found
+        f.seek(start)
+        first = f.read(min(length, 256))
+    frames = vbr_frame_count(first)
+    if frames is not None:
+        # VBR：按信息头中的帧数计算时长，码率取平均值
+        duration = frames * samples / sample_rate
+        bitrate = round((end - start - length) * 8 / duration / 1000) if duration else bitrate
+    else:
+        duration = (end - start) * 8 / (bitrate * 1000)
+    return {"codec": "mp3", "sample_rate": sample_rate, "channels": channels, "bits_per_sample": None,
+            "duration": duration, "bitrate": bitrate, "total_samples": None}
+
+
+def flac_info(path):
+    info = flac_streaminfo(path)
+    if info is None or not info["sample_rate"]:
+        return None
+    with open(path, "rb") as f:
+        payload = flac_payload_range(f, os.fstat(f.fileno()).st_size)
+    duration = info["total_samples"] / info["sample_rate"]
+    bitrate = round((payload[1] - payload[0]) * 8 / duration / 1000) if payload and duration else None
+    return {"codec": "flac", "sample_rate": info["sample_rate"], "channels": info["channels"],
+            "bits_per_sample": info["bits_per_sample"], "duration": duration, "bitrate": bitrate,
+            "total_samples": info["total_samples"]}
+
+
+def wav_probe(path):
+    info = wav_info(path)
+    if info is None or not info["sample_rate"] or not info["block_align"]:
+        return None
+    kind = "f" if info["format_tag"] == 3 else "s" if info["bits_per_sample"] > 8 else "u"
+    byte_rate = info["sample_rate"] * info["block_align"]
+    return {"codec": f"pcm_{kind}{info['bits_per_sample']}le", "sample_rate": info["sample_rate"],
+            "channels": info["channels"], "bits_per_sample": info["bits_per_sample"],
+            "duration": info["data_size"] / byte_rate, "bitrate": round(byte_rate * 8 / 1000),
+            "total_samples": info["data_size"] // info["block_align"]}
+
+
+def probe_header(path):
+    """
+    只读取文件头（以及末尾标签的位置），获取音频流的基本参数，目前支持 WAV、FLAC 和 MP3
+
+    参数:
+        path (str): 音频文件路径
+
+    返回:
+        dict | None: 包含 codec、sample_rate、channels、bits_per_sample、duration（秒）、bitrate（kbps）、
+        total_samples 的字典，无法得知的项为 None；格式不支持或无法解析时返回 None
+    """
+    readers = {
+        ".wav": wav_probe,
+        ".flac": flac_info,
+        ".mp3": mp3_info,
+    }
+    reader = readers.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        return None
+    return reader(path)
@@ -0,0 +1,76 @@
+import os
+import subprocess
+
+from runtime import VAL
+from runtime.metrics import METRICS
+
+# ffmpeg 原始PCM输出格式及每个采样的字节数
+PCM_FORMATS = {
+    "s16le": 2,
+    "s24le": 3,
+    "s32le": 4,
+    "f32le": 4,
+}
+BLOCK_SIZE = 1024 * 1024
+
+
+def pcm_command(path, sample_fmt="s16le", sample_rate=None, channels=None, max_duration=None):
+    """
+    构建将音频解码为原始PCM并输出到标准输出的 ffmpeg 命令
+
+    参数:
+        path (str): 音频文件路径
+        sample_fmt (str): 输出采样格式，见 PCM_FORMATS
+        sample_rate (int): 输出采样率，留空则保持原采样率
+        channels (int): 输出声道数，留空则保持原声道布局
+        max_duration (float): 最大解码时长（秒），留空则解码全部
+
+    返回:
+        list: ffmpeg 命令
+    """
+    if sample_fmt not in PCM_FORMATS:
+        raise ValueError(f"不支持的采样格式：{sample_fmt}")
+    cmd = [VAL.ffmpeg, '-i', path]
+    if max_duration:
+        cmd += ['-t', str(max_duration)]
+    cmd += ['-map', '0:a:0']
+    if channels:
+        cmd += ['-ac', str(channels)]
+    if sample_rate:
+        cmd += ['-ar', str(sample_rate)]
+    cmd += ['-f', sample_fmt, '-']
+    return cmd
+
+
+def read_blocks(cmd, buffer=None):
+    """
+    运行命令并以固定大小的块读取其标准输出，块为复用缓冲区的视图，下次迭代前有效
+
+    参数:
+        cmd (list): 命令
+        buffer (bytearray): 复用的缓冲区，留空则新建 BLOCK_SIZE 大小的缓冲区
+
+    返回:
+        generator: memoryview 数据块
+
+    异常:
+        subprocess.CalledProcessError: 命令返回非0
+    """
+    if buffer is None:
+        buffer = bytearray(BLOCK_SIZE)
+    view = memoryview(buffer)
+    # 计入子进程的运行时间，包括调用方处理数据块的时间
+    with METRICS.timer("subprocess", tool=os.path.basename(cmd[0])), \
+            subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0) as proc:
+        while n := proc.stdout.readinto(buffer):
+            yield view[:n]
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def iter_pcm(path, buffer=None, **kwargs):
+    """
+    解码音频文件，以固定大小的块逐块返回原始PCM数据，参数同 pcm_command
+    """
+    return read_blocks(pcm_command(path, **kwargs), buffer)
+
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLBOX = os.path.join(ROOT, "toolbox.py")
+
+# 改为按需导入之前，toolbox.py 启动时导入的全部工具模块
+EAGER_IMPORTS = """
+import importlib
+for name in ("tools.check_ffmpeg", "tools.musicAnalyze", "tools.sim", "tools.sim.web", "tools.wav2flac"):
+    try:
+        importlib.import_module(name)
+    except Exception:
+        pass
+"""
+
+
+def time_command(command, runs):
+    """
+    运行命令 runs 次，返回每次的耗时（秒）
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark(runs=10, probe_file=None):
+    """
+    比较导入全部工具与按需导入的命令行的启动耗时
+
+    参数:
+        runs (int): 每项运行的次数，取中位数
+        probe_file (str): 额外测量对该文件运行 probe 子命令的耗时
+
+    返回:
+        dict: 测试项名称到耗时中位数（秒）的映射
+    """
+    cases = [
+        ("python", [sys.executable, "-c", "pass"]),
+        ("eager imports", [sys.executable, "-c", EAGER_IMPORTS]),
+        ("toolbox --help", [sys.executable, TOOLBOX, "--help"]),
+    ]
+    if probe_file:
+        cases.append(("toolbox probe", [sys.executable, TOOLBOX, "probe", probe_file]))
+
+    results = {}
+    print(f"{'测试项':<16} {'中位数(ms)':>10} {'最小(ms)':>10}")
+    for name, command in cases:
+        timings = time_command(command, runs)
+        results[name] = statistics.median(timings)
+        print(f"{name:<16} {results[name] * 1000:>10.1f} {min(timings) * 1000:>10.1f}")
+    speedup = results["eager imports"] / results["toolbox --help"]
+    print(f"按需导入后启动耗时为原来的{1 / speedup:.1%}（{speedup:.1f}倍）")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="toolbox.py 启动耗时测试")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--probe-file", default=None, help="额外测量对该文件运行 probe 子命令的耗时")
+    parser.add_argument("--min-speedup", type=float, default=None,
+                        help="启动加速倍数低于该值时以退出码1结束，便于在CI中检查")
+    args = parser.parse_args()
+    results = benchmark(args.runs, args.probe_file)
+    if args.min_speedup is not None and results["eager imports"] / results["toolbox --help"] < args.min_speedup:
+        sys.exit(1)
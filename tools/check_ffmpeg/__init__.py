@@ -1,31 +1,123 @@
+import os
+import json
+import shutil
+import threading
 import subprocess
 
 from runtime import COLOR as color
 from runtime import VAL as val
+from runtime.metrics import METRICS
 
+CAPABILITIES_FILE = "ffmpeg.json"
 
-def get_ffmpeg_version():
+_lock = threading.Lock()
+_capabilities = {}
+
+
+def parse_encoders(output):
+    """
+    解析 ffmpeg -encoders 的输出，返回音频编码器名称到描述的映射
+    """
+    encoders = {}
+    started = False
+    for line in output.splitlines():
+        if line.strip().startswith("------"):
+            started = True
+            continue
+        parts = line.split(None, 2)
+        if started and len(parts) >= 2 and parts[0].startswith("A"):
+            encoders[parts[1]] = parts[2] if len(parts) > 2 else ""
+    return encoders
+
+
+def detect_capabilities(executable):
+    """
+    运行一次 ffmpeg -encoders，从标准错误输出的横幅中取版本信息，从标准输出中取编码器列表
+
+    返回:
+        dict | None: {"version", "encoders"}，无法运行时返回 None
+    """
     try:
-        result = subprocess.run([val.ffmpeg, '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
-                                text=True)
-        return result.stdout.splitlines()[0]
-    except subprocess.CalledProcessError:
-        return False
+        with METRICS.timer("subprocess", tool="ffmpeg"):
+            result = subprocess.run([executable, "-nostdin", "-encoders"], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, check=True, text=True, errors="replace")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    banner = result.stderr.splitlines()
+    return {
+        "version": banner[0] if banner else "",
+        "encoders": parse_encoders(result.stdout),
+    }
+
+
+def capabilities(refresh=False):
+    """
+    返回 ffmpeg 的能力记录，结果保存在 VAL.config_path 下，ffmpeg 可执行文件变化（升级、替换）后重新检测；
+    同一进程内只检测一次
+
+    参数:
+        refresh (bool): 忽略已保存的记录，重新检测
+
+    返回:
+        dict | None: {"path", "size", "mtime_ns", "version", "encoders"}，ffmpeg 不可用时返回 None
+    """
+    executable = shutil.which(val.ffmpeg)
+    if executable is None:
+        return None
+    with _lock:
+        if not refresh and executable in _capabilities:
+            return _capabilities[executable]
+        try:
+            st = os.stat(executable)
+        except OSError:
+            return None
+        record_path = os.path.join(val.config_path, CAPABILITIES_FILE)
+        record = None
+        if not refresh:
+            try:
+                with open(record_path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                record = None
+        if not record or [record.get("path"), record.get("size"), record.get("mtime_ns")] != \
+                [executable, st.st_size, st.st_mtime_ns]:
+            detected = detect_capabilities(executable)
+            if detected is None:
+                # 不保存检测失败的结果，修复后无需手动刷新
+                return None
+            record = {"path": executable, "size": st.st_size, "mtime_ns": st.st_mtime_ns, **detected}
+            try:
+                with open(record_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(record, f, ensure_ascii=False)
+                os.replace(record_path + ".tmp", record_path)
+            except OSError:
+                pass
+        _capabilities[executable] = record
+        return record
+
+
+def has_encoder(name):
+    record = capabilities()
+    return record is not None and name in record["encoders"]
+
+
+def get_ffmpeg_version():
+    record = capabilities()
+    return record["version"] if record else False
 
 
 def is_ffmpeg_available():
-    try:
-        subprocess.run([val.ffmpeg, '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    return capabilities() is not None
 
 
 def main():
-    ffmpeg_version = get_ffmpeg_version()
+    record = capabilities(refresh=True)
 
-    if is_ffmpeg_available():
+    if record is not None:
         print(f"{color.green}ffmpeg可用{color.end}")
-        print(f"{color.blue}ffmpeg版本信息:\n{ffmpeg_version}{color.end}")
+        print(f"{color.blue}ffmpeg版本信息:\n{record['version']}{color.end}")
+        for name in ("flac", "libmp3lame", "aac"):
+            state = f"{color.green}可用" if name in record["encoders"] else f"{color.yellow}不可用"
+            print(f"{state}编码器：{name}{color.end}")
     else:
         print(f"{color.red}ffmpeg命令不可用。\n请前往 https://ffmpeg.org 安装FFmpeg{color.end}")
@@ -0,0 +1,203 @@
+import os
+import concurrent.futures
+
+import numpy as np
+from scipy import fft
+from scipy.ndimage import maximum_filter
+from tqdm import tqdm
+
+from runtime.metrics import METRICS
+from .. import scanner
+from ..sim.ann import connected_components
+from ..sim.mfcc import hann_window, load_audio
+from .index import FingerprintIndex
+
+SAMPLE_RATE = 8000
+N_FFT = 1024
+HOP_LENGTH = 256                # 帧间隔32ms
+FRAME_BLOCK = 256
+# 峰值的邻域大小（频率 × 时间），邻域越大峰值越稀疏
+PEAK_NEIGHBORHOOD = (31, 15)
+# 每秒最多保留的峰值数
+PEAKS_PER_SECOND = 12
+# 每个锚点峰值与其后最多 FAN_OUT 个峰值配对，时间差不超过 MAX_DT 帧
+FAN_OUT = 5
+MAX_DT = 63
+# 频率只取前512个频点，哈希为 锚点频率(9位) | 目标频率(9位) | 时间差(6位)
+N_BINS = 512
+HASH_BITS = 24
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.aac', '.m4a', '.wma', '.ape')
+
+
+def spectrogram(y):
+    """
+    计算对数幅度谱
+
+    返回:
+        numpy.ndarray: 形状为 (N_BINS, 帧数) 的 float32 矩阵
+    """
+    if len(y) < N_FFT:
+        y = np.pad(y, (0, N_FFT - len(y)))
+    frames = np.lib.stride_tricks.sliding_window_view(y, N_FFT)[::HOP_LENGTH]
+    window = hann_window(N_FFT)
+    result = np.empty((len(frames), N_BINS), dtype=np.float32)
+    for start in range(0, len(frames), FRAME_BLOCK):
+        spectrum = np.abs(fft.rfft(frames[start:start + FRAME_BLOCK] * window, axis=-1))[:, :N_BINS]
+        result[start:start + FRAME_BLOCK] = np.log(np.maximum(spectrum, 1e-6))
+    return result.T
+
+
+def find_peaks(spec):
+    """
+    在对数幅度谱中寻找局部最大值，每秒只保留最强的 PEAKS_PER_SECOND 个
+
+    返回:
+        tuple: (峰值所在帧, 峰值所在频点)，按帧排序
+    """
+    local_max = maximum_filter(spec, size=PEAK_NEIGHBORHOOD, mode="constant", cval=-np.inf) == spec
+    # 排除低于整体平均响度的峰值，静音段不产生指纹
+    local_max &= spec > spec.mean()
+    bins, frames = np.nonzero(local_max)
+    strength = spec[bins, frames]
+
+    frames_per_second = SAMPLE_RATE / HOP_LENGTH
+    second = (frames / frames_per_second).astype(np.int64)
+    order = np.lexsort((-strength, second))
+    second = second[order]
+    group_start = np.searchsorted(second, second, side="left")
+    rank = np.arange(len(order)) - group_start
+    keep = order[rank < PEAKS_PER_SECOND]
+
+    order = np.lexsort((bins[keep], frames[keep]))
+    return frames[keep][order], bins[keep][order]
+
+
+def landmarks(frames, bins):
+    """
+    将峰值两两配对生成声纹哈希
+
+    返回:
+        tuple: (uint32 哈希数组, 锚点帧数组)
+    """
+    hashes, offsets = [], []
+    paired = np.zeros(len(frames), dtype=np.int64)
+    for k in range(1, FAN_OUT * 3 + 1):
+        if k >= len(frames):
+            break
+        dt = frames[k:] - frames[:-k]
+        valid = (dt >= 1) & (dt <= MAX_DT) & (paired[:-k] < FAN_OUT)
+        anchors = np.flatnonzero(valid)
+        paired[anchors] += 1
+        hashes.append((bins[anchors].astype(np.uint32) << 15) | (bins[anchors + k].astype(np.uint32) << 6)
+                      | dt[anchors].astype(np.uint32))
+        offsets.append(frames[anchors])
+    if not hashes:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint16)
+    return np.concatenate(hashes), np.concatenate(offsets).astype(np.uint16)
+
+
+def fingerprint(path, max_duration=600):
+    """
+    提取音频文件的声纹：解码为 8kHz 单声道后，在频谱峰值之间配对生成哈希（landmark 方式）
+
+    哈希只依赖峰值的相对位置，对有损编码、音量变化和少量噪声不敏感
+
+    参数:
+        path (str): 音频文件路径
+        max_duration (int): 最大持续时间（秒），默认为600秒（10分钟）
+
+    返回:
+        tuple: (uint32 哈希数组, uint16 锚点帧数组)
+    """
+    y = load_audio(path, SAMPLE_RATE, max_duration)
+    return landmarks(*find_peaks(spectrogram(y)))
+
+
+def safe_fingerprint(path, max_duration=600):
+    # 在子进程中运行，解码失败时返回 None 而不是让整个进程池报错
+    try:
+        return fingerprint(path, max_duration)
+    except Exception:
+        return None
+
+
+def index_files(index, file_paths, workers=None, batch_size=256, min_matches=20):
+    """
+    为新增或变化的文件提取声纹并加入索引，同时在索引中查找它们的匹配
+
+    每批文件写入一个新分段后，用这批文件的声纹查询整个索引，
+    因此新文件既能匹配已有曲目，也能匹配同一批中的其他文件。
+
+    参数:
+        index (FingerprintIndex): 声纹索引
+        file_paths (list): 文件路径列表
+        workers (int): 提取声纹的进程数，默认为CPU核心数
+        batch_size (int): 每批加入索引的文件数
+        min_matches (int): 记录匹配的最低分数
+
+    返回:
+        tuple: (文件路径到曲目编号的映射, 提取失败的文件列表)
+    """
+    path_ids = {}
+    new_files = []
+    for file_path in file_paths:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            continue
+        track_id = index.track_id(file_path, st)
+        if track_id is None:
+            new_files.append((file_path, st))
+        else:
+            path_ids[file_path] = track_id
+    METRICS.count("fingerprints_cached", len(path_ids))
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=len(new_files), desc="Fingerprint") as progress:
+        for start in range(0, len(new_files), batch_size):
+            batch = new_files[start:start + batch_size]
+            results = executor.map(safe_fingerprint, [file_path for file_path, _ in batch], chunksize=4)
+            tracks = []
+            for (file_path, st), result in zip(batch, results):
+                if result is None:
+                    failed.append(file_path)
+                    METRICS.count("features_failed")
+                else:
+                    tracks.append((file_path, st, *result))
+                    METRICS.count("features_extracted")
+            with METRICS.timer("index_insert"):
+                track_ids = index.add_tracks(tracks)
+            with METRICS.timer("index_query"):
+                for track_id, (file_path, _, hashes, offsets) in zip(track_ids, tracks):
+                    path_ids[file_path] = track_id
+                    index.add_matches(track_id, index.query(hashes, offsets, exclude=track_id,
+                                                            min_matches=min_matches))
+            progress.update(len(batch))
+    return path_ids, failed
+
+
+def find_duplicate_audio_files(root_dir, workers=None, min_matches=20):
+    """
+    查找同一录音的不同文件（包括不同格式、码率的转码），以匹配关系的连通分量作为结果
+
+    参数:
+        root_dir (str): 根目录
+        workers (int): 提取声纹的进程数，默认为CPU核心数
+        min_matches (int): 判定为同一录音的最低匹配分数（同一时间偏移上重合的哈希数）
+
+    返回:
+        tuple: (重复文件列表的列表, 提取失败的文件列表)
+    """
+    with METRICS.timer("scan"):
+        file_paths = scanner.scan_files(root_dir, AUDIO_EXTENSIONS)
+    with FingerprintIndex() as index:
+        with METRICS.timer("fingerprint"):
+            path_ids, failed = index_files(index, file_paths, workers, min_matches=min_matches)
+        paths = list(path_ids)
+        position = {track_id: i for i, track_id in enumerate(path_ids.values())}
+        edges = [(position[a], position[b]) for a, b, _, _ in index.matches(min_matches)
+                 if a in position and b in position]
+    with METRICS.timer("cluster", engine="fingerprint"):
+        components = connected_components(len(paths), edges)
+    return [[paths[i] for i in component] for component in components if len(component) > 1], failed
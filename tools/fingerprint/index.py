@@ -0,0 +1,368 @@
+import os
+import sqlite3
+
+import numpy as np
+
+from runtime import VAL
+
+# 倒排记录：曲目编号和锚点所在帧
+POSTING_DTYPE = np.dtype([("track", "<u4"), ("offset", "<u2")])
+# 合并分段时每次处理的哈希区间大小，限制内存占用
+MERGE_SPAN = 1 << 20
+SEGMENT_FILES = ("keys.u4", "starts.i8", "post.bin")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hashes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS matches (
+    a INTEGER NOT NULL,
+    b INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (a, b)
+);
+CREATE INDEX IF NOT EXISTS matches_b ON matches (b);
+"""
+
+
+class Segment:
+    """
+    一个只读的倒排分段，由三个原始二进制文件组成：
+
+    keys.u4: 升序排列的不重复哈希；starts.i8: 每个哈希的倒排记录起始位置，末尾多一项为总数；
+    post.bin: 按哈希排列的倒排记录。三个文件均通过 np.memmap 按需映射。
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.keys = self._map("keys.u4", np.uint32)
+        self.starts = self._map("starts.i8", np.int64)
+        self.postings = self._map("post.bin", POSTING_DTYPE)
+
+    def _map(self, suffix, dtype):
+        path = f"{self.prefix}.{suffix}"
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self):
+        return len(self.postings)
+
+    def lookup(self, hashes):
+        """
+        查找一组哈希的倒排记录
+
+        返回:
+            tuple: (命中的哈希在输入中的下标, 每个命中哈希的倒排记录起点, 终点)
+        """
+        if not len(self.keys):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        pos = np.minimum(np.searchsorted(self.keys, hashes), len(self.keys) - 1)
+        found = np.flatnonzero(self.keys[pos] == hashes)
+        pos = pos[found]
+        return found, np.asarray(self.starts[pos]), np.asarray(self.starts[pos + 1])
+
+    def span(self, lo_hash, hi_hash):
+        """
+        取出哈希位于 [lo_hash, hi_hash) 的倒排记录
+
+        返回:
+            tuple: (每条记录的哈希, 倒排记录)
+        """
+        lo, hi = np.searchsorted(self.keys, [lo_hash, hi_hash])
+        starts = np.asarray(self.starts[lo:hi + 1])
+        if hi == lo:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=POSTING_DTYPE)
+        hashes = np.repeat(np.asarray(self.keys[lo:hi]), np.diff(starts))
+        return hashes, np.asarray(self.postings[starts[0]:starts[-1]])
+
+
+def gather(lo, hi):
+    """
+    将若干个 [lo, hi) 区间展开为连续的下标数组
+    """
+    lengths = hi - lo
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    return np.repeat(lo - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+
+
+class SegmentWriter:
+    """
+    按哈希升序追加写入一个新分段，先写入临时文件，完成后重命名
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.files = {suffix: open(f"{prefix}.{suffix}.tmp", "wb") for suffix in SEGMENT_FILES}
+        self.count = 0
+
+    def write(self, hashes, postings):
+        """
+        追加一批已按哈希排序的倒排记录，哈希必须大于之前写入的全部哈希
+        """
+        if not len(hashes):
+            return
+        bounds = np.flatnonzero(np.diff(hashes)) + 1
+        keys = hashes[np.concatenate(([0], bounds))].astype(np.uint32)
+        starts = np.concatenate(([0], bounds)).astype(np.int64) + self.count
+        self.files["keys.u4"].write(keys.tobytes())
+        self.files["starts.i8"].write(starts.tobytes())
+        self.files["post.bin"].write(postings.astype(POSTING_DTYPE).tobytes())
+        self.count += len(postings)
+
+    def close(self):
+        self.files["starts.i8"].write(np.int64(self.count).tobytes())
+        for f in self.files.values():
+            f.close()
+        # keys 最后重命名，作为分段写入完成的标志
+        for suffix in ("post.bin", "starts.i8", "keys.u4"):
+            os.replace(f"{self.prefix}.{suffix}.tmp", f"{self.prefix}.{suffix}")
+
+
+class FingerprintIndex:
+    """
+    声纹哈希的倒排索引，存放于 VAL.cache_path/fingerprint/<name>
+
+    曲目和已找到的匹配记录在 SQLite 数据库中；倒排记录写入只读分段，每批曲目写入一个新分段。
+    分段按记录数分层，记录数每相差 merge_factor 倍为一层，同一层的分段达到 merge_factor 个时合并为一个
+    （进入更高一层），合并时丢弃已被替换的曲目的记录。每条记录最多被重写约 log(曲库大小) 次，
+    分段数也只按对数增长。查询只需在每个分段中二分查找查询曲目的哈希，与曲库大小基本无关。
+
+    参数:
+        name (str): 索引名称，不同的指纹参数应使用不同的索引
+        merge_factor (int): 同层分段的合并数量，也是相邻两层的大小比例，默认为4
+        max_bucket (int): 查询时忽略倒排记录多于该数量的哈希（静音、噪声等常见哈希），默认为20000
+    """
+
+    def __init__(self, name="landmark", merge_factor=4, max_bucket=20000):
+        self.root = os.path.join(VAL.cache_path, "fingerprint", name)
+        os.makedirs(self.root, exist_ok=True)
+        self.merge_factor = max(2, merge_factor)
+        self.max_bucket = max_bucket
+        self._conn = sqlite3.connect(os.path.join(self.root, "tracks.db"))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self.segments = [Segment(self._prefix(i)) for i in self._segment_ids()]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _prefix(self, segment_id):
+        return os.path.join(self.root, f"seg-{segment_id:05d}")
+
+    def _segment_ids(self):
+        ids = []
+        for name in os.listdir(self.root):
+            if name.endswith(".tmp"):
+                # 中断时残留的临时文件
+                os.remove(os.path.join(self.root, name))
+            elif name.startswith("seg-") and name.endswith(".keys.u4"):
+                ids.append(int(name[4:9]))
+        return sorted(ids)
+
+    def _next_prefix(self):
+        ids = self._segment_ids()
+        return self._prefix(ids[-1] + 1 if ids else 0)
+
+    def track_id(self, path, st):
+        """
+        返回已索引且未变化的文件的曲目编号，否则返回 None
+        """
+        row = self._conn.execute("SELECT id, size, mtime_ns, inode FROM tracks WHERE path = ?", (path,)).fetchone()
+        if row is None or row[1:] != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+        return row[0]
+
+    def paths(self, track_ids):
+        """
+        返回曲目编号到文件路径的映射
+        """
+        result = {}
+        track_ids = list(track_ids)
+        for start in range(0, len(track_ids), 500):
+            chunk = track_ids[start:start + 500]
+            rows = self._conn.execute(f"SELECT id, path FROM tracks WHERE id IN ({','.join('?' * len(chunk))})",
+                                      chunk)
+            result.update(rows)
+        return result
+
+    def add_tracks(self, tracks):
+        """
+        批量加入曲目，倒排记录写入一个新分段；路径已存在时替换旧曲目
+
+        参数:
+            tracks (list): [(路径, os.stat_result, 哈希数组, 锚点帧数组), ...]
+
+        返回:
+            list: 按输入顺序分配的曲目编号
+        """
+        if not tracks:
+            return []
+        track_ids = []
+        with self._conn:
+            for path, st, hashes, offsets in tracks:
+                old = self._conn.execute("SELECT id FROM tracks WHERE path = ?", (path,)).fetchone()
+                if old is not None:
+                    self._conn.execute("DELETE FROM tracks WHERE id = ?", old)
+                    self._conn.execute("DELETE FROM matches WHERE a = ? OR b = ?", old * 2)
+                cursor = self._conn.execute(
+                    "INSERT INTO tracks (path, size, mtime_ns, inode, hashes) VALUES (?, ?, ?, ?, ?)",
+                    (path, st.st_size, st.st_mtime_ns, st.st_ino, len(hashes)))
+                track_ids.append(cursor.lastrowid)
+
+        hashes = np.concatenate([track[2] for track in tracks]).astype(np.uint32)
+        postings = np.empty(len(hashes), dtype=POSTING_DTYPE)
+        postings["track"] = np.repeat(track_ids, [len(track[2]) for track in tracks])
+        postings["offset"] = np.concatenate([track[3] for track in tracks])
+        order = np.argsort(hashes, kind="stable")
+
+        prefix = self._next_prefix()
+        writer = SegmentWriter(prefix)
+        writer.write(hashes[order], postings[order])
+        writer.close()
+        self.segments.append(Segment(prefix))
+        self.merge_tiers()
+        return track_ids
+
+    def tier(self, segment):
+        """
+        分段所在的层：记录数每增加 merge_factor 倍升高一层
+        """
+        size, tier = len(segment), 0
+        while size >= self.merge_factor:
+            size //= self.merge_factor
+            tier += 1
+        return tier
+
+    def merge_tiers(self):
+        """
+        依次合并分段数达到 merge_factor 的最低层，合并结果进入更高的层时可能继续合并
+        """
+        while True:
+            tiers = {}
+            for segment in self.segments:
+                tiers.setdefault(self.tier(segment), []).append(segment)
+            full = [tier for tier, segments in tiers.items() if len(segments) >= self.merge_factor]
+            if not full:
+                return
+            self.merge(tiers[min(full)])
+
+    def live_ids(self):
+        return np.fromiter((row[0] for row in self._conn.execute("SELECT id FROM tracks ORDER BY id")),
+                           dtype=np.uint32)
+
+    def merge(self, segments=None):
+        """
+        将一组分段合并为一个，按哈希区间分块处理，丢弃已删除曲目的记录
+
+        参数:
+            segments (list): 要合并的分段，留空则合并全部分段
+        """
+        segments = list(self.segments if segments is None else segments)
+        live = self.live_ids()
+        prefix = self._next_prefix()
+        writer = SegmentWriter(prefix)
+        max_hash = max((int(segment.keys[-1]) for segment in segments if len(segment.keys)), default=-1)
+        for lo_hash in range(0, max_hash + 1, MERGE_SPAN):
+            parts = [segment.span(lo_hash, lo_hash + MERGE_SPAN) for segment in segments]
+            hashes = np.concatenate([part[0] for part in parts])
+            if not len(hashes):
+                continue
+            postings = np.concatenate([part[1] for part in parts])
+            keep = np.isin(postings["track"], live)
+            hashes, postings = hashes[keep], postings[keep]
+            order = np.argsort(hashes, kind="stable")
+            writer.write(hashes[order], postings[order])
+        writer.close()
+
+        merged = {segment.prefix for segment in segments}
+        self.segments = [segment for segment in self.segments if segment.prefix not in merged] + [Segment(prefix)]
+        for segment in segments:
+            del segment.keys, segment.starts, segment.postings
+            for suffix in SEGMENT_FILES:
+                try:
+                    os.remove(f"{segment.prefix}.{suffix}")
+                except OSError:
+                    pass
+
+    def query(self, hashes, offsets, exclude=None, min_matches=10):
+        """
+        查找与一组声纹哈希在同一时间偏移上大量重合的曲目
+
+        每个命中的倒排记录给出 (曲目, 记录帧 - 查询帧)，同一曲目在同一偏移上的命中数即匹配分数。
+
+        参数:
+            hashes (numpy.ndarray): 查询曲目的哈希
+            offsets (numpy.ndarray): 查询曲目的锚点帧
+            exclude (int): 排除的曲目编号，通常是查询曲目自身
+            min_matches (int): 最低匹配分数
+
+        返回:
+            list: [(曲目编号, 分数, 偏移帧数), ...]，按分数从高到低排列
+        """
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        offsets = np.asarray(offsets, dtype=np.int32)
+        tracks, deltas = [], []
+        for segment in self.segments:
+            found, lo, hi = segment.lookup(hashes)
+            keep = hi - lo <= self.max_bucket
+            found, lo, hi = found[keep], lo[keep], hi[keep]
+            postings = segment.postings[gather(lo, hi)]
+            tracks.append(postings["track"].astype(np.int64))
+            deltas.append(postings["offset"].astype(np.int64) - np.repeat(offsets[found], hi - lo))
+        if not tracks:
+            return []
+        tracks, deltas = np.concatenate(tracks), np.concatenate(deltas)
+        if exclude is not None:
+            keep = tracks != exclude
+            tracks, deltas = tracks[keep], deltas[keep]
+        if not len(tracks):
+            return []
+
+        # 统计每个 (曲目, 偏移) 的命中数，取每个曲目命中最多的偏移
+        keys, counts = np.unique((tracks << 17) | (deltas + (1 << 16)), return_counts=True)
+        track_of = keys >> 17
+        order = np.lexsort((counts, track_of))
+        last = np.flatnonzero(np.diff(track_of[order], append=-1))
+        best = order[last]
+        best = best[counts[best] >= min_matches]
+        result = [(int(track_of[i]), int(counts[i]), int((keys[i] & ((1 << 17) - 1)) - (1 << 16))) for i in best]
+        return sorted(result, key=lambda item: -item[1])
+
+    def add_matches(self, track_id, matches):
+        """
+        记录曲目与其他曲目的匹配，每对曲目只保存一次
+        """
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO matches (a, b, score, offset) VALUES (?, ?, ?, ?)",
+                [(min(track_id, other), max(track_id, other), score, offset if track_id < other else -offset)
+                 for other, score, offset in matches])
+
+    def matches(self, min_matches=10):
+        """
+        返回全部分数不低于 min_matches 的匹配
+
+        返回:
+            list: [(曲目编号a, 曲目编号b, 分数, b 相对 a 的偏移帧数), ...]
+        """
+        return self._conn.execute("SELECT a, b, score, offset FROM matches WHERE score >= ?",
+                                  (min_matches,)).fetchall()
+
+    def close(self):
+        self._conn.close()
+        self.segments = []
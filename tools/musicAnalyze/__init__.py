@@ -1,43 +1,152 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import concurrent.futures
+
 import numpy as np
-import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
+from scipy import fft
 from scipy.io import wavfile
+from tqdm import tqdm
+
+from runtime import COLOR as color
+from runtime import VAL
+from runtime.cache import StatCache
+from runtime.metrics import METRICS
+from .. import scanner
+from ..audio.pcm import iter_pcm
+
+# 每次送入 rfft 的帧数
+FRAME_BLOCK = 256
+# 分块读取时每块的采样数
+CHUNK_SAMPLES = 1 << 20
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.aac', '.m4a', '.wma', '.ape')
+# 渲染结果按内容哈希和参数缓存在 VAL.cache_path/spectrogram 下；修改渲染方式时需递增版本号使旧缓存失效
+RENDER_VERSION = 1
+# 进程的文件权限掩码，只能通过设置后恢复的方式读取，在导入时（尚未启动线程）读取一次
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 
 def mix_channels(data):
     # 将多个声道混合成一个单声道
-    return np.mean(data, axis=-1)
+    return np.mean(data, axis=-1, dtype=np.float32)
 
-def generate_spectrogram(audio_file, window_size=1024, hop_size=512, fs=44100):
-    # 读取音频文件
-    rate, data = wavfile.read(audio_file)
 
-    # 将多个声道混合成一个单声道
-    if len(data.shape) > 1:
-        data = mix_channels(data)
+def read_wav_chunks(audio_file, chunk_samples=CHUNK_SAMPLES):
+    """
+    以内存映射方式读取WAV文件，逐块返回混合为单声道的 float32 数据
+
+    返回:
+        tuple: (采样率, 数据块生成器)
+    """
+    rate, data = wavfile.read(audio_file, mmap=True)
+
+    def chunks():
+        for start in range(0, len(data), chunk_samples):
+            chunk = np.asarray(data[start:start + chunk_samples], dtype=np.float32)
+            yield mix_channels(chunk) if chunk.ndim > 1 else chunk
+
+    return rate, chunks()
+
+
+def read_pipe_chunks(audio_file, fs=44100):
+    """
+    通过 ffmpeg 管道将任意格式解码为 fs 采样率的16位单声道数据，逐块返回 float32 数据，数值范围与16位WAV相同
+
+    返回:
+        tuple: (采样率, 数据块生成器)
+    """
+    def chunks():
+        remainder = b""
+        for block in iter_pcm(audio_file, sample_fmt="s16le", sample_rate=fs, channels=1):
+            # 管道读取的块长度不一定是采样的整数倍
+            data = remainder + bytes(block)
+            usable = len(data) - len(data) % 2
+            remainder = data[usable:]
+            yield np.frombuffer(data, dtype="<i2", count=usable // 2).astype(np.float32)
+
+    return fs, chunks()
+
+
+def read_chunks(audio_file, fs=44100):
+    """
+    分块读取音频，WAV文件直接内存映射，其他格式（以及 scipy 无法映射的WAV，如24位）通过 ffmpeg 管道解码
+    """
+    if audio_file.lower().endswith(".wav"):
+        try:
+            return read_wav_chunks(audio_file)
+        except ValueError:
+            pass
+    return read_pipe_chunks(audio_file, fs)
+
 
-    # 使用窗口函数进行快速傅里叶变换
-    window = np.hanning(window_size)
-    num_frames = int((len(data) - window_size) / hop_size) + 1
+def stft_magnitude(chunks, window_size=1024, hop_size=512):
+    """
+    流式计算幅度谱，内存占用只与块大小有关
 
-    spectrogram = np.zeros((window_size // 2, num_frames))
+    相邻数据块之间保留不足一帧的尾部数据，分帧结果与一次性读入整个文件相同；
+    帧通过 sliding_window_view 构建，每 FRAME_BLOCK 帧加窗后做一次 rfft
 
-    for t in range(num_frames):
-        start = t * hop_size
-        end = start + window_size
-        frame = data[start:end] * window
+    参数:
+        chunks (iterable): float32 单声道数据块
+        window_size (int): 窗口大小
+        hop_size (int): 帧移
 
-        spectrum = np.fft.fft(frame)
-        magnitude = np.abs(spectrum[:window_size // 2])
-        spectrogram[:, t] = magnitude
+    返回:
+        generator: 形状为 (帧数, window_size // 2) 的 float32 幅度块
+    """
+    window = np.hanning(window_size).astype(np.float32)
+    carry = np.zeros(0, dtype=np.float32)
+    for chunk in chunks:
+        buffer = np.concatenate((carry, chunk))
+        if len(buffer) < window_size:
+            carry = buffer
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, window_size)[::hop_size]
+        for start in range(0, len(frames), FRAME_BLOCK):
+            spectrum = fft.rfft(frames[start:start + FRAME_BLOCK] * window, axis=-1)[:, :window_size // 2]
+            yield np.abs(spectrum).astype(np.float32)
+        carry = buffer[len(frames) * hop_size:]
 
+
+def to_db(magnitude):
     # 将幅度转换为分贝
-    spectrogram = 10 * np.log10(spectrogram + 1e-9)
+    return 10 * np.log10(magnitude + np.float32(1e-9))
+
+
+def generate_spectrogram(audio_file, window_size=1024, hop_size=512, fs=44100):
+    """
+    计算音频文件的频谱图
 
+    参数:
+        audio_file (str): 音频文件路径
+        window_size (int): 窗口大小
+        hop_size (int): 帧移
+        fs (int): 非WAV文件解码时使用的采样率
+
+    返回:
+        tuple: (形状为 (window_size // 2, 帧数) 的 float32 分贝矩阵, 采样率)
+    """
+    rate, chunks = read_chunks(audio_file, fs)
+    blocks = list(stft_magnitude(chunks, window_size, hop_size))
+    if not blocks:
+        return np.zeros((window_size // 2, 0), dtype=np.float32), rate
+    spectrogram = to_db(np.concatenate(blocks)).T
     return spectrogram, rate
 
-def plot_spectrogram(spectrogram, rate, colormap='viridis'):
+
+def spectrogram_cmap(colormap='viridis'):
     colors = [(0, 0, 0), (0, 0, 1), (0, 1, 1), (0, 1, 0), (1, 1, 0), (1, 0, 0)]  # 你可以定义自己的颜色
-    cmap = LinearSegmentedColormap.from_list(colormap, colors, N=256)
+    return LinearSegmentedColormap.from_list(colormap, colors, N=256)
+
+
+def plot_spectrogram(spectrogram, rate, colormap='viridis'):
+    # 交互式显示，仅在使用时导入 pyplot，批量渲染不依赖图形界面
+    import matplotlib.pyplot as plt
+    cmap = spectrogram_cmap(colormap)
     plt.imshow(spectrogram, aspect='auto', origin='lower', cmap=cmap, extent=[0, len(spectrogram[0]), 20, rate // 2])
     plt.colorbar(label='Magnitude (dB)')
     plt.xlabel('Time (frames)')
@@ -45,7 +154,235 @@ def plot_spectrogram(spectrogram, rate, colormap='viridis'):
     plt.title('Spectrogram')
     plt.show()
 
-# 音频文件路径
-audio_file = (r'H:\sp\y.wav')
-spectrogram, rate = generate_spectrogram(audio_file)
-plot_spectrogram(spectrogram, rate)
\ No newline at end of file
+
+def max_pool_frames(blocks, width):
+    """
+    流式地将幅度块在时间方向上最大池化到不超过 width 列
+
+    每列先取 group 帧的最大值，列数达到 2 * width 时相邻两列合并、group 加倍，
+    内存占用只与 width 有关，不需要预先知道总帧数
+
+    参数:
+        blocks (iterable): 形状为 (帧数, 频点数) 的幅度块
+        width (int): 输出列数
+
+    返回:
+        numpy.ndarray: 形状为 (列数, 频点数) 的 float32 矩阵，列数不超过 width
+    """
+    group = 1
+    columns = []
+    partial, partial_count = None, 0   # 尚未凑满 group 帧的最后一列
+    for block in blocks:
+        if partial_count:
+            need = group - partial_count
+            partial = np.maximum(partial, block[:need].max(axis=0))
+            partial_count += len(block[:need])
+            block = block[need:]
+            if partial_count < group:
+                continue
+            columns.append(partial[None])
+            partial, partial_count = None, 0
+        full = len(block) // group
+        if full:
+            columns.append(block[:full * group].reshape(full, group, -1).max(axis=1))
+        if len(block) > full * group:
+            partial, partial_count = block[full * group:].max(axis=0), len(block) - full * group
+
+        pooled = np.concatenate(columns) if columns else None
+        while pooled is not None and len(pooled) >= 2 * width:
+            if len(pooled) % 2:
+                # 剩下的单列帧数不足新的 group，并入最后一列
+                last = pooled[-1]
+                partial = last if partial is None else np.maximum(last, partial)
+                partial_count += group
+                pooled = pooled[:-1]
+            pooled = pooled.reshape(-1, 2, pooled.shape[1]).max(axis=1)
+            group *= 2
+        columns = [pooled] if pooled is not None else []
+
+    if partial_count:
+        columns.append(partial[None])
+    if not columns:
+        return np.zeros((0, 0), dtype=np.float32)
+    pooled = np.concatenate(columns)
+    return pool_axis(pooled, width, axis=0)
+
+
+def pool_axis(data, size, axis):
+    """
+    沿指定方向把数据最大池化为 size 份，已不超过 size 时原样返回
+    """
+    n = data.shape[axis]
+    if n <= size:
+        return data
+    edges = np.linspace(0, n, size + 1).astype(np.int64)[:-1]
+    return np.maximum.reduceat(data, edges, axis=axis)
+
+
+def render_params(window_size=1024, hop_size=512, fs=44100, width=1600, height=512, colormap='viridis'):
+    return {"window_size": window_size, "hop_size": hop_size, "fs": fs, "width": width, "height": height,
+            "colormap": colormap, "version": RENDER_VERSION}
+
+
+def params_key(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def cache_png_path(content_md5, params):
+    return os.path.join(VAL.cache_path, "spectrogram", content_md5[:2], f"{content_md5}-{params_key(params)}.png")
+
+
+def render_png(audio_file, png_path, params):
+    """
+    流式计算频谱图并最大池化到输出像素大小，用 Agg 后端写入PNG，每个像素对应一个池化后的值
+    """
+    from matplotlib.image import imsave
+    _, chunks = read_chunks(audio_file, params["fs"])
+    magnitude = max_pool_frames(stft_magnitude(chunks, params["window_size"], params["hop_size"]), params["width"])
+    if not magnitude.size:
+        raise ValueError("音频过短，无法生成频谱图")
+    spectrogram = to_db(pool_axis(magnitude, params["height"], axis=1)).T
+    os.makedirs(os.path.dirname(png_path), exist_ok=True)
+    temp_path = temp_file(png_path)
+    try:
+        imsave(temp_path, spectrogram, cmap=spectrogram_cmap(params["colormap"]), origin='lower', format='png')
+        os.replace(temp_path, png_path)
+    except BaseException:
+        remove_quietly(temp_path)
+        raise
+
+
+def temp_file(path):
+    """
+    在 path 所在目录创建唯一的临时文件并返回其路径，并行任务写同一输出时互不覆盖
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                     dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    # mkstemp 创建的文件只有所有者可读写，改为与普通新建文件相同的权限
+    os.chmod(temp_path, 0o666 & ~UMASK)
+    return temp_path
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def file_md5(path):
+    hasher = hashlib.md5()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def publish(cached_path, output_path):
+    # 输出文件优先以硬链接指向缓存，不支持硬链接时复制
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    temp_path = temp_file(output_path)
+    try:
+        # 硬链接的目标不能已存在，先删除占位的临时文件，文件名仍是本任务独有的
+        os.remove(temp_path)
+        try:
+            os.link(cached_path, temp_path)
+        except OSError:
+            shutil.copyfile(cached_path, temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        remove_quietly(temp_path)
+        raise
+
+
+def render_job(audio_file, output_path, params, content_md5=None):
+    """
+    在子进程中运行：计算内容哈希（未缓存时），缓存中没有对应的PNG时渲染，最后发布到输出路径
+
+    返回:
+        tuple: (音频文件, 内容哈希, 是否重新渲染, 错误信息)
+    """
+    try:
+        content_md5 = content_md5 or file_md5(audio_file)
+        cached_path = cache_png_path(content_md5, params)
+        rendered = not os.path.exists(cached_path)
+        if rendered:
+            render_png(audio_file, cached_path, params)
+        publish(cached_path, output_path)
+        return audio_file, content_md5, rendered, None
+    except Exception as e:
+        return audio_file, None, False, str(e)
+
+
+def output_png_path(audio_file, input_dir, output_dir):
+    # 保留原扩展名，同名的不同格式文件不会互相覆盖
+    return os.path.join(output_dir, os.path.relpath(audio_file, input_dir)) + ".png"
+
+
+def batch_render(input_dir, output_dir=None, workers=None, **kwargs):
+    """
+    为目录树中的全部音频文件渲染频谱图PNG，在输出目录中保留相对目录结构
+
+    渲染在进程池中进行，使用 Agg 后端，不需要图形界面。渲染结果按文件内容的MD5和渲染参数缓存，
+    文件内容的MD5按文件状态缓存，再次运行时未变化的文件既不重新计算哈希也不重新渲染。
+
+    参数:
+        input_dir (str): 音频文件目录
+        output_dir (str): PNG输出目录，留空则输出到音频文件旁
+        workers (int): 进程数，默认为CPU核心数
+        **kwargs: 渲染参数，见 render_params
+
+    返回:
+        tuple: (重新渲染的数量, 使用缓存的数量, [(音频文件, 错误信息), ...])
+    """
+    output_dir = output_dir or input_dir
+    params = render_params(**kwargs)
+    rendered, cached, failed = 0, 0, []
+    with StatCache("file-md5") as hash_cache, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        # 扫描到文件即提交渲染，不等待扫描结束
+        for entry in scanner.scan(input_dir, AUDIO_EXTENSIONS):
+            audio_file = entry.path
+            try:
+                st = os.stat(audio_file)
+            except OSError:
+                continue
+            output_path = output_png_path(audio_file, input_dir, output_dir)
+            content_md5 = hash_cache.get(audio_file, st)
+            # 内容未变化且输出已是缓存中的渲染结果时直接跳过
+            if content_md5 and os.path.exists(output_path):
+                cached_path = cache_png_path(content_md5, params)
+                if os.path.exists(cached_path) and os.path.getsize(cached_path) == os.path.getsize(output_path):
+                    cached += 1
+                    continue
+            future = executor.submit(render_job, audio_file, output_path, params, content_md5)
+            futures[future] = st
+        with METRICS.timer("render"):
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Spectrogram"):
+                audio_file, content_md5, is_rendered, error = future.result()
+                if error is not None:
+                    failed.append((audio_file, error))
+                    continue
+                hash_cache.put(audio_file, content_md5, futures[future])
+                if is_rendered:
+                    rendered += 1
+                else:
+                    cached += 1
+    METRICS.count("spectrograms", rendered, result="rendered")
+    METRICS.count("spectrograms", cached, result="cached")
+    METRICS.count("spectrograms", len(failed), result="failed")
+    return rendered, cached, sorted(failed)
+
+
+def main():
+    input_dir = input(f"{color.magenta}音频文件目录：{color.end}")
+    if not os.path.isdir(input_dir):
+        print(f"{color.red}定义的路径不存在{color.end}")
+        return
+    output_dir = input(f"{color.magenta}频谱图输出目录（留空代表与音频文件相同）：{color.end}")
+    rendered, cached, failed = batch_render(input_dir, output_dir or None)
+    print(f"{color.green}新渲染{rendered}个，使用缓存{cached}个，失败{len(failed)}个{color.end}")
+    for audio_file, error in failed:
+        print(f"{color.red}{audio_file}\n    {error}{color.end}")
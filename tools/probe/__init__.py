@@ -0,0 +1,136 @@
+import os
+import json
+import threading
+import concurrent.futures
+
+from runtime.cache import StatCache
+from runtime.metrics import METRICS
+from .. import scanner
+from ..audio.formats import probe_header
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.aac', '.m4a', '.wma', '.ape')
+
+# 探测结果按文件状态缓存在 StatCache 的 probe 类别中；修改结果格式时需递增版本号使旧缓存失效
+CACHE_KIND = "probe-1"
+
+_lock = threading.Lock()
+_executor = None
+
+
+def shared_executor():
+    """
+    返回进程内共享的线程池，探测都是小块读取，哈希、转码和Web界面共用一个池即可
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4),
+                                                              thread_name_prefix="probe")
+        return _executor
+
+
+def read_probe(path):
+    """
+    读取单个文件的音频参数：WAV/FLAC/MP3 只解析文件头，其他格式退回 mutagen
+
+    返回:
+        dict: probe_header 的各项，无法解析时各项为 None
+    """
+    try:
+        info = probe_header(path)
+    except (OSError, ValueError, ZeroDivisionError):
+        info = None
+    if info is not None:
+        METRICS.count("probes", method="header")
+        return info
+    METRICS.count("probes", method="mutagen")
+    info = {"codec": None, "sample_rate": None, "channels": None, "bits_per_sample": None, "duration": None,
+            "bitrate": None, "total_samples": None}
+    try:
+        from mutagen import File
+        audio = File(path)
+    except Exception:
+        return info
+    if audio is None or audio.info is None:
+        return info
+    stream = audio.info
+    bitrate = getattr(stream, "bitrate", None)
+    info.update(codec=audio.mime[0] if audio.mime else None, sample_rate=getattr(stream, "sample_rate", None),
+                channels=getattr(stream, "channels", None), bits_per_sample=getattr(stream, "bits_per_sample", None),
+                duration=getattr(stream, "length", None), bitrate=bitrate // 1000 if bitrate else None,
+                total_samples=getattr(stream, "total_samples", None))
+    return info
+
+
+def expand_paths(paths, extensions=AUDIO_EXTENSIONS):
+    """
+    展开路径列表：目录替换为其中的音频文件，文件原样保留
+
+    返回:
+        list: 去重后的文件路径，保持原始顺序
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(scanner.scan_files(path, extensions))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+class Prober:
+    """
+    批量探测音频参数，结果按文件状态持久化缓存，文件变化后自动失效
+
+    参数:
+        executor (concurrent.futures.Executor): 执行探测的线程池，默认使用 shared_executor()
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor or shared_executor()
+        self.cache = StatCache(CACHE_KIND)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def probe(self, path, st=None):
+        """
+        返回 read_probe 的结果，文件不存在时返回 None
+        """
+        try:
+            st = st or os.stat(path)
+        except OSError:
+            return None
+        value = self.cache.get(path, st)
+        if value is not None:
+            return json.loads(value)
+        info = read_probe(path)
+        self.cache.put(path, json.dumps(info), st)
+        return info
+
+    def probe_many(self, paths):
+        """
+        在线程池中并行探测一批文件
+
+        返回:
+            dict: 路径到 probe() 结果的映射
+        """
+        result = dict(zip(paths, self.executor.map(self.probe, paths)))
+        self.cache.flush()
+        return result
+
+    def close(self):
+        self.cache.close()
+
+
+def probe(path):
+    with Prober() as prober:
+        return prober.probe(path)
+
+
+def probe_many(paths):
+    with Prober() as prober:
+        return prober.probe_many(paths)
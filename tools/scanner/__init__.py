@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import hashlib
+import concurrent.futures
+from collections import namedtuple
+
+from runtime import VAL
+from runtime.metrics import METRICS
+
+FileEntry = namedtuple("FileEntry", ["path", "size", "mtime_ns", "inode"])
+
+# 修改时间距扫描开始不足该值（纳秒）的目录不记入清单，避免同一时间粒度内的修改被漏掉
+MTIME_GRACE_NS = 2 * 10 ** 9
+
+
+def manifest_path(root_dir, extensions):
+    key = hashlib.sha1(json.dumps([os.path.abspath(root_dir), sorted(extensions)]).encode()).hexdigest()
+    return os.path.join(VAL.cache_path, "scan", f"{key}.json")
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def scan_dir(dir_path, extensions, cached=None):
+    """
+    扫描单个目录，返回 (目录修改时间, 匹配的文件, 子目录)
+
+    目录修改时间与清单中记录的一致时，说明目录下没有增删文件，直接使用清单中的结果
+    """
+    try:
+        dir_mtime = os.stat(dir_path).st_mtime_ns
+    except OSError:
+        return None, [], []
+    if cached is not None and cached[0] == dir_mtime:
+        return dir_mtime, cached[1], cached[2]
+
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        # 复用 DirEntry 的 stat 结果（Windows 上无需额外系统调用）
+                        st = entry.stat()
+                        files.append([entry.name, st.st_size, st.st_mtime_ns, st.st_ino])
+                except OSError:
+                    continue
+    except OSError:
+        return None, [], []
+    return dir_mtime, files, subdirs
+
+
+def scan(root_dir, extensions, workers=8, incremental=True):
+    """
+    并行扫描目录树，逐个返回扩展名匹配的文件，调用方可以在扫描结束前开始处理
+
+    子目录在线程池中并行扫描。incremental 为 True 时，扫描结果按目录记入 VAL.cache_path 下的清单，
+    再次扫描时修改时间未变的目录不再读取，其中文件的大小和修改时间沿用清单中的记录；
+    原地修改文件内容不会改变目录的修改时间，需要精确文件状态时应自行 stat 或关闭 incremental。
+
+    参数:
+        root_dir (str): 根目录
+        extensions (tuple): 小写的扩展名，例如 ('.mp3', '.flac')
+        workers (int): 扫描线程数，默认为8
+        incremental (bool): 是否使用目录修改时间清单跳过未变化的目录
+
+    返回:
+        generator: FileEntry(path, size, mtime_ns, inode)
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    path = manifest_path(root_dir, extensions)
+    old_manifest = load_manifest(path) if incremental else {}
+    new_manifest = {}
+    scan_start = time.time_ns()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_dir, root_dir, extensions, old_manifest.get(root_dir)): root_dir}
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                dir_path = pending.pop(future)
+                dir_mtime, files, subdirs = future.result()
+                if dir_mtime is None:
+                    continue
+                cached = old_manifest.get(dir_path)
+                METRICS.count("dirs_scanned", unchanged=cached is not None and cached[0] == dir_mtime)
+                METRICS.count("files_scanned", len(files))
+                if scan_start - dir_mtime > MTIME_GRACE_NS:
+                    new_manifest[dir_path] = [dir_mtime, files, subdirs]
+                for subdir in subdirs:
+                    sub_path = os.path.join(dir_path, subdir)
+                    pending[executor.submit(scan_dir, sub_path, extensions, old_manifest.get(sub_path))] = sub_path
+                for name, size, mtime_ns, inode in files:
+                    yield FileEntry(os.path.join(dir_path, name), size, mtime_ns, inode)
+
+    if incremental:
+        with METRICS.timer("scan_manifest_save"):
+            save_manifest(path, new_manifest)
+
+
+def scan_files(root_dir, extensions, workers=8, incremental=True):
+    """
+    扫描目录树，返回排序后的文件路径列表，参数同 scan
+    """
+    return sorted(entry.path for entry in scan(root_dir, extensions, workers, incremental))
@@ -1,13 +1,22 @@
 import os
 import hashlib
-import librosa
 import numpy as np
 from tqdm import tqdm
 import concurrent.futures
+from functools import partial
 from sklearn.cluster import KMeans
 from scipy.spatial.distance import cosine
 from scipy.cluster.hierarchy import linkage, fcluster
 
+from runtime.cache import StatCache
+from runtime.metrics import METRICS
+from .. import scanner
+from . import mfcc
+from . import ann
+from .featurestore import FeatureStore
+
+N_MFCC = 30
+
 
 # 计算文件的MD5
 def calculate_md5(file_path):
@@ -28,14 +37,14 @@ def calculate_md5(file_path):
 
 
 # 提取音频文件的MFCC特征
-def feature(path, target_sr=8000, n_mfcc=30, frame_size=16384, hop_length=2048, max_duration=600):
+def feature(path, target_sr=8000, n_mfcc=N_MFCC, frame_size=16384, hop_length=2048, max_duration=600):
     """
     提取音频文件的 MFCC 特征
 
     参数:
         path (str): 音频文件路径
         target_sr (int): 目标采样率，默认为8000
-        n_mfcc (int): MFCC的数量，默认为50
+        n_mfcc (int): MFCC的数量，默认为30
         frame_size (int): 帧大小，默认为16384
         hop_length (int): 帧之间的跳跃长度，默认为2048
         max_duration (int): 最大持续时间（秒），默认为600秒（10分钟）
@@ -43,12 +52,8 @@ def feature(path, target_sr=8000, n_mfcc=30, frame_size=16384, hop_length=2048,
     返回:
         numpy.ndarray: MFCC 特征向量
     """
-    y, sr = librosa.load(path, sr=target_sr, duration=max_duration)
-    y = librosa.effects.preemphasis(y)      # 预加重处理
-    y = librosa.util.normalize(y)           # 音量归一化
-    mfcc_features = librosa.feature.mfcc(y=y, sr=target_sr, n_mfcc=n_mfcc, n_fft=frame_size, hop_length=hop_length)
-    # 转换精度
-    # mfcc_features = mfcc_features.astype(np.float32)
+    mfcc_features = mfcc.feature(path, target_sr=target_sr, n_mfcc=n_mfcc, frame_size=frame_size,
+                                 hop_length=hop_length, max_duration=max_duration)
     return mfcc_features.flatten()
 
 
@@ -67,72 +72,104 @@ def cosine_similarity(vector1, vector2):
     return similarity
 
 
+def stack_vectors(vectors):
+    """
+    将向量补零对齐，装入 float32 矩阵
+
+    参数:
+        vectors (list | numpy.ndarray): 向量列表，或已经对齐的二维矩阵
+
+    返回:
+        numpy.ndarray: 形状为 (向量数, 最大长度) 的矩阵
+    """
+    if isinstance(vectors, np.ndarray) and vectors.ndim == 2:
+        return vectors.astype(np.float32)
+    max_len = max(len(vector) for vector in vectors)
+    matrix = np.zeros((len(vectors), max_len), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        matrix[i, :len(vector)] = vector
+    return matrix
+
+
+def normalize_vectors(vectors):
+    """
+    将向量补零对齐后按行做L2归一化，得到 float32 矩阵
+
+    补零不改变向量的模和点积，因此与逐对计算补零向量的余弦相似度结果相同；全零向量归一化后为 nan
+
+    参数:
+        vectors (list | numpy.ndarray): 向量列表，或已经对齐的二维矩阵
+
+    返回:
+        numpy.ndarray: 形状为 (向量数, 最大长度) 的矩阵
+    """
+    matrix = stack_vectors(vectors)
+    # 在 float64 下累加平方和，避免长向量损失精度
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix, dtype=np.float64)).astype(np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        matrix /= norms[:, None]
+    return matrix
+
+
 # 计算相似度矩阵
-def calculate_similarity_matrix(vectors):
+def calculate_similarity_matrix(vectors, block_size=2048):
     """
     计算向量列表中所有向量之间的余弦相似度矩阵
 
+    归一化后按 block_size × block_size 的分块做矩阵乘法，除输入和结果外，
+    峰值内存只增加一个分块的大小
+
     参数:
         vectors (list): 向量列表
+        block_size (int): 分块大小，默认为2048
 
     返回:
-        numpy.ndarray: 相似度矩阵
+        numpy.ndarray: float32 相似度矩阵
     """
-    max_len = max(len(vector) for vector in vectors)
-    padded_vectors = [np.pad(vector, (0, max_len - len(vector))) for vector in vectors]
-    similarity_matrix = np.zeros((len(vectors), len(vectors)))
-    for i in range(len(vectors)):
-        for j in range(i, len(vectors)):
-            similarity = cosine_similarity(padded_vectors[i], padded_vectors[j])
-            similarity_matrix[i, j] = similarity
-            similarity_matrix[j, i] = similarity
+    matrix = normalize_vectors(vectors)
+    n = len(matrix)
+    similarity_matrix = np.empty((n, n), dtype=np.float32)
+    for i in range(0, n, block_size):
+        rows = matrix[i:i + block_size]
+        for j in range(i, n, block_size):
+            tile = rows @ matrix[j:j + block_size].T
+            similarity_matrix[i:i + block_size, j:j + block_size] = tile
+            if j != i:
+                similarity_matrix[j:j + block_size, i:i + block_size] = tile.T
     return similarity_matrix
 
 
-def perform_hierarchical_clustering(pathToMFCC, threshold, fileQuant):
+def perform_hierarchical_clustering(paths, matrix, threshold, fileQuant):
     """
     执行层次聚类并返回聚类结果
 
     参数:
-        pathToMFCC (dict): 特征向量的字典，键为文件路径，值为特征向量
+        paths (list): 文件路径列表
+        matrix (numpy.ndarray): 与 paths 逐行对应的 (文件数 × 维数) 特征矩阵
         threshold (float): 相似度阈值
         fileQuant (int): 文件数量
 
     返回:
         list: 聚类结果
     """
-    vectors = list(pathToMFCC.values())     # 将MFCC矩阵装入列表
-
     # 使用K-Means算法进行预分类
-    k = fileQuant // 20                 # 设置簇数
+    k = max(1, min(fileQuant // 20, len(paths)))     # 设置簇数，文件少于20个时只分一个簇
     kmeans = KMeans(n_clusters=k)           # 实例化
-    max_len = max(len(vector) for vector in vectors)
-
-    # 统一向量长度，并进行填充
-    padded_vectors = []
-    for vector in vectors:
-        if len(vector) < max_len:
-            padded_vector = np.pad(vector, (0, max_len - len(vector)))
-        else:
-            padded_vector = vector[:max_len]
-        padded_vectors.append(padded_vector)
-
-    clusters = kmeans.fit_predict(padded_vectors)   # 获得返回的聚类结果
+    clusters = kmeans.fit_predict(matrix)   # 获得返回的聚类结果
 
     print("完成k-means聚类，进行层次聚类")
 
-    clustered_paths = {}                            # 创建空字典
-    for i, path in enumerate(pathToMFCC.keys()):    # 遍历pathToMFCC字典的key
-        cluster = clusters[i]
-        if cluster not in clustered_paths:
-            clustered_paths[cluster] = [path]
+    clustered_indices = {}                          # 创建空字典
+    for i, cluster in enumerate(clusters):          # 记录每个簇包含的向量下标
+        if cluster not in clustered_indices:
+            clustered_indices[cluster] = [i]
         else:
-            clustered_paths[cluster].append(path)
+            clustered_indices[cluster].append(i)
 
     final_clusters = []
-    for cluster_paths in clustered_paths.values():
-        cluster_vectors = [pathToMFCC[path] for path in cluster_paths]
-        similarity_matrix = calculate_similarity_matrix(cluster_vectors)
+    for cluster_indices in clustered_indices.values():
+        cluster_paths = [paths[i] for i in cluster_indices]
+        similarity_matrix = calculate_similarity_matrix(matrix[cluster_indices])
 
         # 使用层次聚类进行细分
         if len(cluster_paths) > 1:
@@ -162,82 +199,225 @@ def perform_hierarchical_clustering(pathToMFCC, threshold, fileQuant):
     return final_clusters
 
 
-def process_file(args):
-    file_path = args
-    # print(file_path)
-    file_md5 = calculate_md5(file_path)
-    global md5ToMFCC, pathToMFCC, fileQuant, fatalError
+def hash_entry(file_path, hash_cache):
+    """
+    I/O 阶段：stat 后查询缓存，未命中时计算文件的 MD5，在线程池中运行
+
+    返回:
+        tuple: (文件路径, MD5)，读取失败时 MD5 为 None
+    """
+    try:
+        st = os.stat(file_path)
+        file_md5 = hash_cache.get(file_path, st)
+        if file_md5 is None:
+            file_md5 = calculate_md5(file_path)
+            hash_cache.put(file_path, file_md5, st)
+            METRICS.count("bytes_hashed", st.st_size, stage="file")
+        return file_path, file_md5
+    except OSError:
+        return file_path, None
+
+
+def extract_vector(file_path, embedding=None):
+    """
+    CPU 阶段：解码并提取特征，汇聚为最终写入特征库的向量，在进程池中运行
+
+    返回:
+        numpy.ndarray | None: 特征向量，提取失败时为 None
+    """
+    mfcc_matrix = mfcc.safe_feature(file_path)
+    if mfcc_matrix is None:
+        return None
+    # 汇聚为定长向量，内存占用与音频时长无关
+    return mfcc.embed(mfcc_matrix, embedding) if embedding else mfcc_matrix.flatten()
 
-    # 如果MD5存在，直接赋值
-    if file_md5 in md5ToMFCC:
-        mfcc_features = md5ToMFCC[file_md5]
-    # 如果MD5不存在，则Feature
-    else:
-        try:
-            # 计算
-            mfcc_features = feature(file_path)
-            # 赋值
-            md5ToMFCC[file_md5] = mfcc_features
-        except:
-            print("Error:" + file_path)
-            fatalError.append(file_md5)
-            fileQuant += 1
-            return
 
-    # 处理多声道的MFCC特征向量
-    # 如果声道数大于1，则平均混合
-    if len(mfcc_features.shape) > 1:
-        mfcc_features = np.mean(mfcc_features, axis=1)  # 平均混合多个声道
+def bounded_map(executor, func, items, window):
+    """
+    类似 executor.map，但最多同时提交 window 个任务，按完成顺序返回结果
 
-    pathToMFCC[file_path] = mfcc_features
-    fileQuant += 1  # 对文件数进行计数
+    上游是生成器时只在有空位时才取下一项，下游处理不过来时上游随之暂停，内存占用保持平稳
+    """
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(func, item))
+        if len(pending) >= window:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
 
 
-def process_audio_folder(folder_path, threads):
+def feature_store_name(embedding=None):
+    return f"mfcc-{embedding}" if embedding else "mfcc"
+
+
+def migrate_mfcc_npy(embedding=None):
+    """
+    将当前目录下旧版的 MFCC.npy 导入特征库，导入后重命名为 .migrated
+
+    完整的 MFCC 导入 mfcc 特征库；使用定长向量时同时导入汇聚后的向量
+    """
+    if not os.path.exists("MFCC.npy"):
+        return
+    old_features = np.load("MFCC.npy", allow_pickle=True).item()
+    with FeatureStore(feature_store_name()) as store:
+        for file_md5, mfcc_features in old_features.items():
+            store.put(file_md5, mfcc_features)
+    if embedding:
+        with FeatureStore(feature_store_name(embedding)) as store:
+            for file_md5, mfcc_features in old_features.items():
+                store.put(file_md5, mfcc.embed(mfcc_features.reshape(N_MFCC, -1), embedding))
+    os.replace("MFCC.npy", "MFCC.npy.migrated")
+
+
+def process_audio_folder(folder_path, threads, embedding=None, prune=False):
     """
     处理音频文件夹并提取 MFCC 特征
 
+    特征按文件内容的 MD5 存放在 VAL.cache_path 下的特征库中，运行期间分批写入。
+    扫描、计算MD5、提取特征和写入特征库流水线进行：MD5 在线程池中计算并按文件状态缓存，
+    特征在进程池中提取，各阶段同时处理的文件数有上限，计数和结果只在主线程中更新。
+
     参数:
         folder_path (str): 音频文件夹路径
+        threads (int): 计算MD5的线程数，同时也是提取特征的进程数
+        embedding (str): 定长向量的汇聚方式（见 mfcc.embed），留空则使用展平的完整 MFCC
+        prune (bool): 是否从特征库中清除本次未扫描到的文件的特征，仅在每次都扫描整个音乐库时使用
 
     返回:
-       Dict[str, numpy.ndarray]: 文件路径到 MFCC 特征向量的映射
+       tuple: (排序后的文件路径列表, 按路径顺序排列的 float32 特征矩阵（见 FeatureStore.matrix）, 文件数,
+       无法读取或提取特征失败的文件路径列表)
     """
-    global md5ToMFCC, pathToMFCC, fileQuant, fatalError
-    md5ToMFCC = {}
-    pathToMFCC = {}
-    fileQuant = 0
-    fatalError = []
+    migrate_mfcc_npy(embedding)
+    with FeatureStore(feature_store_name(embedding)) as featureStore:
+        extensions = ('.wav', '.mp3', '.flac', '.ogg', '.aac', '.m4a')
+
+        pathToMD5 = {}
+        fatalError = []
+        waiting = {}        # 正在提取的 MD5 到文件路径列表的映射，相同内容的文件只提取一次
+        pending = {}        # 进程池任务到 MD5 的映射
+
+        def store_result(future):
+            # 写入阶段：只在主线程中写入特征库
+            file_md5 = pending.pop(future)
+            paths = waiting.pop(file_md5)
+            vector = future.result()
+            if vector is None:
+                for file_path in paths:
+                    print("Error:" + file_path)
+                # 相同内容的文件都记为失败
+                fatalError.extend(paths)
+                METRICS.count("features_failed")
+            else:
+                featureStore.put(file_md5, vector)
+                METRICS.count("features_extracted")
+                pathToMD5.update((file_path, file_md5) for file_path in paths)
+            progress.update(len(paths))
+
+        # 扫描 → stat/查询缓存 → 计算MD5（线程池） → 解码提取特征（进程池） → 写入特征库
+        with StatCache("file-md5") as hash_cache, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=threads) as io_pool, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=threads) as feature_pool, \
+                tqdm(desc="MFCC.Progress", unit="file") as progress:
+            file_paths = (entry.path for entry in scanner.scan(folder_path, extensions))
+            hashed = bounded_map(io_pool, partial(hash_entry, hash_cache=hash_cache), file_paths, threads * 4)
+            for file_path, file_md5 in hashed:
+                if file_md5 is None:
+                    print("Error:" + file_path)
+                    fatalError.append(file_path)
+                    METRICS.count("hash_errors")
+                    progress.update()
+                elif file_md5 in waiting:
+                    waiting[file_md5].append(file_path)
+                elif file_md5 in featureStore:
+                    pathToMD5[file_path] = file_md5
+                    progress.update()
+                    METRICS.count("features_cached")
+                else:
+                    waiting[file_md5] = [file_path]
+                    pending[feature_pool.submit(extract_vector, file_path, embedding)] = file_md5
+                    # 进程池中最多保留两倍进程数的任务，多余的文件在上游等待
+                    while len(pending) >= threads * 2:
+                        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            store_result(future)
+            for future in concurrent.futures.as_completed(list(pending)):
+                store_result(future)
+            fileQuant = progress.n
+
+        with METRICS.timer("feature_store_save"):
+            featureStore.flush()
+            # 被覆盖的旧数据超过一半时自动整理
+            live_keys = set(pathToMD5.values()) if prune else set(featureStore.index)
+            if prune or featureStore.stale_bytes(live_keys) * 2 > featureStore.stale_bytes(()):
+                featureStore.compact(live_keys)
+        # 按扫描路径排序，结果与扫描顺序无关；全部写入后再从特征库读出，不在内存中保留新提取的特征
+        paths = sorted(pathToMD5)
+        matrix = featureStore.matrix(pathToMD5[file_path] for file_path in paths)
 
-    if os.path.exists("MFCC.npy"):
-        md5ToMFCC = np.load("MFCC.npy", allow_pickle=True).item()
+    print("完成特征向量提取，正在进行聚类...")
+    return paths, matrix, fileQuant, sorted(fatalError)
 
-    file_paths = []
-    for root, _, files in os.walk(folder_path):
-        for filename in files:
-            if filename.lower().endswith(('.wav', '.mp3', '.flac', '.ogg', '.aac', '.m4a')):
-                file_path = os.path.join(root, filename)
-                file_paths.append(file_path)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
-        results = list(tqdm(executor.map(process_file, file_paths), total=len(file_paths), desc="MFCC.Progress"))
+def perform_ann_clustering(paths, matrix, min_similarity=0.98, k=10, n_tables=16):
+    """
+    用近似近邻索引生成候选边，以连通分量作为聚类结果
 
-    np.save("MFCC.npy", md5ToMFCC)
+    不会像 K-Means 预分类那样把相似的文件拆到不同的簇中，耗时随文件数近似线性增长
 
-    print("完成特征向量提取，正在进行聚类...")
-    return pathToMFCC, fileQuant, fatalError
+    参数:
+        paths (list): 文件路径列表
+        matrix (numpy.ndarray): 与 paths 逐行对应的 (文件数 × 维数) 特征矩阵
+        min_similarity (float): 按维度标准化后的余弦相似度阈值，见 ann.nearest_neighbors
+        k (int): 每个文件保留的近邻数
+        n_tables (int): 哈希表数量，越多召回率越高
+
+    返回:
+        tuple: (聚类结果, 形成各簇的候选文件对列表)
+    """
+    if not paths:
+        return [], []
+    # 由 ann 按维度标准化，不在这里做L2归一化
+    edges = ann.candidate_edges(matrix, k=k, min_similarity=min_similarity, n_tables=n_tables)
+    components = ann.connected_components(len(paths), edges)
+    return [[paths[i] for i in component] for component in components], [(paths[i], paths[j]) for i, j in edges]
 
 
 # 主程序
-def main(folder_path, threshold=0.12, threads=8, debug=False):
-    pathToMFCC, fileQuant, fatalError = process_audio_folder(folder_path, threads)       # 完成MFCC
-    clusters = perform_hierarchical_clustering(pathToMFCC, threshold, fileQuant)    # 进行聚类
+def main(folder_path, threshold=0.12, threads=8, debug=False, embedding="stats", engine="ann", min_similarity=0.98,
+         k=10, n_tables=16):
+    """
+    参数:
+        folder_path (str): 音频文件夹路径
+        threshold (float): kmeans 方式下层次聚类的距离阈值
+        threads (int): 线程数
+        debug (bool): 是否输出全部聚类结果
+        embedding (str): 定长向量的汇聚方式，留空则使用展平的完整 MFCC
+        engine (str): 聚类方式，ann 为近似近邻索引，kmeans 为 K-Means 预分类加层次聚类
+        min_similarity (float): ann 方式下按维度标准化后的余弦相似度阈值
+        k (int): ann 方式下每个文件保留的近邻数
+        n_tables (int): ann 方式下的哈希表数量，用于调节召回率
+
+    返回:
+        tuple: (重复候选簇列表, 提取特征失败的文件列表, 候选文件对列表)。候选文件对是 ann 方式下形成各簇的近邻边，
+        可传给 verify.verify_clusters 只验证这些文件对；kmeans 方式下为 None
+    """
+    with METRICS.timer("features"):
+        paths, matrix, fileQuant, fatalError = process_audio_folder(folder_path, threads, embedding)   # 完成MFCC
+    with METRICS.timer("cluster", engine=engine):
+        if engine == "ann":
+            clusters, pairs = perform_ann_clustering(paths, matrix, min_similarity, k, n_tables)
+        else:
+            clusters = perform_hierarchical_clustering(paths, matrix, threshold, fileQuant)    # 进行聚类
+            pairs = None
     # 输出结果
     duplicateList = []
     for i, cluster in enumerate(clusters):
         if debug or (len(cluster) > 1):
             duplicateList.append(cluster)
-    return duplicateList, fatalError
+    return duplicateList, fatalError, pairs
 
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+import numpy as np
+
+# 桶内相似度按该大小分块计算，限制超大桶的内存占用
+BLOCK_SIZE = 2048
+
+
+def auto_bits(n):
+    """
+    根据向量数选择每张哈希表的位数，使平均桶大小保持在几十个左右
+    """
+    return int(np.clip(np.log2(max(n, 1)) - 5, 4, 24))
+
+
+def standardize(matrix):
+    """
+    按维度做 z-score 标准化后按行L2归一化
+
+    MFCC 汇聚向量各维度的量级相差很大，并且整体偏向同一方向，直接计算余弦相似度时不相关的音频也可能接近1；
+    标准化后余弦相似度只反映各维度相对整个曲库的偏离。统计量来自输入本身，不同的向量很少（十个以下）时
+    同一录音的不同编码也会被拉开，召回率下降。标准差为0的维度只减去均值，全零行保持为零
+
+    参数:
+        matrix (numpy.ndarray): 特征矩阵，每行一个向量
+
+    返回:
+        numpy.ndarray: float32 矩阵
+    """
+    matrix = np.nan_to_num(np.asarray(matrix, dtype=np.float64))
+    std = matrix.std(axis=0)
+    std[std == 0] = 1
+    matrix = (matrix - matrix.mean(axis=0)) / std
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1
+    return (matrix / norms[:, None]).astype(np.float32)
+
+
+def hash_codes(centered, n_bits, rng):
+    """
+    随机超平面投影（SimHash），每个向量得到一个 n_bits 位的整数编码，夹角越小编码越可能相同
+    """
+    planes = rng.standard_normal((centered.shape[1], n_bits)).astype(np.float32)
+    codes = np.zeros(len(centered), dtype=np.int64)
+    for start in range(0, len(centered), BLOCK_SIZE):
+        bits = centered[start:start + BLOCK_SIZE] @ planes > 0
+        codes[start:start + BLOCK_SIZE] = bits @ (1 << np.arange(n_bits, dtype=np.int64))
+    return codes
+
+
+def buckets(codes):
+    """
+    按编码分桶，只返回包含多个向量的桶
+
+    返回:
+        generator: 桶内向量下标数组
+    """
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+    for bucket in np.split(order, bounds):
+        if len(bucket) > 1:
+            yield bucket
+
+
+def bucket_neighbors(matrix, bucket, k, min_similarity):
+    """
+    计算桶内向量的精确余弦相似度，为每个向量保留相似度不低于 min_similarity 的前 k 个邻居
+
+    返回:
+        generator: (i, j, 相似度)
+    """
+    for start in range(0, len(bucket), BLOCK_SIZE):
+        rows = bucket[start:start + BLOCK_SIZE]
+        similarity = matrix[rows] @ matrix[bucket].T
+        # 排除自身
+        similarity[np.arange(len(rows)), np.arange(start, start + len(rows))] = -np.inf
+        kk = min(k, len(bucket) - 1)
+        top = np.argpartition(-similarity, kk - 1, axis=1)[:, :kk]
+        top_sim = np.take_along_axis(similarity, top, axis=1)
+        for r, c in zip(*np.nonzero(top_sim >= min_similarity)):
+            yield rows[r], bucket[top[r, c]], top_sim[r, c]
+
+
+def nearest_neighbors(matrix, k=10, min_similarity=0.98, n_tables=16, n_bits=None, seed=0):
+    """
+    用随机投影局部敏感哈希为每个向量查找近似的前 k 个近邻
+
+    每张哈希表把夹角相近的向量分到同一个桶，只在桶内计算精确相似度，总耗时与向量数近似线性。
+    哈希和相似度都基于 standardize() 的结果，避免特征整体偏向同一方向时大部分向量落入同一个桶、
+    不相关的向量也超过阈值。
+
+    参数:
+        matrix (numpy.ndarray): 特征矩阵，每行一个向量，无需预先归一化
+        k (int): 每个向量保留的近邻数，默认为10
+        min_similarity (float): 标准化后的余弦相似度阈值，默认为0.98。在合成曲目和实际曲库上，
+            同一录音的不同编码不低于0.995，不相关的曲目最高约0.978（均为平稳噪声类信号）
+        n_tables (int): 哈希表数量，越多召回率越高、耗时越长，默认为16
+        n_bits (int): 每张哈希表的位数，越少桶越大、召回率越高，留空则按向量数自动选择
+        seed (int): 随机种子
+
+    返回:
+        dict: 向量下标到 [(近邻下标, 相似度), ...] 的映射，按相似度从高到低排列
+    """
+    matrix = standardize(matrix)
+    n_bits = n_bits or auto_bits(len(matrix))
+    rng = np.random.default_rng(seed)
+
+    neighbors = {}
+    for _ in range(n_tables):
+        for bucket in buckets(hash_codes(matrix, n_bits, rng)):
+            for i, j, similarity in bucket_neighbors(matrix, bucket, k, min_similarity):
+                neighbors.setdefault(int(i), {})[int(j)] = float(similarity)
+
+    return {i: sorted(found.items(), key=lambda item: -item[1])[:k] for i, found in neighbors.items()}
+
+
+def connected_components(n, edges):
+    """
+    并查集求连通分量
+
+    参数:
+        n (int): 节点数
+        edges (iterable): (i, j) 边
+
+    返回:
+        list: 每个连通分量的节点下标列表，包括单个节点
+    """
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in edges:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[root_j] = root_i
+
+    components = {}
+    for x in range(n):
+        components.setdefault(find(x), []).append(x)
+    return list(components.values())
+
+
+def candidate_edges(matrix, k=10, min_similarity=0.98, n_tables=16, n_bits=None, seed=0):
+    """
+    返回近似近邻构成的候选边，参数同 nearest_neighbors
+
+    完全相同的向量（内容相同的文件）先合并为一个，彼此之间总是有边，也不会重复计入标准化的统计量
+
+    返回:
+        list: 去重后的 (i, j) 边，i < j
+    """
+    matrix = np.nan_to_num(np.asarray(matrix, dtype=np.float32))
+    if len(matrix) == 0:
+        return []
+    unique, inverse = np.unique(matrix, axis=0, return_inverse=True)
+    members = {}
+    for index, u in enumerate(inverse.reshape(-1)):
+        members.setdefault(int(u), []).append(index)
+    edges = set()
+    for group in members.values():
+        edges.update((group[0], index) for index in group[1:])
+    for u, found in nearest_neighbors(unique, k, min_similarity, n_tables, n_bits, seed).items():
+        for v, _ in found:
+            i, j = members[u][0], members[v][0]
+            edges.add((min(i, j), max(i, j)))
+    return sorted(edges)
+
+
+def ann_clusters(matrix, k=10, min_similarity=0.98, n_tables=16, n_bits=None, seed=0):
+    """
+    以 candidate_edges 的候选边求连通分量，得到重复候选簇，参数同 nearest_neighbors
+
+    返回:
+        list: 每个簇的向量下标列表，包括单个向量
+    """
+    return connected_components(len(matrix), candidate_edges(matrix, k, min_similarity, n_tables, n_bits, seed))
@@ -0,0 +1,77 @@
+import time
+import argparse
+
+import numpy as np
+
+from .ai import calculate_similarity_matrix, cosine_similarity
+
+
+def legacy_similarity_matrix(vectors):
+    """
+    原有的逐对计算实现，作为正确性和速度的对照
+    """
+    max_len = max(len(vector) for vector in vectors)
+    padded_vectors = [np.pad(vector, (0, max_len - len(vector))) for vector in vectors]
+    similarity_matrix = np.zeros((len(vectors), len(vectors)))
+    for i in range(len(vectors)):
+        for j in range(i, len(vectors)):
+            similarity = cosine_similarity(padded_vectors[i], padded_vectors[j])
+            similarity_matrix[i, j] = similarity
+            similarity_matrix[j, i] = similarity
+    return similarity_matrix
+
+
+def random_vectors(n, dim, rng):
+    # 模拟长度不一的特征向量
+    lengths = rng.integers(dim // 2, dim + 1, size=n)
+    return [rng.standard_normal(length).astype(np.float32) for length in lengths]
+
+
+def legacy_pair_seconds(vectors, samples=2000):
+    """
+    抽样测量原实现计算一对向量所需的时间，用于估算大簇的总耗时
+    """
+    max_len = max(len(vector) for vector in vectors)
+    padded = [np.pad(vector, (0, max_len - len(vector))) for vector in vectors[:64]]
+    start = time.perf_counter()
+    for k in range(samples):
+        cosine_similarity(padded[k % len(padded)], padded[(k * 7 + 1) % len(padded)])
+    return (time.perf_counter() - start) / samples
+
+
+def benchmark_similarity(sizes=(1000, 2000, 5000, 10000, 20000), dim=1024, block_size=2048, seed=0):
+    """
+    对比分块矩阵乘法与原有逐对实现计算相似度矩阵的耗时
+
+    原实现在大簇上需要数小时，因此按抽样得到的单对耗时乘以 n(n+1)/2 估算
+
+    参数:
+        sizes (tuple): 测试的簇大小
+        dim (int): 最大向量长度
+        block_size (int): 分块大小
+        seed (int): 随机种子
+    """
+    rng = np.random.default_rng(seed)
+
+    # 先在小规模数据上确认结果一致
+    check = random_vectors(200, dim, rng)
+    error = np.nanmax(np.abs(calculate_similarity_matrix(check, block_size=64) - legacy_similarity_matrix(check)))
+    print(f"与原实现的最大误差：{error:.2e}")
+
+    print(f"{'簇大小':>8} {'新实现(s)':>12} {'原实现估算(s)':>14} {'加速比':>10}")
+    for n in sizes:
+        vectors = random_vectors(n, dim, rng)
+        start = time.perf_counter()
+        calculate_similarity_matrix(vectors, block_size=block_size)
+        elapsed = time.perf_counter() - start
+        legacy = legacy_pair_seconds(vectors) * n * (n + 1) / 2
+        print(f"{n:>8} {elapsed:>12.3f} {legacy:>14.1f} {legacy / elapsed:>9.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="相似度矩阵性能测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000, 10000, 20000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--block-size", type=int, default=2048)
+    args = parser.parse_args()
+    benchmark_similarity(args.sizes, args.dim, args.block_size)
@@ -0,0 +1,228 @@
+import os
+import filecmp
+import threading
+
+from runtime.metrics import METRICS
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，不支持 reflink
+    fcntl = None
+
+# Linux 的 FICLONE ioctl：让目标文件与源文件共享数据块（Btrfs、XFS 等支持写时复制的文件系统）
+FICLONE = 0x40049409
+
+# 保留策略：每个簇中排序键最大的文件被保留
+POLICIES = {
+    # 码率最高，其次文件最大、路径最短
+    "highest-bitrate": lambda path, info: (info.get("bitrate") or 0, info.get("size") or 0, -len(path)),
+    # 路径最短，其次码率最高
+    "shortest-path": lambda path, info: (-len(path), info.get("bitrate") or 0),
+    # 文件最大，其次路径最短
+    "largest": lambda path, info: (info.get("size") or 0, -len(path)),
+}
+
+
+def choose_keeper(cluster, policy, info_cache):
+    """
+    按保留策略选出簇中要保留的文件，已不存在的文件不参与选择
+
+    返回:
+        str | None: 保留的文件路径，簇中的文件都不存在时返回 None
+    """
+    key = POLICIES[policy]
+    candidates = []
+    for path in cluster:
+        info = info_cache.get(path)
+        if "error" not in info:
+            candidates.append((key(path, info), path))
+    return max(candidates)[1] if candidates else None
+
+
+def delete_file(keeper, path):
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
+
+
+def replace_with(path, make_copy):
+    """
+    用 make_copy(临时路径) 生成的文件原子地替换 path，失败时删除临时文件
+    """
+    temp_path = path + ".dedup-tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        make_copy(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def check_identical(keeper, path):
+    # 链接会让两个路径共享同一份数据，只用于逐字节相同的文件（音频哈希相同但标签不同的文件不适用）
+    if not filecmp.cmp(keeper, path, shallow=False):
+        raise ValueError("文件内容与保留的文件不完全相同，无法链接")
+
+
+def hardlink_file(keeper, path):
+    # 已经是同一个文件时返回 None，不计入处理数
+    if os.path.samefile(keeper, path):
+        return None
+    check_identical(keeper, path)
+    size = os.path.getsize(path)
+    replace_with(path, lambda temp_path: os.link(keeper, temp_path))
+    return size
+
+
+def reflink(source, target):
+    if fcntl is None:
+        raise OSError("当前系统不支持 reflink")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def reflink_file(keeper, path):
+    if os.path.samefile(keeper, path):
+        return None
+    check_identical(keeper, path)
+    size = os.path.getsize(path)
+    replace_with(path, lambda temp_path: reflink(keeper, temp_path))
+    return size
+
+
+ACTIONS = {
+    "delete": delete_file,
+    "hardlink": hardlink_file,
+    "reflink": reflink_file,
+}
+
+
+class BulkJob:
+    """
+    在后台线程中对一组簇执行批量操作：每个簇按策略保留一个文件，其余文件删除或替换为指向保留文件的链接
+
+    硬链接和 reflink 保留每个路径，播放列表不受影响，只适用于逐字节相同的文件。
+    进度通过 snapshot() 读取，可随时 cancel()。
+
+    参数:
+        clusters (list): 簇列表，每个簇为路径列表
+        policy (str): 保留策略，见 POLICIES
+        action (str): 操作，见 ACTIONS
+        info_cache (InfoCache): 元数据缓存，用于按码率、大小选择
+        dry_run (bool): 只生成计划，不修改文件
+        on_finish (callable): 处理结束后、设置结束状态前在工作线程中调用，参数为本任务
+    """
+
+    def __init__(self, clusters, policy, action, info_cache, dry_run=False, on_finish=None):
+        if policy not in POLICIES:
+            raise ValueError(f"不支持的保留策略：{policy}")
+        if action not in ACTIONS:
+            raise ValueError(f"不支持的操作：{action}")
+        self.clusters = clusters
+        self.policy = policy
+        self.action = action
+        self.info_cache = info_cache
+        self.dry_run = dry_run
+        self.done = 0
+        self.files = 0
+        self.freed_bytes = 0
+        self.plan = []
+        self.errors = []
+        self.processed = []
+        self.status = "pending"
+        self.on_finish = on_finish
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.status = "running"
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def finished(self):
+        return self.status in ("finished", "cancelled", "failed")
+
+    def _run(self):
+        status = self._process()
+        # on_finish 执行完后才设置结束状态，轮询方看到结束时其结果（例如更新后的重复列表）已经生效
+        if self.on_finish is not None:
+            try:
+                self.on_finish(self)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append({"path": None, "error": str(e)})
+                status = "failed"
+        self.status = status
+
+    def _process(self):
+        """
+        处理全部簇
+
+        返回:
+            str: 结束状态，finished、cancelled 或 failed
+        """
+        act = ACTIONS[self.action]
+        try:
+            for cluster in self.clusters:
+                if self._cancel.is_set():
+                    return "cancelled"
+                keeper = choose_keeper(cluster, self.policy, self.info_cache)
+                targets = [path for path in cluster if path != keeper] if keeper else []
+                with self._lock:
+                    self.plan.append({"keep": keeper, "targets": targets})
+                for path in targets:
+                    if self.dry_run:
+                        continue
+                    try:
+                        freed = act(keeper, path)
+                    except (OSError, ValueError) as e:
+                        with self._lock:
+                            self.errors.append({"path": path, "error": str(e)})
+                        continue
+                    if freed is None:
+                        continue
+                    METRICS.count("bulk_files", action=self.action)
+                    METRICS.count("bytes_freed", freed, action=self.action)
+                    with self._lock:
+                        self.files += 1
+                        self.freed_bytes += freed
+                        self.processed.append(path)
+                with self._lock:
+                    self.done += 1
+            return "finished"
+        except Exception as e:
+            with self._lock:
+                self.errors.append({"path": None, "error": str(e)})
+            return "failed"
+
+    def snapshot(self, plan=False):
+        """
+        返回当前进度
+
+        参数:
+            plan (bool): 是否包含每个簇的保留文件和处理对象
+        """
+        with self._lock:
+            result = {
+                "status": self.status,
+                "policy": self.policy,
+                "action": self.action,
+                "dry_run": self.dry_run,
+                "total": len(self.clusters),
+                "done": self.done,
+                "files": self.files,
+                "freed_bytes": self.freed_bytes,
+                "errors": list(self.errors),
+            }
+            if plan:
+                result["plan"] = list(self.plan)
+        return result
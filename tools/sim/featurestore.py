@@ -0,0 +1,209 @@
+import os
+import threading
+
+import numpy as np
+
+from runtime import VAL
+
+INDEX_FILE = "index.tsv"
+
+
+class FeatureStore:
+    """
+    追加写入的特征库，存放于 VAL.cache_path/features/<name>
+
+    特征以 float32 连续写入分片文件 shard-XXXXX.f32，索引文件 index.tsv 每行记录
+    "内容哈希  分片号  偏移  长度"（偏移和长度以 float32 个数计）。启动时只读取索引，
+    特征通过 np.memmap 按需映射；新特征先暂存在内存中，积累到 flush_every 条后追加写入，
+    先写数据再写索引，进程中断最多丢失未写入的一批。同一哈希被重复写入或不再使用时，
+    旧数据由 compact 清理。
+
+    参数:
+        name (str): 特征库名称，不同种类的特征分别存放
+        shard_bytes (int): 单个分片的最大字节数，默认为256MiB
+        flush_every (int): 暂存多少条特征后写入磁盘，默认为256
+    """
+
+    def __init__(self, name, shard_bytes=256 * 1024 * 1024, flush_every=256):
+        self.root = os.path.join(VAL.cache_path, "features", name)
+        os.makedirs(self.root, exist_ok=True)
+        self.shard_bytes = shard_bytes
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._maps = {}
+        self.index = self._read_index()
+        self._remove_orphans()
+        shards = self._shard_ids()
+        self._shard = shards[-1] if shards else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self.index or key in self._pending
+
+    def __len__(self):
+        return len(self.index) + len([key for key in self._pending if key not in self.index])
+
+    def _shard_path(self, shard):
+        return os.path.join(self.root, f"shard-{shard:05d}.f32")
+
+    def _shard_ids(self):
+        return sorted(int(name[6:11]) for name in os.listdir(self.root)
+                      if name.startswith("shard-") and name.endswith(".f32"))
+
+    def _read_index(self):
+        index = {}
+        path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(path):
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                # 中断时可能留下不完整的最后一行
+                if len(fields) != 4 or not all(field.isdigit() for field in fields[1:]):
+                    continue
+                index[fields[0]] = (int(fields[1]), int(fields[2]), int(fields[3]))
+        return index
+
+    def _remove_orphans(self):
+        # 整理时仍被映射而未能删除的旧分片（Windows 下无法删除已映射的文件），在下次打开时清理
+        shards = self._shard_ids()
+        used = {shard for shard, _, _ in self.index.values()}
+        for shard in shards[:-1]:
+            if shard not in used:
+                try:
+                    os.remove(self._shard_path(shard))
+                except OSError:
+                    pass
+
+    def _map(self, shard):
+        shard_map = self._maps.get(shard)
+        if shard_map is None:
+            shard_map = self._maps[shard] = np.memmap(self._shard_path(shard), dtype=np.float32, mode="r")
+        return shard_map
+
+    def get(self, key):
+        """
+        读取特征，返回只读的内存映射视图，不存在时返回 None
+        """
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            shard, offset, length = entry
+            return self._map(shard)[offset:offset + length]
+
+    def put(self, key, vector):
+        """
+        写入特征，vector 会被展平并转换为 float32
+        """
+        vector = np.ascontiguousarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            self._pending[key] = vector
+            if len(self._pending) >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        entries = self._write_pending()
+        with open(os.path.join(self.root, INDEX_FILE), "a", encoding="utf-8") as f:
+            f.writelines(f"{key}\t{shard}\t{offset}\t{length}\n" for key, (shard, offset, length) in entries)
+
+    def _write_pending(self):
+        """
+        将暂存的特征追加写入分片，超过 shard_bytes 时换用新分片
+
+        返回:
+            list: 新写入的 (哈希, (分片号, 偏移, 长度))
+        """
+        if not self._pending:
+            return []
+        entries = []
+        shard_path = self._shard_path(self._shard)
+        offset = os.path.getsize(shard_path) // 4 if os.path.exists(shard_path) else 0
+        f = open(shard_path, "ab")
+        try:
+            for key, vector in self._pending.items():
+                if offset and (offset + len(vector)) * 4 > self.shard_bytes:
+                    f.close()
+                    self._shard += 1
+                    offset = 0
+                    f = open(self._shard_path(self._shard), "ab")
+                f.write(vector.tobytes())
+                entries.append((key, (self._shard, offset, len(vector))))
+                offset += len(vector)
+        finally:
+            f.close()
+        self.index.update(entries)
+        self._pending = {}
+        # 正在写入的分片长度已变化，下次读取时重新映射
+        for shard in {entry[0] for _, entry in entries}:
+            self._maps.pop(shard, None)
+        return entries
+
+    def matrix(self, keys):
+        """
+        将一组特征按顺序装入 (数量 × 最大维数) 的 float32 矩阵，较短的特征在末尾补零
+        """
+        keys = list(keys)
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        # 内存映射视图不复制数据，先取出再按最长的特征分配矩阵
+        vectors = [self.get(key) for key in keys]
+        result = np.zeros((len(vectors), max(len(vector) for vector in vectors)), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            result[i, :len(vector)] = vector
+        return result
+
+    def stale_bytes(self, live_keys):
+        """
+        返回分片中不属于 live_keys 的数据字节数，包括被覆盖的旧数据
+        """
+        total = sum(os.path.getsize(self._shard_path(shard)) for shard in self._shard_ids())
+        live = sum(self.index[key][2] for key in set(live_keys) if key in self.index) * 4
+        return total - live
+
+    def compact(self, live_keys):
+        """
+        只保留 live_keys 对应的特征，写入新的分片并重写索引
+        """
+        self.flush()
+        with self._lock:
+            old_shards = self._shard_ids()
+            old_index = self.index
+            self.index = {}
+            self._shard = (old_shards[-1] + 1) if old_shards else 0
+            for key in dict.fromkeys(live_keys):
+                if key not in old_index:
+                    continue
+                shard, offset, length = old_index[key]
+                self._pending[key] = np.array(self._map(shard)[offset:offset + length])
+                if len(self._pending) >= self.flush_every:
+                    self._write_pending()
+            self._write_pending()
+            self._maps = {}
+            # 先替换索引再删除旧分片，中断时旧分片只会残留而不会丢失数据
+            tmp_path = os.path.join(self.root, INDEX_FILE + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{key}\t{shard}\t{offset}\t{length}\n"
+                             for key, (shard, offset, length) in self.index.items())
+            os.replace(tmp_path, os.path.join(self.root, INDEX_FILE))
+            for shard in old_shards:
+                try:
+                    os.remove(self._shard_path(shard))
+                except OSError:
+                    pass
+
+    def close(self):
+        self.flush()
+        self._maps = {}
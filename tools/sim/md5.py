@@ -1,101 +1,521 @@
 import os
 import hashlib
 import json
+import mmap
+import tempfile
+import itertools
+import threading
 from tqdm import tqdm
 import subprocess
+import concurrent.futures
+from functools import partial
 
 from runtime import VAL
+from runtime.cache import StatCache
+from runtime.metrics import METRICS
+from ..audio.formats import audio_payload_range, flac_streaminfo, wav_info
+from ..audio.pcm import iter_pcm, read_blocks
+from ..probe import Prober
+from .. import scanner
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 cache = VAL.cache_path
 
+# 可选的摘要算法；xxh64 需要额外安装 xxhash
+DIGESTS = {
+    "md5": hashlib.md5,
+    "blake2b": hashlib.blake2b,
+    "xxh64": xxhash.xxh64 if xxhash else None,
+}
+# 流式哈希时 ffmpeg 输出到管道所用的封装格式
+STREAM_FORMATS = {
+    ".mp3": "mp3",
+    ".flac": "flac",
+}
+STREAM_BUFFER_SIZE = 1024 * 1024
+HASH_MODES = ("ffmpeg", "stream", "native", "streaminfo", "pcm")
+AUDIO_EXTENSIONS = ('.mp3', '.flac')
+# pcm 方式比较解码后的数据，可以跨格式查找无损音频的重复
+PCM_EXTENSIONS = AUDIO_EXTENSIONS + ('.wav', '.ape', '.wv', '.aiff', '.aif', '.tta')
+_local = threading.local()
+
+
+def find_duplicate_audio_files(root_dir, workers=None, batch_size=None, digest="md5", mode="ffmpeg", staged=True,
+                               edge_kib=64, pcm_format="s16le", pcm_channels=None):
+    """
+    查找内容重复的音频文件
+
+    参数:
+        root_dir (str): 音乐根目录
+        workers (int): 并行计算哈希的工作线程数，默认为CPU核心数；为1时逐个计算
+        batch_size (int): 每批提交的文件数，默认为 workers * 4
+        digest (str): 摘要算法，可选 md5 / blake2b / xxh64，默认为 md5
+        mode (str): 哈希方式，默认为 ffmpeg
+            ffmpeg: 使用 ffmpeg 清除 metadata 后写入临时文件再计算哈希
+            stream: 直接从 ffmpeg 管道读取数据计算哈希，不写临时文件
+            native: 直接定位 MP3/FLAC 文件中的音频数据并计算哈希，不启动 ffmpeg
+            streaminfo: FLAC 直接比较 STREAMINFO 中记录的解码后PCM数据MD5，其余同 native
+            pcm: 对解码后的PCM数据计算哈希，与编码格式和压缩等级无关，同时扫描WAV等无损格式
+        staged (bool): 是否先用文件头信息和首尾数据筛选候选文件，只对仍有冲突的文件计算完整哈希
+        edge_kib (int): 筛选时读取音频数据首尾各多少KiB，默认为64
+        pcm_format (str): pcm 方式下统一转换的采样格式，默认为 s16le，保留24位精度可使用 s32le
+        pcm_channels (int): pcm 方式下统一转换的声道数，留空则保持原声道布局
 
-def find_duplicate_audio_files(root_dir):
-    audio_files = {}
+    返回:
+        tuple: (重复文件列表, 读取或计算哈希失败的文件列表)，重复文件列表的每个元素为一组内容相同的文件路径
+    """
     duplicate_files = []
+    workers = workers or os.cpu_count() or 1
+    batch_size = batch_size or workers * 4
+    method = hash_method(digest, mode, pcm_format, pcm_channels)
+    hash_func = partial(calculate_hash, digest=digest, mode=mode, pcm_format=pcm_format, pcm_channels=pcm_channels)
+    pcm = mode == "pcm"
 
-    # 尝试读取保存的MD5值字典
-    md5_dict = read_md5_dict()
-
-    # 获取音频文件列表
-    audio_files_list = get_audio_files_list(root_dir)
-
-    # 遍历文件列表，并显示进度条
-    with tqdm(total=len(audio_files_list), desc='Processing') as pbar:
-        for file_path in audio_files_list:
-            # 检查是否存在对应的MD5值
-            if file_path in md5_dict:
-                audio_hash = md5_dict[file_path]
-            else:
-                audio_hash = calculate_md5(file_path)
-                # 更新MD5值字典
-                md5_dict[file_path] = audio_hash
-            if audio_hash in audio_files:
-                audio_files[audio_hash].append(file_path)
-            else:
-                audio_files[audio_hash] = [file_path]
-                save_md5_dict(md5_dict)
-            pbar.update(1)
+    # 扫描到的文件直接交给阶段1读取文件头，不等待扫描结束；扫描顺序不固定，结果在分组后排序
+    audio_files = iter_audio_files(root_dir, PCM_EXTENSIONS if pcm else AUDIO_EXTENSIONS)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        if staged:
+            # STREAMINFO 和 pcm 比较的是解码后的数据，不同压缩等级的文件首尾字节不同，跳过阶段2
+            candidates, failed = filter_candidates(audio_files, executor, batch_size, edge_kib,
+                                                   edge=mode not in ("streaminfo", "pcm"), pcm=pcm,
+                                                   channels=not (pcm and pcm_channels))
+        else:
+            candidates, failed = list(audio_files), []
+
+        # 计算完整哈希，由主线程统一写入缓存，避免多个线程同时写缓存
+        with StatCache(method) as hash_cache:
+            # 首次运行时导入旧版 JSON 缓存
+            migrate_md5_dict(hash_cache, method)
+            audio_hashes = cached_map(candidates, hash_cache, hash_func, executor, batch_size, 'Processing')
+        # 计算失败的文件不参与比较
+        failed += [file_path for file_path in candidates if file_path not in audio_hashes]
+        candidates = [file_path for file_path in candidates if file_path in audio_hashes]
 
     # 找到重复的文件
-    for audio_hash, files in audio_files.items():
-        if len(files) > 1:
-            duplicate_files.append(files)
+    with METRICS.timer("group"):
+        for files in group_files(candidates, audio_hashes):
+            if len(files) > 1:
+                duplicate_files.append(sorted(files))
+    METRICS.count("duplicate_clusters", len(duplicate_files))
+
+    return sorted(duplicate_files), sorted(failed)
+
+
+def filter_candidates(audio_files, executor, batch_size, edge_kib=64, edge=True, pcm=False, channels=True):
+    """
+    分阶段排除不可能重复的文件
+
+    阶段1：按编码、采样率、声道数和帧数分组，pcm 为 True 时不区分编码，channels 为 False 时不区分声道数；
+    阶段2：在阶段1仍有冲突的组内，按音频数据长度及首尾 edge_kib KiB 的哈希分组，edge 为 False 时跳过。
+    audio_files 可以是扫描过程中逐个产生文件的迭代器，阶段1与扫描同时进行。阶段1的文件头与 probe 命令共用缓存，
+    阶段2的结果按文件状态缓存。无法读取文件头的文件只会与同样无法读取的文件比较；
+    阶段2无法读取的文件所在的组整组交给完整哈希判断，由完整哈希记为失败。
+
+    返回:
+        tuple: (仍需计算完整哈希的文件列表, 阶段1无法访问的文件列表)
+    """
+    headers = probe_headers(audio_files, executor, batch_size, 'Stage1')
+    failed = [file_path for file_path, info in headers.items() if info is None]
+    audio_files_list = [file_path for file_path, info in headers.items() if info is not None]
+    header_keys = {file_path: header_key(file_path, headers[file_path], pcm, channels)
+                   for file_path in audio_files_list}
+    stage1_groups = [files for files in group_files(audio_files_list, header_keys) if len(files) > 1]
+    stage1 = [file_path for files in stage1_groups for file_path in files]
+    report_stage("阶段1（文件头）", len(audio_files_list), len(stage1))
+    if not edge:
+        return stage1, failed
+
+    with StatCache(f"stage2-{edge_kib}") as stage_cache:
+        edge_hashes = cached_map(stage1, stage_cache, partial(edge_hash, edge_kib=edge_kib), executor, batch_size,
+                                 'Stage2')
+    stage2 = []
+    for files in stage1_groups:
+        # 组内有文件无法定位音频数据时，整组交给完整哈希判断
+        if any(not edge_hashes.get(file_path) for file_path in files):
+            stage2.extend(files)
+            continue
+        for sub_files in group_files(files, edge_hashes):
+            if len(sub_files) > 1:
+                stage2.extend(sub_files)
+    report_stage("阶段2（首尾数据）", len(stage1), len(stage2))
+    return stage2, failed
+
+
+def report_stage(name, total, remaining):
+    print(f"{name}：{total}个文件中排除{total - remaining}个，剩余{remaining}个")
+
+
+def group_files(file_list, keys):
+    """
+    按键值对文件分组，组内保持原始文件顺序
+
+    返回:
+        list: 分组列表
+    """
+    groups = {}
+    for file_path in file_list:
+        key = keys[file_path]
+        if key in groups:
+            groups[key].append(file_path)
+        else:
+            groups[key] = [file_path]
+    return list(groups.values())
+
+
+def probe_headers(file_list, executor, batch_size, desc):
+    """
+    按批次用 Prober 读取文件头，结果写入 probe 缓存，文件未变化时直接取缓存值
+
+    参数:
+        file_list (iterable): 文件路径列表，也可以是迭代器，此时进度条不显示总数
+
+    返回:
+        dict: 按输入顺序的文件路径到 read_probe 结果的映射，扫描后被删除或无法访问的文件为 None
+    """
+    headers = {}
+    total = len(file_list) if isinstance(file_list, list) else None
+    files = iter(file_list)
+    with METRICS.timer("hash_stage", phase=desc), tqdm(total=total, desc=desc) as pbar, Prober(executor) as prober:
+        while batch := list(itertools.islice(files, batch_size)):
+            for file_path, info in prober.probe_many(batch).items():
+                if info is None:
+                    print("Error:" + file_path)
+                    METRICS.count("hash_errors")
+                headers[file_path] = info
+            pbar.update(len(batch))
+    return headers
+
+
+def cached_map(file_list, value_cache, func, executor, batch_size, desc):
+    """
+    按批次对文件列表并行计算 func，文件未变化时直接取缓存值
+
+    参数:
+        file_list (iterable): 文件路径列表，也可以是迭代器，此时进度条不显示总数
+
+    返回:
+        dict: 文件路径到计算结果的映射，计算失败的文件不在其中
+    """
+    values = {}
+    total = len(file_list) if isinstance(file_list, list) else None
+    files = iter(file_list)
+    with METRICS.timer("hash_stage", phase=desc), tqdm(total=total, desc=desc) as pbar:
+        while batch := list(itertools.islice(files, batch_size)):
+            values.update(hash_batch(batch, value_cache, executor, pbar, func))
+    return values
+
+
+def hash_batch(batch, hash_cache, executor, pbar, hash_func=None):
+    """
+    计算一批文件的哈希，文件未变化时直接取缓存值，新结果写入缓存
+
+    返回:
+        dict: 文件路径到哈希值的映射
+    """
+    hash_func = hash_func or calculate_md5
+    batch_hashes = {}
+    futures = {}
+    for file_path in batch:
+        # 检查是否存在对应的MD5值，文件状态变化时缓存失效；扫描后被删除或无法访问的文件记为失败
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            print("Error:" + file_path)
+            METRICS.count("hash_errors")
+            pbar.update(1)
+            continue
+        audio_hash = hash_cache.get(file_path, st)
+        if audio_hash is not None:
+            batch_hashes[file_path] = audio_hash
+            pbar.update(1)
+        else:
+            futures[executor.submit(hash_func, file_path)] = (file_path, st)
+    for future in concurrent.futures.as_completed(futures):
+        file_path, st = futures[future]
+        pbar.update(1)
+        try:
+            batch_hashes[file_path] = future.result()
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            # ValueError：文件头损坏、被截断
+            print("Error:" + file_path)
+            METRICS.count("hash_errors")
+            continue
+        hash_cache.put(file_path, batch_hashes[file_path], st)
+    return batch_hashes
+
 
-    # 保存MD5值字典
-    save_md5_dict(md5_dict)
+def header_key(file_path, info, pcm=False, channels=True):
+    """
+    由 read_probe 读取的文件头信息生成阶段1的分组键
 
-    return duplicate_files
+    默认按 [编码, 采样率, 声道数, 帧数] 分组，FLAC 直接使用总采样数；MP3 只按 [编码, 采样率, 声道数] 分组，
+    VBR 文件的时长由 Xing/Info 帧推算，同一音频数据有无该帧时时长不同；
+    pcm 为 True 时按 [采样率, 声道数, 总采样数] 分组，不区分编码
+    """
+    codec, sample_rate, file_channels = info["codec"], info["sample_rate"], info["channels"]
+    length, total_samples = info["duration"], info["total_samples"]
+    if codec is None or not sample_rate or length is None:
+        return ("?",) if pcm else ("?", os.path.splitext(file_path)[1].lower())
+    if not channels:
+        file_channels = None
+    if pcm:
+        return sample_rate, file_channels, total_samples or round(length * sample_rate)
+    if codec == "mp3":
+        return codec, sample_rate, file_channels
+    return codec, sample_rate, file_channels, total_samples or round(length * sample_rate)
 
 
-def get_audio_files_list(root_dir):
-    audio_files_list = []
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            file_path = os.path.join(dirpath, filename)
-            if is_audio_file(file_path):
-                audio_files_list.append(file_path)
-    return audio_files_list
+def edge_hash(file_path, edge_kib=64):
+    """
+    计算音频数据（不含标签）长度及首尾各 edge_kib KiB 的哈希，无法定位音频数据时返回空字符串
+    """
+    try:
+        payload = audio_payload_range(file_path)
+    except OSError:
+        payload = None
+    if payload is None:
+        return ""
+    start, end = payload
+    edge = edge_kib * 1024
+    hasher = hashlib.md5(str(end - start).encode())
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        hasher.update(f.read(min(edge, end - start)))
+        if end - start > edge:
+            f.seek(max(start + edge, end - edge))
+            hasher.update(f.read(end - max(start + edge, end - edge)))
+    METRICS.count("bytes_hashed", min(end - start, 2 * edge), stage="edge")
+    return hasher.hexdigest()
 
 
-def is_audio_file(file_path):
-    audio_extensions = ['.mp3', '.flac']
+def iter_audio_files(root_dir, audio_extensions=AUDIO_EXTENSIONS):
+    """
+    逐个返回扫描到的音频文件路径，顺序不固定
+    """
+    return (entry.path for entry in scanner.scan(root_dir, audio_extensions))
+
+
+def is_audio_file(file_path, audio_extensions=AUDIO_EXTENSIONS):
     _, ext = os.path.splitext(file_path)
     return ext.lower() in audio_extensions
 
 
-def calculate_md5(file_path):
+def hash_method(digest="md5", mode="ffmpeg", pcm_format="s16le", pcm_channels=None):
+    """
+    返回哈希方式的名称，不同方式得到的哈希值互不兼容，分别缓存
+
+    默认方式（md5，临时文件）沿用原有名称，已有缓存继续有效；
+    管道输出的MP3不含 ffmpeg 写入的 Xing 帧，native 方式不含封装头，因此其余方式均单独命名
+    """
+    if digest not in DIGESTS:
+        raise ValueError(f"不支持的摘要算法：{digest}")
+    if DIGESTS[digest] is None:
+        raise ValueError(f"摘要算法 {digest} 需要安装 xxhash")
+    if mode not in HASH_MODES:
+        raise ValueError(f"不支持的哈希方式：{mode}")
+    if mode == "pcm":
+        return f"{digest}-pcm-{pcm_format}" + (f"-{pcm_channels}ch" if pcm_channels else "")
+    return digest if mode == "ffmpeg" else f"{digest}-{mode}"
+
+
+def calculate_hash(file_path, digest="md5", mode="ffmpeg", pcm_format="s16le", pcm_channels=None):
+    extension = os.path.splitext(file_path)[1].lower()
+    if mode == "pcm":
+        return calculate_pcm_hash(file_path, digest, pcm_format, pcm_channels)
+    if mode == "streaminfo" and extension == ".flac":
+        info = flac_streaminfo(file_path)
+        if info and info["md5"]:
+            return "streaminfo:" + info["md5"]
+    if mode in ("native", "streaminfo"):
+        audio_hash = calculate_native_hash(file_path, digest)
+        if audio_hash is not None:
+            return audio_hash
+        # 无法定位音频数据时退回 ffmpeg
+        mode = "stream"
+    if mode == "stream" and extension in STREAM_FORMATS:
+        return calculate_stream_hash(file_path, digest)
+    return calculate_md5(file_path, digest)
+
+
+def calculate_native_hash(file_path, digest="md5"):
+    """
+    内存映射文件，只对音频数据部分（不含标签）计算哈希，不启动 ffmpeg
+
+    参数:
+        file_path (str): MP3 或 FLAC 文件路径
+        digest (str): 摘要算法
+
+    返回:
+        str | None: 哈希值，无法定位音频数据时返回 None
+    """
+    payload = audio_payload_range(file_path)
+    if payload is None:
+        return None
+    return hash_file_range(file_path, *payload, digest)
+
+
+def hash_file_range(file_path, start, end, digest="md5"):
+    """
+    内存映射文件，对 [start, end) 范围内的字节计算哈希
+    """
+    hasher = DIGESTS[digest]()
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            for offset in range(start, end, STREAM_BUFFER_SIZE * 8):
+                hasher.update(view[offset:min(offset + STREAM_BUFFER_SIZE * 8, end)])
+        finally:
+            view.release()
+    METRICS.count("bytes_hashed", end - start, stage="full")
+    return hasher.hexdigest()
+
+
+def calculate_pcm_hash(file_path, digest="md5", sample_fmt="s16le", channels=None):
+    """
+    对解码后的PCM数据计算哈希，同一母带的不同无损编码结果相同
+
+    16位的FLAC和WAV无需解码：FLAC 的 STREAMINFO MD5 与 s16le 数据的MD5相同，WAV 直接对 data 块计算哈希；
+    其余文件通过 ffmpeg 管道按固定大小的块解码
+
+    参数:
+        file_path (str): 音频文件路径
+        digest (str): 摘要算法
+        sample_fmt (str): 统一转换的采样格式
+        channels (int): 统一转换的声道数，留空则保持原声道布局
+
+    返回:
+        str: 哈希值
+    """
+    native_hash = native_pcm_hash(file_path, digest, sample_fmt, channels)
+    if native_hash is not None:
+        return native_hash
+    hasher = DIGESTS[digest]()
+    size = 0
+    for block in iter_pcm(file_path, buffer=thread_buffer(), sample_fmt=sample_fmt, channels=channels):
+        hasher.update(block)
+        size += len(block)
+    METRICS.count("bytes_hashed", size, stage="full")
+    return hasher.hexdigest()
+
+
+def native_pcm_hash(file_path, digest="md5", sample_fmt="s16le", channels=None):
+    """
+    不解码直接得到16位PCM数据的哈希，文件不满足条件时返回 None
+    """
+    if sample_fmt != "s16le":
+        return None
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".flac" and digest == "md5":
+        info = flac_streaminfo(file_path)
+        if info and info["md5"] and info["bits_per_sample"] == 16 and channels in (None, info["channels"]):
+            return info["md5"]
+    elif extension == ".wav":
+        info = wav_info(file_path)
+        if info and info["format_tag"] == 1 and info["bits_per_sample"] == 16 \
+                and channels in (None, info["channels"]) and info["data_size"] % info["block_align"] == 0:
+            start = info["data_offset"]
+            return hash_file_range(file_path, start, start + info["data_size"], digest)
+    return None
+
+
+def thread_buffer():
+    # 每个线程复用同一块缓冲区
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = _local.buffer = bytearray(STREAM_BUFFER_SIZE)
+    return buffer
+
+
+def calculate_stream_hash(file_path, digest="md5"):
+    """
+    清除 metadata 后直接从 ffmpeg 的标准输出读取音频流计算哈希，不写入磁盘
+
+    参数:
+        file_path (str): 音频文件路径
+        digest (str): 摘要算法
+
+    返回:
+        str: 哈希值
+    """
+    fmt = STREAM_FORMATS[os.path.splitext(file_path)[1].lower()]
+    hasher = DIGESTS[digest]()
+    ffmpeg_cmd = ['ffmpeg', '-i', file_path, '-map', '0:a', '-c:a', 'copy', '-map_metadata', '-1', '-f', fmt, '-']
+    size = 0
+    for block in read_blocks(ffmpeg_cmd, thread_buffer()):
+        hasher.update(block)
+        size += len(block)
+    METRICS.count("bytes_hashed", size, stage="full")
+    return hasher.hexdigest()
+
+
+def calculate_md5(file_path, digest="md5"):
     # 获取拓展名
     extension = os.path.splitext(file_path)[1]
     chunk_size = 4096
-    hash_md5 = hashlib.md5()
-    # 检查临时文件是否存在，如果有则删除
-    temp_file_path = os.path.join(cache, f"cache_file{extension}")
-    if os.path.exists(temp_file_path):
-        os.remove(temp_file_path)
+    hash_md5 = DIGESTS[digest]()
+    # 每次调用使用独立的临时文件，并行计算时互不覆盖
+    fd, temp_file_path = tempfile.mkstemp(prefix="cache_file_", suffix=extension, dir=cache)
+    os.close(fd)
 
-    # 使用FFmpeg清除所有metadata
-    ffmpeg_cmd = ['ffmpeg', '-i', file_path, '-map', '0:a', '-c:a', 'copy', '-map_metadata', '-1', temp_file_path]
-    subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    # 清除完成后，继续使用临时文件计算MD5
-    with open(temp_file_path, 'rb') as f:
-        chunk = f.read(chunk_size)
-        while chunk:
-            hash_md5.update(chunk)
+    try:
+        # 使用FFmpeg清除所有metadata
+        ffmpeg_cmd = ['ffmpeg', '-y', '-i', file_path, '-map', '0:a', '-c:a', 'copy', '-map_metadata', '-1',
+                      temp_file_path]
+        # ffmpeg 失败时临时文件为空，不能当作有效结果计算哈希，由 hash_batch 记为失败
+        with METRICS.timer("subprocess", tool="ffmpeg"):
+            subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        if os.path.getsize(temp_file_path) == 0:
+            raise subprocess.CalledProcessError(0, ffmpeg_cmd)
+        # 清除完成后，继续使用临时文件计算MD5
+        with open(temp_file_path, 'rb') as f:
             chunk = f.read(chunk_size)
-    # 删除临时文件
-    os.remove(temp_file_path)
+            while chunk:
+                hash_md5.update(chunk)
+                chunk = f.read(chunk_size)
+        METRICS.count("bytes_hashed", os.path.getsize(temp_file_path), stage="full")
+    finally:
+        # 删除临时文件
+        os.remove(temp_file_path)
     # 返回MD5
     return hash_md5.hexdigest()
 
 
-def read_md5_dict():
+def md5_dict_file(method="md5"):
+    return 'md5_dict.json' if method == "md5" else f'md5_dict.{method}.json'
+
+
+def read_md5_dict(method="md5"):
     md5_dict = {}
-    if os.path.exists('md5_dict.json'):
-        with open('md5_dict.json', 'r') as f:
+    file_name = md5_dict_file(method)
+    if os.path.exists(file_name):
+        with open(file_name, 'r') as f:
             md5_dict = json.load(f)
     return md5_dict
 
 
-def save_md5_dict(md5_dict):
-    with open('md5_dict.json', 'w') as f:
-        json.dump(md5_dict, f)
+def migrate_md5_dict(hash_cache, method="md5"):
+    """
+    将当前目录下旧版的 md5_dict.json 导入缓存数据库，导入后重命名为 .migrated
+
+    旧缓存只记录了路径，导入时以文件的当前状态作为键；已不存在的文件直接跳过
+    """
+    file_name = md5_dict_file(method)
+    if not os.path.exists(file_name):
+        return 0
+    count = 0
+    for file_path, audio_hash in read_md5_dict(method).items():
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            continue
+        if file_path not in hash_cache.entries:
+            hash_cache.put(file_path, audio_hash, st)
+            count += 1
+    hash_cache.flush()
+    os.replace(file_name, file_name + '.migrated')
+    return count
@@ -0,0 +1,210 @@
+import functools
+import concurrent.futures
+
+import numpy as np
+from scipy import fft
+from scipy.signal import get_window
+
+from ..audio.pcm import iter_pcm
+
+# 每次送入 rfft 的帧数，限制分帧加窗时的内存占用
+FRAME_BLOCK = 64
+
+
+def load_audio(path, target_sr=8000, max_duration=600):
+    """
+    通过 ffmpeg 管道将音频解码为单声道 float32 数据
+
+    参数:
+        path (str): 音频文件路径
+        target_sr (int): 目标采样率
+        max_duration (int): 最大持续时间（秒）
+
+    返回:
+        numpy.ndarray: 一维 float32 数组
+    """
+    data = bytearray()
+    for block in iter_pcm(path, sample_fmt="f32le", sample_rate=target_sr, channels=1, max_duration=max_duration):
+        data += block
+    return np.frombuffer(data, dtype="<f4", count=len(data) // 4).astype(np.float32)
+
+
+def preemphasis(y, coef=0.97):
+    """
+    预加重 y[n] - coef * y[n-1]，首个采样的处理与 librosa 一致（以 2 * y[0] - y[1] 作为滤波器初始状态）
+    """
+    if len(y) < 2:
+        return y.copy()
+    result = np.empty_like(y)
+    result[1:] = y[1:] - coef * y[:-1]
+    result[0] = y[0] + (2 * y[0] - y[1])
+    return result
+
+
+def normalize(y):
+    # 按最大绝对值归一化音量，静音数据保持不变
+    peak = np.max(np.abs(y)) if len(y) else 0
+    return y / peak if peak > 0 else y
+
+
+def hz_to_mel(frequencies):
+    # Slaney 梅尔刻度：1000Hz 以下线性，以上对数
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    mels = frequencies / f_sp
+    log_region = frequencies >= min_log_hz
+    mels[log_region] = min_log_mel + np.log(frequencies[log_region] / min_log_hz) / logstep
+    return mels
+
+
+def mel_to_hz(mels):
+    mels = np.atleast_1d(np.asarray(mels, dtype=np.float64))
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    freqs = f_sp * mels
+    log_region = mels >= min_log_mel
+    freqs[log_region] = min_log_hz * np.exp(logstep * (mels[log_region] - min_log_mel))
+    return freqs
+
+
+@functools.lru_cache(maxsize=8)
+def mel_filterbank(sr, n_fft, n_mels=128):
+    """
+    构建 Slaney 归一化的梅尔滤波器组，结果按参数缓存
+
+    返回:
+        numpy.ndarray: 形状为 (n_fft // 2 + 1, n_mels) 的 float32 矩阵
+    """
+    fft_freqs = np.fft.rfftfreq(n_fft, 1.0 / sr)
+    mel_f = mel_to_hz(np.linspace(hz_to_mel(0.0)[0], hz_to_mel(sr / 2.0)[0], n_mels + 2))
+    fdiff = np.diff(mel_f)
+    ramps = mel_f[:, None] - fft_freqs[None, :]
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    weights *= (2.0 / (mel_f[2:] - mel_f[:-2]))[:, None]
+    return np.ascontiguousarray(weights.T, dtype=np.float32)
+
+
+@functools.lru_cache(maxsize=8)
+def hann_window(n_fft):
+    return get_window("hann", n_fft, fftbins=True).astype(np.float32)
+
+
+def mel_power(y, sr, n_fft, hop_length, n_mels=128):
+    """
+    计算梅尔功率谱，分帧方式与 librosa 的 center=True、pad_mode="constant" 一致
+
+    使用 sliding_window_view 构建帧视图，每次对 FRAME_BLOCK 帧加窗后做 rfft
+
+    返回:
+        numpy.ndarray: 形状为 (n_mels, 帧数) 的 float32 矩阵
+    """
+    y = np.pad(y, n_fft // 2)
+    if len(y) < n_fft:
+        y = np.pad(y, (0, n_fft - len(y)))
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop_length]
+    window = hann_window(n_fft)
+    filterbank = mel_filterbank(sr, n_fft, n_mels)
+    result = np.empty((len(frames), n_mels), dtype=np.float32)
+    for start in range(0, len(frames), FRAME_BLOCK):
+        spectrum = fft.rfft(frames[start:start + FRAME_BLOCK] * window, axis=-1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        result[start:start + FRAME_BLOCK] = power @ filterbank
+    return result.T
+
+
+def power_to_db(power, amin=1e-10, top_db=80.0):
+    log_spec = 10.0 * np.log10(np.maximum(amin, power))
+    return np.maximum(log_spec, log_spec.max() - top_db)
+
+
+def mfcc(y, sr, n_mfcc=30, n_fft=16384, hop_length=2048, n_mels=128):
+    """
+    计算 MFCC，与 librosa.feature.mfcc 的默认参数一致
+
+    返回:
+        numpy.ndarray: 形状为 (n_mfcc, 帧数) 的 float32 矩阵
+    """
+    log_mel = power_to_db(mel_power(y, sr, n_fft, hop_length, n_mels))
+    return fft.dct(log_mel, type=2, axis=0, norm="ortho")[:n_mfcc].astype(np.float32)
+
+
+def feature(path, target_sr=8000, n_mfcc=30, frame_size=16384, hop_length=2048, max_duration=600):
+    """
+    提取音频文件的 MFCC 特征
+
+    参数:
+        path (str): 音频文件路径
+        target_sr (int): 目标采样率，默认为8000
+        n_mfcc (int): MFCC的数量，默认为30
+        frame_size (int): 帧大小，默认为16384
+        hop_length (int): 帧之间的跳跃长度，默认为2048
+        max_duration (int): 最大持续时间（秒），默认为600秒（10分钟）
+
+    返回:
+        numpy.ndarray: 形状为 (n_mfcc, 帧数) 的 MFCC 矩阵
+    """
+    y = load_audio(path, target_sr, max_duration)
+    y = preemphasis(y)      # 预加重处理
+    y = normalize(y)        # 音量归一化
+    return mfcc(y, target_sr, n_mfcc=n_mfcc, n_fft=frame_size, hop_length=hop_length)
+
+
+def safe_feature(path, **kwargs):
+    # 在子进程中运行，解码失败时返回 None 而不是让整个进程池报错
+    try:
+        return feature(path, **kwargs)
+    except Exception:
+        return None
+
+
+def extract_features(paths, workers=None, **kwargs):
+    """
+    在进程池中批量提取 MFCC 特征，参数同 feature
+
+    参数:
+        paths (list): 音频文件路径列表
+        workers (int): 进程数，默认为CPU核心数
+
+    返回:
+        generator: 按输入顺序返回 (路径, MFCC 矩阵)，提取失败时矩阵为 None
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from zip(paths, executor.map(functools.partial(safe_feature, **kwargs), paths, chunksize=4))
+
+
+def embed(mfcc_features, mode="stats", n_segments=8):
+    """
+    将长度随时长变化的 MFCC 矩阵汇聚为定长的 float32 向量
+
+    参数:
+        mfcc_features (numpy.ndarray): 形状为 (n_mfcc, 帧数) 的 MFCC 矩阵
+        mode (str): 汇聚方式，默认为 stats
+            stats: 每个系数的均值、标准差，以及一阶差分的均值、标准差，长度为 4 * n_mfcc
+            segments: 按时间均分为 n_segments 段，每段求均值，长度为 n_segments * n_mfcc
+        n_segments (int): segments 方式的分段数，默认为8
+
+    返回:
+        numpy.ndarray: 一维 float32 向量
+    """
+    mfcc_features = np.asarray(mfcc_features, dtype=np.float32)
+    n_mfcc, n_frames = mfcc_features.shape
+    if mode == "stats":
+        delta = np.diff(mfcc_features, axis=1) if n_frames > 1 else np.zeros((n_mfcc, 1), dtype=np.float32)
+        parts = [mfcc_features.mean(axis=1), mfcc_features.std(axis=1), delta.mean(axis=1), delta.std(axis=1)]
+        return np.concatenate(parts).astype(np.float32)
+    if mode == "segments":
+        # 帧数少于分段数时，相邻的段使用同一帧
+        segments = []
+        for i in range(n_segments):
+            lo = i * n_frames // n_segments
+            hi = max((i + 1) * n_frames // n_segments, lo + 1)
+            segments.append(mfcc_features[:, lo:hi].mean(axis=1))
+        return np.concatenate(segments).astype(np.float32)
+    raise ValueError(f"不支持的汇聚方式：{mode}")
@@ -0,0 +1,240 @@
+import math
+import itertools
+import collections
+import concurrent.futures
+
+import numpy as np
+from scipy import fft
+from tqdm import tqdm
+
+from runtime.metrics import METRICS
+from . import mfcc
+from .ann import connected_components
+
+SAMPLE_RATE = 8000
+N_FFT = 2048
+HOP_LENGTH = 800                # 每帧100ms
+FRAME_BLOCK = 256
+# 计算色度的频率范围
+MIN_FREQ = 55.0
+MAX_FREQ = 3520.0
+
+
+def frame_seconds():
+    return HOP_LENGTH / SAMPLE_RATE
+
+
+def chroma_matrix():
+    """
+    频点到12个音级的映射矩阵
+
+    返回:
+        numpy.ndarray: 形状为 (N_FFT // 2 + 1, 12) 的 float32 矩阵
+    """
+    freqs = np.fft.rfftfreq(N_FFT, 1.0 / SAMPLE_RATE)
+    matrix = np.zeros((len(freqs), 12), dtype=np.float32)
+    valid = np.flatnonzero((freqs >= MIN_FREQ) & (freqs <= MAX_FREQ))
+    pitch = np.round(12 * np.log2(freqs[valid] / 440.0)).astype(np.int64) % 12
+    matrix[valid, pitch] = 1.0
+    return matrix
+
+
+CHROMA = chroma_matrix()
+
+
+def chroma(y):
+    """
+    计算逐帧的色度特征，每个音级减去全曲均值后按帧L2归一化
+
+    减去均值后，不相关的两段音频的逐帧余弦相似度在0附近，相同音频在1附近
+
+    返回:
+        numpy.ndarray: 形状为 (帧数, 12) 的 float32 矩阵
+    """
+    if len(y) < N_FFT:
+        y = np.pad(y, (0, N_FFT - len(y)))
+    frames = np.lib.stride_tricks.sliding_window_view(y, N_FFT)[::HOP_LENGTH]
+    window = mfcc.hann_window(N_FFT)
+    result = np.empty((len(frames), 12), dtype=np.float32)
+    for start in range(0, len(frames), FRAME_BLOCK):
+        spectrum = fft.rfft(frames[start:start + FRAME_BLOCK] * window, axis=-1)
+        result[start:start + FRAME_BLOCK] = (spectrum.real ** 2 + spectrum.imag ** 2) @ CHROMA
+    result = np.log1p(result)
+    result -= result.mean(axis=0)
+    norms = np.linalg.norm(result, axis=1, keepdims=True)
+    return result / np.where(norms > 0, norms, 1)
+
+
+def track_chroma(path, max_duration=600):
+    """
+    解码音频文件并计算色度特征，在子进程中运行，解码失败时返回 None
+    """
+    try:
+        return chroma(mfcc.load_audio(path, SAMPLE_RATE, max_duration))
+    except Exception:
+        return None
+
+
+def cross_correlate(a, b, min_overlap=0.5):
+    """
+    用FFT计算两段色度特征在所有时间偏移上的互相关，取重叠部分平均相似度最高的偏移
+
+    参数:
+        a (numpy.ndarray): 形状为 (n, 12) 的色度特征
+        b (numpy.ndarray): 形状为 (m, 12) 的色度特征
+        min_overlap (float): 只考虑重叠部分不少于较短一方该比例的偏移
+
+    返回:
+        tuple: (分数, 偏移帧数)。偏移为正表示 b 的开头对齐 a 的第 offset 帧，即 a 多出一段前奏
+    """
+    n, m = len(a), len(b)
+    length = fft.next_fast_len(n + m - 1, real=True)
+    spectrum = (fft.rfft(a, length, axis=0) * np.conj(fft.rfft(b, length, axis=0))).sum(axis=1)
+    corr = fft.irfft(spectrum, length)
+    # corr[k] 为 a[i + k] 与 b[i] 的内积之和，负偏移位于数组末尾
+    lags = np.concatenate((np.arange(n), np.arange(-(m - 1), 0)))
+    corr = np.concatenate((corr[:n], corr[length - (m - 1):]))
+    overlap = np.where(lags >= 0, np.minimum(n - lags, m), np.minimum(n, m + lags))
+    valid = overlap >= max(1, int(min_overlap * min(n, m)))
+    score = np.where(valid, corr / np.maximum(overlap, 1), -np.inf)
+    best = int(np.argmax(score))
+    return float(score[best]), int(lags[best])
+
+
+class ChromaCache:
+    """
+    按路径缓存色度特征的LRU缓存，一个文件出现在多个候选对中时只解码一次
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def get(self, path):
+        self.entries.move_to_end(path)
+        return self.entries[path]
+
+    def put(self, path, value):
+        self.entries[path] = value
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+def verify_pairs(pairs, workers=None, batch_size=256, cache_size=1024, min_overlap=0.5, max_duration=600):
+    """
+    对候选文件对逐一做时间偏移互相关验证
+
+    候选对按批处理：先在进程池中解码本批中尚未缓存的文件，再在线程池中计算互相关。
+    同一簇中的文件对相邻排列，缓存命中率较高。
+
+    参数:
+        pairs (list): [(路径a, 路径b), ...]
+        workers (int): 解码的进程数和计算互相关的线程数，默认为CPU核心数
+        batch_size (int): 每批的候选对数
+        cache_size (int): 内存中最多缓存的色度特征数，需不小于单批涉及的文件数
+        min_overlap (float): 见 cross_correlate
+        max_duration (int): 每个文件最多解码的时长（秒）
+
+    返回:
+        generator: (路径a, 路径b, 分数, 偏移秒数)，无法解码的文件分数为 None
+    """
+    cache = ChromaCache(max(cache_size, batch_size * 2))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as decode_pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers) as correlate_pool:
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            missing = []
+            for path in dict.fromkeys(itertools.chain.from_iterable(batch)):
+                if path in cache:
+                    cache.get(path)     # 标记为最近使用，避免在本批中被淘汰
+                else:
+                    missing.append(path)
+            with METRICS.timer("verify_decode"):
+                for path, features in zip(missing, decode_pool.map(track_chroma, missing,
+                                                                   itertools.repeat(max_duration))):
+                    cache.put(path, features)
+            METRICS.count("chroma_decoded", len(missing))
+
+            def correlate(pair):
+                a, b = cache.get(pair[0]), cache.get(pair[1])
+                if a is None or b is None:
+                    return None, 0.0
+                score, lag = cross_correlate(a, b, min_overlap)
+                return score, lag * frame_seconds()
+
+            for (path_a, path_b), (score, offset) in zip(batch, correlate_pool.map(correlate, batch)):
+                yield path_a, path_b, score, offset
+
+
+def tiled_pairs(cluster, block):
+    """
+    按 block × block 的分块生成簇内的全部文件对，每块只涉及不超过 2 × block 个文件，
+    同一块的文件对相邻排列，色度特征缓存不会因簇过大而失效
+    """
+    for i in range(0, len(cluster), block):
+        for j in range(i, len(cluster), block):
+            if i == j:
+                yield from itertools.combinations(cluster[i:i + block], 2)
+            else:
+                yield from itertools.product(cluster[i:i + block], cluster[j:j + block])
+
+
+def cluster_pairs(cluster, max_pairs=64, edges=None):
+    """
+    生成簇内需要验证的文件对
+
+    文件对不超过 max_pairs 的小簇验证全部文件对；大簇在给出 edges 时只验证簇内的候选边（即形成该簇的近邻边，
+    数量与文件数成正比），否则按 max_pairs 大小的分块验证全部文件对
+
+    参数:
+        cluster (list): 簇内的文件路径
+        max_pairs (int): 验证全部文件对的簇大小上限，也决定分块大小
+        edges (list): 候选文件对 [(路径a, 路径b), ...]，可以包含其他簇的文件对
+    """
+    if len(cluster) * (len(cluster) - 1) // 2 <= max_pairs:
+        return list(itertools.combinations(cluster, 2))
+    if edges is not None:
+        members = set(cluster)
+        return [(a, b) for a, b in edges if a in members and b in members]
+    return list(tiled_pairs(cluster, max(2, math.isqrt(max_pairs))))
+
+
+def verify_clusters(clusters, min_score=0.6, workers=None, max_pairs=64, edges=None, **kwargs):
+    """
+    验证聚类结果，只保留互相关分数不低于 min_score 的文件对，按其连通分量重新分簇
+
+    参数:
+        clusters (list): 重复候选簇，每个簇为路径列表
+        min_score (float): 判定为同一录音的最低分数（重叠部分色度的平均余弦相似度）
+        workers (int): 见 verify_pairs
+        max_pairs (int): 见 cluster_pairs
+        edges (list): 形成各簇的候选文件对，见 cluster_pairs
+        **kwargs: 传给 verify_pairs 的其他参数
+
+    返回:
+        tuple: (验证后的簇列表, [(路径a, 路径b, 分数, 偏移秒数), ...])
+    """
+    if edges is not None:
+        # 按簇分组，避免每个大簇都扫描全部候选边
+        cluster_of = {path: index for index, cluster in enumerate(clusters) for path in cluster}
+        grouped = collections.defaultdict(list)
+        for a, b in edges:
+            if a in cluster_of and cluster_of[a] == cluster_of.get(b):
+                grouped[cluster_of[a]].append((a, b))
+        pairs = [pair for index, cluster in enumerate(clusters)
+                 for pair in cluster_pairs(cluster, max_pairs, grouped[index])]
+    else:
+        pairs = [pair for cluster in clusters for pair in cluster_pairs(cluster, max_pairs)]
+    with METRICS.timer("verify"):
+        results = list(tqdm(verify_pairs(pairs, workers, **kwargs), total=len(pairs), desc="Verify"))
+    METRICS.count("pairs_verified", len(results))
+
+    paths = list(dict.fromkeys(itertools.chain.from_iterable(clusters)))
+    position = {path: i for i, path in enumerate(paths)}
+    edges = [(position[a], position[b]) for a, b, score, _ in results if score is not None and score >= min_score]
+    components = connected_components(len(paths), edges)
+    return [[paths[i] for i in component] for component in components if len(component) > 1], results
@@ -0,0 +1,462 @@
+import os
+import json
+import time
+import threading
+import functools
+import concurrent.futures
+from html import escape
+
+from flask import Flask, Response, jsonify, request
+from mutagen import File
+
+from runtime.cache import StatCache
+from ..probe import read_probe, shared_executor
+from .bulk import BulkJob, POLICIES
+
+# 每页的默认簇数和上限
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+html = r"""
+<!DOCTYPE html>
+<html>
+<head>
+    <title>文件管理-WebUI</title>
+    <style>
+        .textshow{
+            padding: 10px;
+            margin: 5px;
+        }
+    </style>
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@4.6.2/dist/css/bootstrap.min.css" integrity="sha384-xOolHFLEh07PJGoPkLv1IbcEPTNtaed2xpHsD9ESMhqIYd0nLMwNLD69Npy4HI+N" crossorigin="anonymous">
+    <script>
+        var page = 0;
+        var pageSize = 20;
+        var linkActions = __LINKS__;
+
+        function formatInfo(info) {
+            if (!info) {
+                return '正在读取...';
+            }
+            if (info.error) {
+                return info.error;
+            }
+            var result = ['文件大小：' + (info.size / 1024 / 1024).toFixed(2) + 'MB'];
+            if (info.title) result.push('标题：' + info.title);
+            if (info.artist) result.push('艺人：' + info.artist);
+            if (info.album) result.push('专辑：' + info.album);
+            if (info.duration) {
+                var minutes = Math.floor(info.duration / 60), seconds = Math.floor(info.duration % 60);
+                result.push('时长：' + String(minutes).padStart(2, '0') + ':' + String(seconds).padStart(2, '0'));
+            }
+            if (info.bitrate) result.push('码率：' + info.bitrate + 'kbps');
+            return result.join('；');
+        }
+
+        function fileCard(path) {
+            var card = document.createElement('div');
+            card.className = 'textshow card';
+            card.onclick = handleClick;
+            var pathText = document.createElement('p');
+            pathText.className = 'path';
+            pathText.textContent = path;
+            var infoText = document.createElement('p');
+            infoText.className = 'info';
+            infoText.textContent = formatInfo(null);
+            var hint = document.createElement('p');
+            hint.textContent = '点击删除此文件';
+            card.append(pathText, infoText, hint);
+            return card;
+        }
+
+        // 先用路径渲染本页，再批量请求元数据填充
+        function loadPage(n) {
+            fetch('/api/clusters?page=' + n + '&size=' + pageSize)
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    page = data.page;
+                    var pages = Math.max(1, Math.ceil(data.total / data.size));
+                    document.getElementById('pager').textContent = '第' + (page + 1) + '/' + pages + '页，共' + data.total + '个簇';
+                    var list = document.getElementById('clusters');
+                    list.innerHTML = '';
+                    var cards = {};
+                    data.clusters.forEach(function (cluster) {
+                        var div = document.createElement('div');
+                        div.className = 'clustershow alert alert-dark shadow p-3 mb-5 rounded';
+                        var label = document.createElement('p');
+                        label.textContent = 'Cluster ' + (cluster.index + 1);
+                        div.append(label);
+                        cluster.files.forEach(function (path) {
+                            cards[path] = fileCard(path);
+                            div.append(cards[path]);
+                        });
+                        list.append(div);
+                    });
+                    window.scrollTo(0, 0);
+                    return fetch('/api/info', {method: 'POST', body: JSON.stringify(Object.keys(cards))})
+                        .then(function (response) { return response.json(); })
+                        .then(function (infos) {
+                            Object.keys(infos).forEach(function (path) {
+                                cards[path].querySelector('.info').textContent = formatInfo(infos[path]);
+                            });
+                        });
+                })
+                .catch(function (error) {
+                    alert('请求失败: ' + error);
+                });
+        }
+
+        function handleClick(event) {
+            var div = event.currentTarget;
+            var path = div.querySelector('.path').textContent;
+            var confirmDialog = confirm('确定要删除文件' + path + '吗？');
+
+            if (confirmDialog) {
+                fetch('/api', {
+                    method: 'POST',
+                    body: path
+                })
+                    .then(function (response) {
+                        if (response.status === 200) {
+                            div.style.display = 'none';
+                        } else {
+                            alert('请求失败');
+                        }
+                    })
+                    .catch(function (error) {
+                        alert('请求失败: ' + error);
+                    });
+            }
+        }
+
+        // 批量操作在服务器后台运行，进度通过 Server-Sent Events 推送
+        function startBulk(dryRun) {
+            var policy = document.getElementById('policy').value;
+            var action = document.getElementById('action').value;
+            if (!dryRun && !confirm('确定要对全部簇执行此操作吗？')) {
+                return;
+            }
+            fetch('/api/bulk', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({policy: policy, action: action, dry_run: dryRun})
+            })
+                .then(function (response) {
+                    return response.json().then(function (data) {
+                        if (response.status !== 202) {
+                            throw data.error;
+                        }
+                        watchBulk(data.id);
+                    });
+                })
+                .catch(function (error) {
+                    alert('请求失败: ' + error);
+                });
+        }
+
+        function watchBulk(id) {
+            var status = document.getElementById('bulkStatus');
+            var source = new EventSource('/api/bulk/' + id + '/events');
+            source.onmessage = function (event) {
+                var data = JSON.parse(event.data);
+                var text = (data.dry_run ? '预览' : '处理') + '：' + data.done + '/' + data.total + '个簇';
+                if (!data.dry_run) {
+                    text += '，' + data.files + '个文件，释放' + (data.freed_bytes / 1024 / 1024).toFixed(2) + 'MB';
+                }
+                if (data.errors.length) {
+                    text += '，' + data.errors.length + '个错误';
+                }
+                status.textContent = text;
+                if (data.status !== 'running') {
+                    source.close();
+                    status.textContent = text + '（' + data.status + '）';
+                    if (data.dry_run) {
+                        showPlan(id);
+                    } else {
+                        loadPage(0);
+                    }
+                }
+            };
+        }
+
+        function showPlan(id) {
+            fetch('/api/bulk/' + id)
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    var lines = data.plan.slice(0, 50).map(function (item) {
+                        return '保留 ' + item.keep + '\n' + item.targets.map(function (path) {
+                            return '    ' + data.action + ' ' + path;
+                        }).join('\n');
+                    });
+                    document.getElementById('bulkPlan').textContent = lines.join('\n');
+                });
+        }
+
+        window.onload = function () {
+            if (!linkActions) {
+                document.querySelectorAll('#action .link').forEach(function (option) { option.remove(); });
+            }
+            loadPage(0);
+        };
+    </script>
+</head>
+<body>
+<div class="container">
+<h1>__TITLE__</h1>
+<div class="my-3 form-inline">
+    <select id="policy" class="form-control mr-2">
+        <option value="highest-bitrate">每簇保留码率最高的文件</option>
+        <option value="shortest-path">每簇保留路径最短的文件</option>
+        <option value="largest">每簇保留最大的文件</option>
+    </select>
+    <select id="action" class="form-control mr-2">
+        <option value="delete">删除其余文件</option>
+        <option class="link" value="hardlink">其余文件替换为硬链接</option>
+        <option class="link" value="reflink">其余文件替换为reflink</option>
+    </select>
+    <button class="btn btn-secondary mr-2" onclick="startBulk(true)">预览</button>
+    <button class="btn btn-danger" onclick="startBulk(false)">批量执行</button>
+</div>
+<p id="bulkStatus"></p>
+<pre id="bulkPlan"></pre>
+<div class="my-3">
+    <button class="btn btn-secondary" onclick="loadPage(page - 1)">上一页</button>
+    <span id="pager" class="mx-3"></span>
+    <button class="btn btn-secondary" onclick="loadPage(page + 1)">下一页</button>
+</div>
+<div id="clusters"></div>
+</div></body></html>
+"""
+
+
+def read_audio_info(musicPath):
+    """
+    读取文件大小和标签信息，时长和码率由 read_probe 从文件头读取
+
+    返回:
+        dict: size、title、artist、album、duration（秒）、bitrate（kbps），读取不到的项为 None
+    """
+    stream = read_probe(musicPath)
+    result = {"size": os.path.getsize(musicPath), "title": None, "artist": None, "album": None,
+              "duration": stream["duration"], "bitrate": stream["bitrate"]}
+    try:
+        audio = File(musicPath)
+    except Exception as e:
+        print(musicPath + str(e))
+        return result
+    # 获取标签信息
+    if audio and audio.tags:
+        tags = audio.tags
+        for key in ("title", "artist", "album"):
+            value = tags.get(key)
+            if value:
+                result[key] = str(value[0])
+    return result
+
+
+class InfoCache:
+    """
+    音频元数据缓存：内存中按 (路径, 修改时间) 做LRU缓存，磁盘上存入 StatCache 的 info 类别，
+    文件变化后自动失效。未缓存的文件在线程池中批量读取。
+
+    参数:
+        executor (concurrent.futures.Executor): 读取元数据的线程池，默认与探测共用 shared_executor()
+        memory_size (int): 内存中缓存的条目数
+    """
+
+    def __init__(self, executor=None, memory_size=4096):
+        self.store = StatCache("info-probe")
+        self.executor = executor or shared_executor()
+        self._prefetching = set()
+        self._lock = threading.Lock()
+        self._cached = functools.lru_cache(maxsize=memory_size)(self._load)
+
+    def _load(self, path, mtime_ns, size):
+        value = self.store.get(path)
+        if value is not None:
+            return json.loads(value)
+        info = read_audio_info(path)
+        self.store.put(path, json.dumps(info, ensure_ascii=False))
+        return info
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return {"error": "文件不存在"}
+        return self._cached(path, st.st_mtime_ns, st.st_size)
+
+    def get_many(self, paths):
+        """
+        并行读取一批文件的元数据
+
+        返回:
+            dict: 路径到元数据的映射
+        """
+        result = dict(zip(paths, self.executor.map(self.get, paths)))
+        self.store.flush()
+        return result
+
+    def prefetch(self, paths):
+        # 在后台预读下一页，不等待结果
+        for path in paths:
+            future = self.executor.submit(self.get, path)
+            with self._lock:
+                self._prefetching.add(future)
+            future.add_done_callback(self._prefetched)
+
+    def _prefetched(self, future):
+        with self._lock:
+            self._prefetching.discard(future)
+
+    def close(self):
+        # 线程池是共享的，不关闭，只等待尚未完成的预读
+        with self._lock:
+            pending = list(self._prefetching)
+        concurrent.futures.wait(pending)
+        self.store.close()
+
+
+def page_bounds(total, page, size):
+    size = max(1, min(size, MAX_PAGE_SIZE))
+    pages = max(1, (total + size - 1) // size)
+    page = max(0, min(page, pages - 1))
+    return page, size, page * size, min(total, (page + 1) * size)
+
+
+def create_app(duplicateList, title, info_cache, links=False):
+    """
+    构建Web界面：页面只包含框架，簇列表通过分页的JSON接口获取，元数据由浏览器按页批量请求
+
+    接口:
+        GET /api/clusters?page=0&size=20: {"total", "page", "size", "clusters": [{"index", "files"}]}
+        POST /api/info: 请求体为路径的JSON数组，返回路径到元数据的映射，不在当前结果中的路径被忽略
+        POST /api: 请求体为路径，删除该文件并从结果中去掉
+        POST /api/bulk: 请求体为 {"policy", "action", "dry_run"}，在后台对全部簇执行批量操作，返回 {"id"}
+        GET /api/bulk/<id>: 批量操作的进度和每个簇的处理计划
+        GET /api/bulk/<id>/events: 以 Server-Sent Events 推送进度，结束后关闭
+        POST /api/bulk/<id>/cancel: 处理完当前簇后停止
+
+    参数:
+        links (bool): 是否允许硬链接和 reflink，只应对按文件内容哈希得到的簇开启
+    """
+    app = Flask(__name__)
+    page_html = html.replace("__TITLE__", escape(title)).replace("__LINKS__", json.dumps(links))
+    # 只允许读取和删除当前结果中列出的文件
+    known_paths = {path for cluster in duplicateList for path in cluster}
+    actions = ("delete", "hardlink", "reflink") if links else ("delete",)
+    jobs = {}
+    lock = threading.Lock()
+
+    def prune(removed):
+        # 从结果中去掉已删除的文件，不再构成重复的簇一并去掉
+        with lock:
+            duplicateList[:] = [cluster for cluster in
+                                ([path for path in cluster if path not in removed] for cluster in duplicateList)
+                                if len(cluster) > 1]
+            known_paths.intersection_update(path for cluster in duplicateList for path in cluster)
+
+    def remove_processed(job):
+        if job.action == "delete" and job.processed:
+            prune(set(job.processed))
+
+    @app.route('/')
+    def index():
+        return page_html
+
+    @app.route('/api/clusters')
+    def clusters():
+        with lock:
+            page, size, start, end = page_bounds(len(duplicateList), request.args.get('page', 0, type=int),
+                                                 request.args.get('size', PAGE_SIZE, type=int))
+            next_page = [path for cluster in duplicateList[end:end + size] for path in cluster]
+            result = {
+                "total": len(duplicateList),
+                "page": page,
+                "size": size,
+                "clusters": [{"index": i, "files": list(duplicateList[i])} for i in range(start, end)],
+            }
+        # 预读下一页的元数据，翻页时无需等待
+        info_cache.prefetch(next_page)
+        return jsonify(result)
+
+    @app.route('/api/info', methods=['POST'])
+    def info():
+        paths = json.loads(request.get_data(as_text=True) or "[]")
+        if not isinstance(paths, list):
+            return jsonify({"error": "请求体应为路径数组"}), 400
+        with lock:
+            paths = [path for path in paths if isinstance(path, str) and path in known_paths]
+        return jsonify(info_cache.get_many(paths))
+
+    @app.route('/api', methods=['POST'])
+    def delete_file():
+        file_path = request.get_data(as_text=True)  # 获取请求中的文本内容
+        if file_path not in known_paths:
+            return '文件不在查重结果中', 403
+        try:
+            os.remove(file_path)  # 尝试删除文件
+            prune({file_path})
+            return '', 200  # 返回状态码 200 表示删除成功
+        except Exception as e:
+            return str(e), 500  # 返回状态码 500 表示删除失败，并返回错误信息
+
+    @app.route('/api/bulk', methods=['POST'])
+    def bulk():
+        options = request.get_json(silent=True) or {}
+        policy, action = options.get("policy", "highest-bitrate"), options.get("action", "delete")
+        if policy not in POLICIES:
+            return jsonify({"error": f"不支持的保留策略：{policy}"}), 400
+        if action not in actions:
+            return jsonify({"error": f"不支持的操作：{action}"}), 400
+        with lock:
+            if any(not job.finished for job in jobs.values()):
+                return jsonify({"error": "已有批量操作正在运行"}), 409
+            job_id = len(jobs) + 1
+            jobs[job_id] = BulkJob([list(cluster) for cluster in duplicateList], policy, action, info_cache,
+                                   dry_run=bool(options.get("dry_run")), on_finish=remove_processed).start()
+        return jsonify({"id": job_id}), 202
+
+    @app.route('/api/bulk/<int:job_id>')
+    def bulk_status(job_id):
+        if job_id not in jobs:
+            return jsonify({"error": "任务不存在"}), 404
+        return jsonify(jobs[job_id].snapshot(plan=True))
+
+    @app.route('/api/bulk/<int:job_id>/events')
+    def bulk_events(job_id):
+        if job_id not in jobs:
+            return jsonify({"error": "任务不存在"}), 404
+        job = jobs[job_id]
+
+        def stream():
+            last = None
+            while True:
+                finished = job.finished
+                snapshot = job.snapshot()
+                if snapshot != last:
+                    yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+                    last = snapshot
+                if finished:
+                    return
+                time.sleep(0.5)
+
+        return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @app.route('/api/bulk/<int:job_id>/cancel', methods=['POST'])
+    def bulk_cancel(job_id):
+        if job_id not in jobs:
+            return jsonify({"error": "任务不存在"}), 404
+        jobs[job_id].cancel()
+        return '', 200
+
+    return app
+
+
+def serve(duplicateList, title, links=False):
+    print("即将启动Flask服务器，默认访问地址为http://127.0.0.1:5000\n可通过 Ctrl+C 结束服务器")
+    info_cache = InfoCache()
+    try:
+        create_app(list(duplicateList), title, info_cache, links).run()
+    finally:
+        info_cache.close()
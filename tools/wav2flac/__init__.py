@@ -1,11 +1,9 @@
 import os
-import re
-
-import subprocess
 
 from runtime import COLOR as color
-from runtime import VAL as val
 from .. import check_ffmpeg
+from .. import scanner
+from .scheduler import Job, Scheduler, load_settings, output_path, print_summary
 
 
 def main():
@@ -14,6 +12,9 @@ def main():
     if not check_ffmpeg.is_ffmpeg_available():
         print(f"{color.red}ffmpeg命令不可用。\n请前往 https://ffmpeg.org 安装FFmpeg{color.end}")
         return
+    if not check_ffmpeg.has_encoder("flac"):
+        print(f"{color.red}当前ffmpeg不支持FLAC编码{color.end}")
+        return
     print(
         "此功能需要ffmpeg\n- 程序会自动遍历子目录下的所有WAV文件\n- 转换为FLAC后，新路径中保留目录结构\n- 输出目录留空，代表在原地转码")
     print(f"此功能支持自动识别并转换{"/".join(extensions)}文件")
@@ -27,34 +28,27 @@ def main():
         return
 
     # 遍历input_dir下的所有wav文件
-    wav_files = []
-    succeed_list = []
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.lower().endswith(extensions):
-                input_file = os.path.join(root, file)
-                output_file = os.path.join(output_dir,
-                                           os.path.relpath(os.path.join(root, file), input_dir))
-                real_output_file = re.sub(r'\.wav$', '.flac', output_file, flags=re.IGNORECASE)
-                wav_files.append([input_file, real_output_file])
+    jobs = [Job(entry.path, output_path(entry.path, input_dir, output_dir))
+            for entry in scanner.scan(input_dir, extensions)]
 
-    if len(wav_files) == 0:
+    if len(jobs) == 0:
         print(f"{color.red}指定目录下未找到WAV文件{color.end}")
         return
 
-    print(f"{color.green}已获取{len(wav_files)}个WAV文件，开始转换{color.end}")
-
-    for obj in wav_files:
-        command = [val.ffmpeg, "-i", obj[0], "-c:a", "flac", "-compression_level", "8", "-write_id3v2", "1", "-y", obj[1]]
-        print(command)
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode == 0:
-            print(f"{color.bg_green}File {obj[1]} transcode successfully{color.end}")
-            succeed_list.append(obj[0])
-        else:
-            print(f"{color.red}{obj[0]}Error! ffmpeg abort with code {result.returncode}{color.end}")
-
-    del_det = input("是否删除成功转换的文件(Y/N :N)")
+    verify_det = input("是否在转换后校验FLAC文件与源文件的PCM数据一致(Y/N :Y)")
+    verify = not verify_det or verify_det in "Yy"
+    # 使用性能测试保存的压缩等级和进程数，未保存时为等级8、CPU核心数
+    scheduler = Scheduler(verify=verify, **load_settings())
+    print(f"{color.green}已获取{len(jobs)}个WAV文件，以压缩等级{scheduler.level}、{scheduler.jobs}个进程开始转换{color.end}")
+    result = scheduler.run(jobs)
+    print_summary(result)
+
+    # 只删除本次转换的源文件，开启校验时还需通过校验；之前已转换而跳过的文件不再询问
+    converted = set(result.converted)
+    succeed_list = [job.source for job in (result.verified if verify else result.converted) if job in converted]
+    if not succeed_list:
+        return
+    del_det = input(f"是否删除{'通过校验' if verify else '成功转换'}的{len(succeed_list)}个源文件(Y/N :N)")
     if del_det and del_det in "Yy":
         for file in succeed_list:
             os.remove(file)
@@ -0,0 +1,139 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import concurrent.futures
+from collections import namedtuple
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，不统计CPU时间
+    resource = None
+
+from .. import scanner
+from .scheduler import ffmpeg_command, save_settings
+
+EXTENSIONS = (".wav", ".wmv", ".aac")
+
+Measurement = namedtuple("Measurement", ["level", "workers", "seconds", "cpu_seconds", "input_bytes", "output_bytes"])
+
+
+def sample_files(input_dir, count, seed=0):
+    """
+    从目录中随机抽取 count 个待转换的文件
+    """
+    files = scanner.scan_files(input_dir, EXTENSIONS)
+    if len(files) <= count:
+        return files
+    return sorted(random.Random(seed).sample(files, count))
+
+
+def children_cpu_seconds():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def encode(source, output, level):
+    subprocess.run(ffmpeg_command(source, output, level), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=True)
+    return os.path.getsize(output)
+
+
+def measure(files, level, workers, temp_dir):
+    """
+    以给定的压缩等级和并行数转换全部样本文件，测量耗时、子进程CPU时间和输出大小
+    """
+    outputs = [os.path.join(temp_dir, f"{i}.flac") for i in range(len(files))]
+    cpu_start = children_cpu_seconds()
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        output_bytes = sum(executor.map(encode, files, outputs, [level] * len(files)))
+    seconds = time.perf_counter() - start
+    cpu_end = children_cpu_seconds()
+    cpu_seconds = None if cpu_start is None else cpu_end - cpu_start
+    input_bytes = sum(os.path.getsize(file) for file in files)
+    return Measurement(level, workers, seconds, cpu_seconds, input_bytes, output_bytes)
+
+
+def worker_counts(max_workers=None):
+    # 1, 2, 4, ... 直到CPU核心数
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    return counts + [max_workers]
+
+
+def recommend(measurements, size_tolerance=0.005):
+    """
+    在输出大小不超过最小值 (1 + size_tolerance) 倍的组合中，选择吞吐量最高的一个
+
+    返回:
+        Measurement: 推荐的组合
+    """
+    best_size = min(m.output_bytes for m in measurements)
+    candidates = [m for m in measurements if m.output_bytes <= best_size * (1 + size_tolerance)]
+    return max(candidates, key=lambda m: m.input_bytes / m.seconds)
+
+
+def benchmark(input_dir, count=20, levels=range(13), workers=None, size_tolerance=0.005, seed=0):
+    """
+    对抽样的文件逐一测试每个压缩等级和并行数的组合，输出吞吐量、CPU时间和输出大小
+
+    参数:
+        input_dir (str): 待转换的音乐文件目录
+        count (int): 抽样文件数
+        levels (iterable): 测试的压缩等级，ffmpeg 支持0~12，其中9~12使用更高的预测阶数，部分硬件播放器可能不支持
+        workers (list): 测试的并行数，默认为 1, 2, 4, ... 直到CPU核心数
+        size_tolerance (float): 允许比最小输出大出的比例，默认为0.5%
+        seed (int): 抽样的随机种子
+
+    返回:
+        tuple: (全部测量结果, 推荐的组合)，没有可转换的文件时返回 ([], None)
+    """
+    files = sample_files(input_dir, count, seed)
+    if not files:
+        return [], None
+    workers = workers or worker_counts()
+    total_mb = sum(os.path.getsize(file) for file in files) / 1024 / 1024
+    print(f"样本：{len(files)}个文件，共{total_mb:.1f}MB")
+    print(f"{'等级':>4} {'并行数':>6} {'MB/s':>8} {'CPU(s)':>8} {'输出(MB)':>10} {'压缩率':>8}")
+
+    measurements = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for level in levels:
+            for n in workers:
+                m = measure(files, level, n, temp_dir)
+                measurements.append(m)
+                cpu = "-" if m.cpu_seconds is None else f"{m.cpu_seconds:.1f}"
+                print(f"{level:>4} {n:>6} {m.input_bytes / 1024 / 1024 / m.seconds:>8.1f} {cpu:>8} "
+                      f"{m.output_bytes / 1024 / 1024:>10.2f} {m.output_bytes / m.input_bytes:>8.2%}")
+
+    best = recommend(measurements, size_tolerance)
+    print(f"推荐：压缩等级{best.level}，{best.workers}个进程"
+          f"（{best.input_bytes / 1024 / 1024 / best.seconds:.1f}MB/s，输出大小不超过最小值的{1 + size_tolerance:.1%}）")
+    return measurements, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FLAC转码性能测试与参数选择")
+    parser.add_argument("input_dir")
+    parser.add_argument("--count", type=int, default=20, help="抽样文件数")
+    parser.add_argument("--levels", type=int, nargs="+", default=list(range(13)))
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    parser.add_argument("--size-tolerance", type=float, default=0.005,
+                        help="允许比最小输出大出的比例，例如0.005表示在最小输出的0.5%%以内选择吞吐量最高的组合")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--apply", action="store_true", help="保存推荐的参数，之后的转换默认使用")
+    args = parser.parse_args()
+    _, best = benchmark(args.input_dir, args.count, args.levels, args.workers, args.size_tolerance, args.seed)
+    if best is not None and args.apply:
+        save_settings(best.level, best.workers)
+        print("已保存推荐参数")
@@ -0,0 +1,302 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+import concurrent.futures
+from collections import namedtuple
+
+from tqdm import tqdm
+
+from runtime import COLOR as color
+from runtime import VAL as val
+from runtime.cache import StatCache
+from runtime.metrics import METRICS
+from ..audio.formats import flac_streaminfo, wav_info
+from ..audio.pcm import iter_pcm
+
+SETTINGS_FILE = "wav2flac.json"
+
+Job = namedtuple("Job", ["source", "output"])
+TranscodeResult = namedtuple("TranscodeResult", ["converted", "skipped", "failed", "verified", "mismatched"])
+
+# 临时输出文件的后缀，转码完成后重命名为正式文件名
+PART_SUFFIX = ".part"
+# FLAC 位深对应的 ffmpeg PCM 输出格式，STREAMINFO 中的 MD5 按该格式的交错采样计算
+VERIFY_FORMATS = {
+    16: "s16le",
+    24: "s24le",
+    32: "s32le",
+}
+
+
+def load_settings():
+    """
+    读取 VAL.config_path 下保存的转码参数（由性能测试的 --apply 写入）
+
+    返回:
+        dict: 可能包含 level 和 jobs，未保存时为空
+    """
+    path = os.path.join(val.config_path, SETTINGS_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {key: settings[key] for key in ("level", "jobs") if isinstance(settings.get(key), int)}
+
+
+def save_settings(level, jobs):
+    with open(os.path.join(val.config_path, SETTINGS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"level": level, "jobs": jobs}, f)
+
+
+def output_path(input_file, input_dir, output_dir):
+    """
+    返回输入文件对应的FLAC输出路径，在输出目录中保留相对目录结构
+    """
+    output_file = os.path.join(output_dir, os.path.relpath(input_file, input_dir))
+    return os.path.splitext(output_file)[0] + ".flac"
+
+
+def ffmpeg_command(source, output, level=8):
+    # -nostdin：并行运行时 ffmpeg 不读取终端输入；临时文件名不是 .flac 结尾，需要 -f 指定格式
+    return [val.ffmpeg, "-nostdin", "-v", "error", "-progress", "pipe:1", "-i", source, "-c:a", "flac",
+            "-compression_level", str(level), "-write_id3v2", "1", "-f", "flac", "-y", output]
+
+
+def byte_rate(source):
+    """
+    返回WAV文件每秒的数据字节数，用于把 ffmpeg 报告的转码进度换算为已处理的字节数；其他格式返回 None
+    """
+    try:
+        info = wav_info(source)
+    except OSError:
+        return None
+    if info is None:
+        return None
+    return info["sample_rate"] * info["block_align"]
+
+
+def source_size(source):
+    """
+    返回源文件大小，用于进度条总量；无法读取时返回 0，由转码时报告错误
+    """
+    try:
+        return os.path.getsize(source)
+    except OSError:
+        return 0
+
+
+def manifest_value(job, level, verified=False):
+    st = os.stat(job.output)
+    return f"{job.output}\t{st.st_size}\t{st.st_mtime_ns}\t{level}\t{int(verified)}"
+
+
+def manifest_state(job, manifest, level):
+    """
+    判断输出是否为最新：源文件自上次转码后未变化，且输出文件仍是上次写入的文件
+
+    返回:
+        tuple: (是否为最新, 是否已通过校验)
+    """
+    value = manifest.get(job.source)
+    if value is None:
+        return False, False
+    try:
+        expected = manifest_value(job, level)
+    except OSError:
+        return False, False
+    # 最后一列为校验标记
+    if value.rsplit("\t", 1)[0] != expected.rsplit("\t", 1)[0]:
+        return False, False
+    return True, value.endswith("\t1")
+
+
+def verify_transcode(job):
+    """
+    解码源文件并计算PCM数据的MD5，与FLAC编码器写入 STREAMINFO 的MD5比较，无需再解码FLAC文件
+
+    返回:
+        tuple: (任务, 错误信息)，校验通过时错误信息为 None
+    """
+    try:
+        info = flac_streaminfo(job.output)
+        if info is None:
+            return job, "输出不是有效的FLAC文件"
+        if info["md5"] is None:
+            return job, "FLAC文件未记录MD5"
+        sample_fmt = VERIFY_FORMATS.get(info["bits_per_sample"])
+        if sample_fmt is None:
+            return job, f"不支持校验{info['bits_per_sample']}位采样"
+        hasher = hashlib.md5()
+        size = 0
+        with METRICS.timer("verify"):
+            for block in iter_pcm(job.source, sample_fmt=sample_fmt):
+                hasher.update(block)
+                size += len(block)
+        METRICS.count("bytes_hashed", size, stage="verify")
+    except (OSError, subprocess.CalledProcessError) as e:
+        return job, f"解码源文件失败：{e}"
+    if hasher.hexdigest() != info["md5"]:
+        return job, "源文件解码后的PCM与FLAC记录的MD5不一致"
+    return job, None
+
+
+class Scheduler:
+    """
+    并行运行 ffmpeg 转码任务，并显示按源文件字节数汇总的进度
+
+    每个任务先写入与输出同目录的临时文件，成功后重命名，中断时不会留下不完整的FLAC文件。
+    转码成功的任务按源文件状态记入 VAL.cache_path 下的 StatCache 清单，
+    再次运行时源文件和输出文件都未变化的任务直接跳过。失败的任务重试一次。
+
+    开启校验时，每个任务转码完成后立即在另一个线程池中解码源文件并与 STREAMINFO 中的MD5比较，
+    与其余的转码任务同时进行；跳过的任务如果此前未校验过，也会补充校验。
+
+    参数:
+        jobs (int): 同时运行的 ffmpeg 进程数，默认为CPU核心数
+        level (int): FLAC 压缩等级，默认为8
+        retries (int): 失败后的重试次数，默认为1
+        verify (bool): 是否校验转码结果
+        verify_jobs (int): 同时运行的校验数，默认与 jobs 相同
+    """
+
+    def __init__(self, jobs=None, level=8, retries=1, verify=False, verify_jobs=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.level = level
+        self.retries = retries
+        self.verify = verify
+        self.verify_jobs = verify_jobs or self.jobs
+        self._lock = threading.Lock()
+        self._progress = None
+
+    def _advance(self, n):
+        with self._lock:
+            self._progress.update(n)
+
+    def encode(self, job):
+        """
+        转码单个文件，写入临时文件后重命名
+
+        返回:
+            str | None: 失败时返回错误信息，成功时返回 None
+        """
+        temp_output = job.output + PART_SUFFIX
+        reported = 0
+        try:
+            # 源文件在扫描后被删除或无法读取时只记为该任务失败
+            os.makedirs(os.path.dirname(job.output) or ".", exist_ok=True)
+            size = os.path.getsize(job.source)
+            rate = byte_rate(job.source)
+            with METRICS.timer("subprocess", tool="ffmpeg"), \
+                    subprocess.Popen(ffmpeg_command(job.source, temp_output, self.level), stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, text=True) as proc:
+                # 按 ffmpeg 的 -progress 输出实时推进进度条
+                for line in proc.stdout:
+                    if rate and line.startswith("out_time_us="):
+                        value = line.split("=", 1)[1].strip()
+                        if value.isdigit():
+                            done = min(int(value) * rate // 1_000_000, size)
+                            if done > reported:
+                                self._advance(done - reported)
+                                reported = done
+                error = proc.stderr.read()
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=error)
+            os.replace(temp_output, job.output)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self._advance(-reported)
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+            if isinstance(e, subprocess.CalledProcessError):
+                return f"ffmpeg abort with code {e.returncode}: {(e.stderr or '').strip()[-500:]}"
+            return str(e)
+        self._advance(size - reported)
+        METRICS.count("bytes_encoded", size)
+        return None
+
+    def run_job(self, job):
+        error = None
+        for _ in range(self.retries + 1):
+            error = self.encode(job)
+            if error is None:
+                break
+        return job, error
+
+    def run(self, jobs, on_done=None):
+        """
+        运行全部转码任务
+
+        参数:
+            jobs (list): Job(源文件, 输出文件) 列表
+            on_done (callable): 每个任务在本次运行中转码成功后（开启校验时为通过校验后）在主线程中调用 on_done(job)
+
+        返回:
+            TranscodeResult: (本次转码成功的任务, 已是最新而跳过的任务, [(转码失败的任务, 错误信息), ...],
+            输出已通过校验的任务, [(校验未通过的任务, 错误信息), ...])
+        """
+        converted, skipped, failed, verified, mismatched = [], [], [], [], []
+        with StatCache("wav2flac") as manifest:
+            pending, unverified = [], []
+            for job in jobs:
+                up_to_date, checked = manifest_state(job, manifest, self.level)
+                if not up_to_date:
+                    pending.append(job)
+                    continue
+                skipped.append(job)
+                if checked:
+                    verified.append(job)
+                elif self.verify:
+                    unverified.append(job)
+
+            total = sum(source_size(job.source) for job in pending)
+            with tqdm(total=total, unit="B", unit_scale=True, unit_divisor=1024, desc="FLAC") as self._progress, \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as encode_pool, \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=self.verify_jobs) as verify_pool:
+                futures = {encode_pool.submit(self.run_job, job): "encode" for job in pending}
+                # 之前已转换、本次只补做校验的任务记为 recheck，不算本次完成
+                futures.update((verify_pool.submit(verify_transcode, job), "recheck") for job in unverified)
+                # 转码和校验的结果都在主线程中处理，清单只在主线程中写入
+                while futures:
+                    done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        kind = futures.pop(future)
+                        job, error = future.result()
+                        if kind == "encode" and error is not None:
+                            failed.append((job, error))
+                        elif kind == "encode":
+                            converted.append(job)
+                            manifest.put(job.source, manifest_value(job, self.level))
+                            if self.verify:
+                                futures[verify_pool.submit(verify_transcode, job)] = "verify"
+                            elif on_done is not None:
+                                on_done(job)
+                        elif error is not None:
+                            mismatched.append((job, error))
+                        else:
+                            verified.append(job)
+                            manifest.put(job.source, manifest_value(job, self.level, verified=True))
+                            if on_done is not None and kind == "verify":
+                                on_done(job)
+            self._progress = None
+        for name, items in (("converted", converted), ("skipped", skipped), ("failed", failed),
+                            ("verified", verified), ("mismatched", mismatched)):
+            METRICS.count("transcodes", len(items), result=name)
+        return TranscodeResult(converted, skipped, failed, verified, mismatched)
+
+
+def print_summary(result):
+    """
+    输出转码结果汇总
+    """
+    print(f"{color.green}转换成功{len(result.converted)}个，已是最新而跳过{len(result.skipped)}个，"
+          f"失败{len(result.failed)}个{color.end}")
+    for job, error in result.failed:
+        print(f"{color.red}{job.source}\n    {error}{color.end}")
+    if result.verified or result.mismatched:
+        print(f"{color.green}校验通过{len(result.verified)}个，未通过{len(result.mismatched)}个{color.end}")
+    for job, error in result.mismatched:
+        print(f"{color.red}{job.output}\n    {error}{color.end}")